@@ -0,0 +1,217 @@
+"""
+Spending anomaly detection over the month x category spend matrix.
+
+The matrix comes from the budget_usage monthly counters (one GROUP BY, no
+transaction scan). Every cell is compared with the category's own history:
+
+- rolling robust z-score: distance from the median of the previous WINDOW
+  months in units of the scaled median absolute deviation (MAD);
+- seasonality-adjusted z-score: the same distance from the rolling median
+  plus the category's usual excess for that calendar month in earlier years,
+  so a yearly insurance premium is only reported the first time.
+
+A cell is an anomaly when both scores pass the threshold. All categories and
+months are scored together with NumPy (sliding windows + sort-based
+medians), which keeps ten years x hundreds of categories in the milliseconds.
+analyze() keeps the scored matrix per user until the budget_usage rows
+change, so reruns only pay for reading the counters.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import database as db
+
+# Transaction types counted as spending
+SPEND_TYPES = ('Expense', 'Vehicle', 'Subscriptions', 'Banking')
+
+# Months of history a cell is compared with, and the least history needed at all
+WINDOW = 12
+MIN_HISTORY = 6
+
+# |z| at which a month is reported (3.5 is the usual cut-off for MAD based scores)
+THRESHOLD = 3.5
+
+# MAD of normally distributed data times this estimates the standard deviation
+_MAD_SCALE = 1.4826
+
+# Scored matrices kept by analyze(), least recently used dropped first
+ANALYSIS_CACHE_SIZE = 64
+
+_analysis_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _read_usage(user_id: int, types=SPEND_TYPES) -> pd.DataFrame:
+    """The user's budget_usage counters for types, one row per month, type, category and currency"""
+    conn = db.get_connection(user_id)
+    usage = pd.read_sql_query(f'''
+        SELECT month, type, category, currency, SUM(spent) AS spent
+        FROM budget_usage
+        WHERE user_id = ? AND type IN ({', '.join('?' for _ in types)})
+        GROUP BY month, type, category, currency
+    ''', conn, params=[user_id, *types])
+    conn.close()
+    return usage
+
+def spend_matrix(user_id: int, types=SPEND_TYPES, usage: pd.DataFrame = None):
+    """(months, labels, values): month strings, a (type, category) frame and a months x categories array.
+
+    Months run without gaps from the first spend to the current month, in the
+    user's currency; missing cells are 0. usage: counters already read with _read_usage.
+    """
+    if usage is None:
+        usage = _read_usage(user_id, types)
+    empty = ([], pd.DataFrame(columns=['type', 'category']), np.zeros((0, 0)))
+    if usage.empty:
+        return empty
+
+    foreign = usage['currency'] != ''
+    if foreign.any():
+        base = db.get_user_currency(user_id)
+        usage.loc[foreign, 'spent'] = db.convert_amounts(
+            usage.loc[foreign, 'spent'], usage.loc[foreign, 'currency'], usage.loc[foreign, 'month'] + '-01', base, base)
+
+    grid = usage.pivot_table(index='month', columns=['type', 'category'], values='spent', aggfunc='sum', fill_value=0.0)
+    months = pd.period_range(grid.index.min(), max(grid.index.max(), pd.Timestamp.today().strftime('%Y-%m')), freq='M')
+    grid = grid.reindex(months.strftime('%Y-%m'), fill_value=0.0)
+    labels = grid.columns.to_frame(index=False)
+    return list(grid.index), labels, np.nan_to_num(grid.to_numpy(dtype=np.float64))
+
+def _nanmedian(stack: np.ndarray) -> np.ndarray:
+    """Median along axis 0 ignoring NaN (NaN where nothing is left).
+
+    Sorting once and picking the middle is several times faster than
+    np.median / np.nanmedian on these (short axis, wide) stacks.
+    """
+    ordered = np.sort(stack, axis=0)  # NaN sorts last
+    count = np.sum(~np.isnan(stack), axis=0)
+    low = np.take_along_axis(ordered, (np.maximum(count - 1, 0) // 2)[None], axis=0)[0]
+    high = np.take_along_axis(ordered, (count // 2)[None], axis=0)[0]
+    return np.where(count > 0, (low + high) / 2, np.nan)
+
+def robust_zscores(values: np.ndarray, window: int = WINDOW, min_scale: float = 1.0):
+    """Rolling median, robust scale and z-score of every cell against the previous window rows.
+
+    values is months x categories; rows without a full window get NaN.
+    """
+    median = np.full(values.shape, np.nan)
+    scale = np.full(values.shape, np.nan)
+    if values.shape[0] <= window:
+        return median, scale, np.full(values.shape, np.nan)
+
+    # (months - window, categories, window): the window preceding each scored month, moved to axis 0
+    windows = np.moveaxis(np.lib.stride_tricks.sliding_window_view(values, window, axis=0)[:-1], -1, 0)
+    med = _nanmedian(windows)
+    mad = _nanmedian(np.abs(windows - med))
+    median[window:] = med
+    # Flat histories have MAD 0: fall back to 10% of the level, and never below min_scale
+    scale[window:] = np.maximum(np.maximum(_MAD_SCALE * mad, 0.1 * np.abs(med)), min_scale)
+    return median, scale, (values - median) / scale
+
+def seasonal_offsets(values: np.ndarray, median: np.ndarray) -> np.ndarray:
+    """Per cell, the median of (spend - rolling median) in the same calendar month of earlier years (0 without history).
+
+    Additive, so categories that are usually 0 (a yearly premium) get their
+    season too.
+    """
+    residual = values - median
+    years = (values.shape[0] - 1) // 12
+    if years < 1:
+        return np.zeros(values.shape)
+    lagged = np.full((years,) + values.shape, np.nan)
+    for k in range(1, years + 1):
+        lagged[k - 1, 12 * k:] = residual[:-12 * k]
+    return np.nan_to_num(_nanmedian(lagged))
+
+def score(values: np.ndarray, window: int = WINDOW) -> dict:
+    """All scores for a months x categories matrix (NumPy arrays of the same shape)"""
+    window = min(window, values.shape[0] - 1)
+    if window < MIN_HISTORY:
+        nan = np.full(values.shape, np.nan)
+        return {'expected': nan, 'z': nan, 'seasonal_z': nan}
+    # Deviations smaller than 1% of a typical month's total spend are noise
+    min_scale = max(1.0, 0.01 * float(np.median(values.sum(axis=1))))
+    median, scale, z = robust_zscores(values, window, min_scale)
+    expected = median + seasonal_offsets(values, median)
+    return {'expected': expected, 'z': z, 'seasonal_z': (values - expected) / scale}
+
+def _usage_marker(user_id: int, usage: pd.DataFrame, window: int) -> tuple:
+    """Everything the scored matrix depends on: the counters, currency, FX rates, current month and window"""
+    marker = [user_id, window, pd.Timestamp.today().strftime('%Y-%m'), db.get_user_currency(user_id),
+              int(pd.util.hash_pandas_object(usage, index=False).sum())]
+    if (usage['currency'] != '').any():
+        marker.append(int(pd.util.hash_pandas_object(db.get_fx_rates(), index=False).sum()))
+    return tuple(marker)
+
+def analyze(user_id: int, window: int = WINDOW) -> dict:
+    """Spend matrix and scores: months, labels, values, expected, z, seasonal_z.
+
+    Reads the budget_usage counters (one query) and reuses the last result
+    while they are unchanged. The returned dict is shared: do not modify it.
+    """
+    usage = _read_usage(user_id)
+    key = _usage_marker(user_id, usage, window)
+    with _cache_lock:
+        analysis = _analysis_cache.get(key)
+        if analysis is not None:
+            _analysis_cache.move_to_end(key)
+            return analysis
+
+    months, labels, values = spend_matrix(user_id, usage=usage)
+    analysis = {'months': months, 'labels': labels, 'values': values}
+    if months:
+        analysis.update(score(values, window))
+
+    with _cache_lock:
+        # One entry per user: older markers of the same user are stale
+        for stale in [k for k in _analysis_cache if k[0] == user_id]:
+            del _analysis_cache[stale]
+        _analysis_cache[key] = analysis
+        while len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return analysis
+
+def detect_anomalies(user_id: int, recent_months: int = 3, threshold: float = THRESHOLD,
+                     window: int = WINDOW, analysis: dict = None) -> pd.DataFrame:
+    """Anomalous category months among the last recent_months, largest deviation first.
+
+    Columns: month, type, category, amount, expected, z, seasonal_z, direction
+    ('spike' or 'drop'). The current month is still running, so it can only spike.
+    analysis: result of analyze() already fetched during this rerun.
+    """
+    columns = ['month', 'type', 'category', 'amount', 'expected', 'z', 'seasonal_z', 'direction']
+    analysis = analysis or analyze(user_id, window)
+    months, labels, values = analysis['months'], analysis['labels'], analysis['values']
+    if not months:
+        return pd.DataFrame(columns=columns)
+
+    z, seasonal_z = analysis['z'], analysis['seasonal_z']
+    flagged = (np.abs(z) >= threshold) & (np.abs(seasonal_z) >= threshold) & (np.sign(z) == np.sign(seasonal_z))
+    flagged[:-recent_months] = False
+    flagged[-1] &= z[-1] > 0
+    rows, cols = np.nonzero(flagged)
+    if len(rows) == 0:
+        return pd.DataFrame(columns=columns)
+
+    result = pd.DataFrame({
+        'month': np.asarray(months)[rows],
+        'type': labels['type'].to_numpy()[cols],
+        'category': labels['category'].to_numpy()[cols],
+        'amount': values[rows, cols],
+        'expected': analysis['expected'][rows, cols],
+        'z': z[rows, cols],
+        'seasonal_z': seasonal_z[rows, cols],
+    })
+    result['direction'] = np.where(result['z'] > 0, 'spike', 'drop')
+    return result.reindex(result['seasonal_z'].abs().sort_values(ascending=False).index)[columns].reset_index(drop=True)
+
+def zscore_frame(user_id: int, last_months: int = 24, window: int = WINDOW, analysis: dict = None) -> pd.DataFrame:
+    """Seasonality-adjusted z-scores as a months x 'type · category' frame (for a heatmap)"""
+    analysis = analysis or analyze(user_id, window)
+    months, labels = analysis['months'], analysis['labels']
+    if not months:
+        return pd.DataFrame()
+    names = (labels['type'].astype(str) + ' · ' + labels['category'].astype(str)).tolist()
+    return pd.DataFrame(analysis['seasonal_z'], index=months, columns=names).iloc[-last_months:]
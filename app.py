@@ -6,8 +6,13 @@ import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
 
+import anomalies
+import autocomplete
+import categorizer
+import chart_utils as charts
 import database as db
 import finance_utils as utils
+import scheduler
 
 # Page config
 st.set_page_config(
@@ -79,11 +84,29 @@ st.markdown("""
 # Initialize database
 db.init_db()
 
+# Integrity: quick_check once per server process, full check in the background
+@st.cache_resource
+def startup_integrity_check():
+    return db.run_integrity_check()
+
+startup_integrity_check()
+
+# Recurring items: post due occurrences once per server process, then keep posting in the background
+@st.cache_resource
+def startup_recurring_scheduler():
+    posted = scheduler.run_scheduler()
+    scheduler.start_background_scheduler()
+    return posted
+
+startup_recurring_scheduler()
+
 # Automatic Backup on Startup
 if 'backup_status' not in st.session_state:
+    db.schedule_full_integrity_check()
     st.session_state.backup_status = db.perform_backup()
 
-if "CRITICAL" in st.session_state.backup_status:
+# Cached verdict (updated when the background full check finishes)
+if not db.get_integrity_status()['ok']:
     st.sidebar.error("🚨 DATABASE CORRUPTION DETECTED! Backup aborted. Contact support.")
 
 # Session State for Authentication
@@ -225,7 +248,7 @@ components.html(
 
 page = st.sidebar.radio(
     "Navigate",
-    ["📊 Dashboard", "💼 Portfolio", "➕ Add Transaction", "🔄 Recurring Items", "📋 View Transactions", "💸 Debt Views", "🏷️ Categories", "📈 Analytics", "👤 Profile", "⚙️ Settings"]
+    ["📊 Dashboard", "💼 Portfolio", "➕ Add Transaction", "🔄 Recurring Items", "📋 View Transactions", "💸 Debt Views", "🏦 Accounts", "🏷️ Categories", "📈 Analytics", "👤 Profile", "⚙️ Settings"]
 )
 
 st.sidebar.markdown("---")
@@ -265,8 +288,9 @@ if page == "📊 Dashboard":
     with col2:
         end_date = st.date_input("To", datetime.now())
     
-    # Get summary
-    summary = db.get_summary(user_id, str(start_date), str(end_date))
+    # Load all dashboard queries concurrently
+    dash = db.get_dashboard_data(user_id, str(start_date), str(end_date))
+    summary = dash.summary
     
     # KPI Metrics
     col1, col2, col3, col4, col5 = st.columns(5)
@@ -301,6 +325,33 @@ if page == "📊 Dashboard":
     with c2:
         st.metric("🚗 Vehicle (Tracking)", utils.format_currency(summary['total_vehicle'], currency), help="Total Spend (Cash + CC). Note: Only Cash/Bank spend is deducted from Net Savings.")
     
+    # Budgets for the current month (precomputed counters, independent of the date range above)
+    budgets = dash.budgets
+    if not budgets.empty:
+        st.markdown("---")
+        st.subheader(f"🎯 Budgets ({datetime.now():%B %Y})")
+        for _, b in budgets[budgets['status'] == 'Over'].iterrows():
+            st.error(f"🚨 **{b['category']}** is over budget: {utils.format_currency(b['spent'], currency)} of "
+                     f"{utils.format_currency(b['monthly_limit'], currency)} ({b['pct_used']:.0f}%)")
+        for _, b in budgets[budgets['status'] == 'At Risk'].iterrows():
+            st.warning(f"⚠️ **{b['category']}** is burning {utils.format_currency(b['burn_rate'], currency)}/day and is on track for "
+                       f"{utils.format_currency(b['projected'], currency)} against a budget of {utils.format_currency(b['monthly_limit'], currency)}")
+        with st.expander("View All Budgets", expanded=False):
+            for _, b in budgets.iterrows():
+                st.progress(min(1.0, max(0.0, b['pct_used'] / 100)),
+                            text=f"{b['category']} ({b['type']}): {utils.format_currency(b['spent'], currency)} / "
+                                 f"{utils.format_currency(b['monthly_limit'], currency)} · {utils.format_currency(b['burn_rate'], currency)}/day")
+
+    # Unusual category spend in the last three months (details on Analytics > Anomalies)
+    recent_anomalies = anomalies.detect_anomalies(user_id)
+    if not recent_anomalies.empty:
+        spikes = recent_anomalies[recent_anomalies['direction'] == 'spike']
+        top = recent_anomalies.iloc[0]
+        st.warning(f"🚨 **{len(recent_anomalies)} spending anomal{'y' if len(recent_anomalies) == 1 else 'ies'}** in the last 3 months "
+                   f"({len(spikes)} spike{'' if len(spikes) == 1 else 's'}). Largest: **{top['category']}** in {top['month']}, "
+                   f"{utils.format_currency(top['amount'], currency)} vs ~{utils.format_currency(top['expected'], currency)} expected. "
+                   f"See 📈 Analytics › 🚨 Anomalies.")
+
     st.markdown("---")
     
     # Charts
@@ -308,10 +359,9 @@ if page == "📊 Dashboard":
     
     with col1:
         st.subheader("Income Breakdown")
-        income_data = db.get_category_breakdown(user_id, 'Income', str(start_date), str(end_date))
+        income_data = dash.income_breakdown
         if not income_data.empty:
-            import plotly.express as px
-            fig = px.pie(income_data, values='total', names='category', 
+            fig = charts.cached_figure(px.pie, income_data, values='total', names='category', 
                         title='Income by Category',
                         color_discrete_sequence=px.colors.sequential.Greens_r)
             st.plotly_chart(fig, use_container_width=True)
@@ -320,9 +370,9 @@ if page == "📊 Dashboard":
     
     with col2:
         st.subheader("Expense Breakdown")
-        expense_data = db.get_category_breakdown(user_id, 'Expense', str(start_date), str(end_date))
+        expense_data = dash.expense_breakdown
         if not expense_data.empty:
-            fig = px.pie(expense_data, values='total', names='category',
+            fig = charts.cached_figure(px.pie, expense_data, values='total', names='category',
                         title='Expenses by Category',
                         color_discrete_sequence=px.colors.sequential.Reds_r)
             st.plotly_chart(fig, use_container_width=True)
@@ -332,9 +382,12 @@ if page == "📊 Dashboard":
     # Monthly Projections (Recurring)
     st.subheader("🔮 Projected Monthly Savings")
     
-    rec_items = db.get_recurring_items(user_id)
+    rec_items = dash.recurring_items
     if not rec_items.empty:
         rec_items = rec_items[rec_items['is_active'] == 1]
+        # Quarterly / yearly items count with their monthly share
+        rec_items = rec_items.assign(
+            amount=rec_items['amount'] / rec_items['frequency'].map(db.RECURRING_FREQUENCIES).fillna(1))
         
         # Valid Income
         rec_income = rec_items[rec_items['type'] == 'Income']['amount'].sum()
@@ -403,11 +456,40 @@ elif page == "🔄 Recurring Items":
                     with c5:
                          e_active = st.checkbox("Active?", value=bool(row['is_active']), key=f"e_act_{row['id']}")
                     
+                    st.write("**📅 Schedule**")
+                    s1, s2, s3 = st.columns(3)
+                    with s1:
+                         e_auto = st.checkbox("Auto-post as transaction", value=bool(row['auto_post']), key=f"e_auto_{row['id']}")
+                         freq_list = list(db.RECURRING_FREQUENCIES)
+                         e_freq = st.selectbox("Frequency", freq_list, format_func=lambda f: f.replace('_', ' ').title(),
+                                               index=freq_list.index(row['frequency']) if row['frequency'] in freq_list else 0,
+                                               key=f"e_freq_{row['id']}")
+                    with s2:
+                         e_day = st.number_input("Day of Month", min_value=1, max_value=31,
+                                                 value=int(row['day_of_month']) if pd.notna(row['day_of_month']) else 1,
+                                                 key=f"e_day_{row['id']}")
+                         e_account = st.text_input("Account", value=row['account'] if pd.notna(row['account']) else "", key=f"e_acc_{row['id']}")
+                    with s3:
+                         e_start = st.date_input("Start Date", value=pd.to_datetime(row['start_date']).date() if pd.notna(row['start_date']) else datetime.now().date(),
+                                                 key=f"e_start_{row['id']}")
+                         e_end = st.date_input("End Date (optional)", value=pd.to_datetime(row['end_date']).date() if pd.notna(row['end_date']) else None,
+                                               key=f"e_end_{row['id']}")
+                    
                     b1, b2 = st.columns([1, 1])
                     with b1:
                         if st.form_submit_button("💾 Save Changes", type="primary"):
-                             if db.update_recurring_item(int(row['id']), int(user_id), e_name, e_type, e_cat, float(e_amount), 1 if e_active else 0):
+                             schedule = {
+                                 'auto_post': 1 if e_auto else 0,
+                                 'frequency': e_freq,
+                                 'day_of_month': int(e_day),
+                                 'start_date': e_start.strftime('%Y-%m-%d'),
+                                 'end_date': e_end.strftime('%Y-%m-%d') if e_end else None,
+                                 'account': e_account or None,
+                             }
+                             if db.update_recurring_item(int(row['id']), int(user_id), e_name, e_type, e_cat, float(e_amount), 1 if e_active else 0, schedule):
                                  st.session_state.edit_recurring_id = None
+                                 if e_auto and e_active:
+                                     scheduler.run_scheduler(user_id)
                                  st.success("Updated!")
                                  st.rerun()
                              else:
@@ -442,15 +524,36 @@ elif page == "🔄 Recurring Items":
             
             c4, c5 = st.columns(2)
             with c4:
-                r_amount = st.number_input(f"Est. Monthly Amount ({symbol})", min_value=0.0, step=100.0)
+                r_amount = st.number_input(f"Est. Amount per Occurrence ({symbol})", min_value=0.0, step=100.0)
                 if r_amount > 0:
                     st.caption(f"**{utils.number_to_words(r_amount, currency)}**")
             with c5:
                 r_active = st.checkbox("Active?", value=True, help="Uncheck to hide from projections without deleting")
             
+            r_auto = st.checkbox("Auto-post as transaction", value=False,
+                                 help="Create the transaction automatically on every due date")
+            if r_auto:
+                s1, s2, s3 = st.columns(3)
+                with s1:
+                    r_freq = st.selectbox("Frequency", list(db.RECURRING_FREQUENCIES), format_func=lambda f: f.replace('_', ' ').title())
+                    r_day = st.number_input("Day of Month", min_value=1, max_value=31, value=datetime.now().day)
+                with s2:
+                    r_start = st.date_input("Start Date", datetime.now())
+                    r_end = st.date_input("End Date (optional)", value=None)
+                with s3:
+                    r_account = st.text_input("Account", key="r_account")
+            else:
+                r_freq, r_day, r_start, r_end, r_account = 'monthly', 1, None, None, None
+            
             if st.button("Add Item", type="primary"):
                 if r_name and r_amount > 0:
-                    db.add_recurring_item(user_id, r_name, r_type, r_cat, r_amount, 1 if r_active else 0)
+                    db.add_recurring_item(user_id, r_name, r_type, r_cat, r_amount, 1 if r_active else 0,
+                                          auto_post=1 if r_auto else 0, frequency=r_freq, day_of_month=int(r_day),
+                                          start_date=r_start.strftime('%Y-%m-%d') if r_start else None,
+                                          end_date=r_end.strftime('%Y-%m-%d') if r_end else None,
+                                          account=r_account or None)
+                    if r_auto:
+                        scheduler.run_scheduler(user_id)
                     st.success("Added!")
                     st.rerun()
                 else:
@@ -483,6 +586,8 @@ elif page == "🔄 Recurring Items":
                             with col3:
                                  status = "✅ Active" if row['is_active'] else "❌ Inactive"
                                  st.write(status)
+                                 if row['auto_post']:
+                                     st.caption(f"📅 Auto-post {row['frequency'].replace('_', ' ')}, day {int(row['day_of_month'])}")
                             with col4:
                                 # Simple Toggle Active Button
                                 btn_label = "Deactivate" if row['is_active'] else "Activate"
@@ -520,13 +625,21 @@ elif page == "➕ Add Transaction":
     with col2:
         categories = db.get_categories(user_id, trans_type)
         if not categories.empty:
-            category = st.selectbox("Category", categories['name'].tolist())
+            category = st.selectbox("Category", categories['name'].tolist(), key="add_category")
         else:
             category = st.text_input("Category (No categories found, enter manually)")
         
-        amount = st.number_input(f"Amount ({symbol})", min_value=0.0, step=100.0)
+        # Only currencies the FX rates can convert, so every amount shows up in converted totals
+        curr_options = [c for c in db.convertible_currencies(currency) if c in utils.CURRENCIES]
+        trans_currency = st.selectbox("Currency", curr_options,
+                                      index=curr_options.index(currency) if currency in curr_options else 0,
+                                      key="add_currency",
+                                      help="Reports convert other currencies into your preferred currency using the FX rates. "
+                                           "Upload rates in Profile to enter more currencies.")
+        trans_symbol = utils.CURRENCIES[trans_currency]['symbol']
+        amount = st.number_input(f"Amount ({trans_symbol})", min_value=0.0, step=100.0)
         if amount > 0:
-            st.caption(f"**{utils.number_to_words(amount, currency)}**")
+            st.caption(f"**{utils.number_to_words(amount, trans_currency)}**")
         
         is_cc_payment = False
         if trans_type in ["Expense", "Subscriptions", "Vehicle"]:
@@ -540,8 +653,11 @@ elif page == "➕ Add Transaction":
         if trans_type == "Expense":
              is_self_expense = st.checkbox("👤 Self / Personal Expense", help="Check this if this is a personal expense just for you (not shared).")
     
+    counterparty = None
     if trans_type == "Debt" and category == "Friends":
         st.info("ℹ️ **Note:** This transaction will be tracked in 'Friends Debt' and excluded from your main savings calculations.")
+        counterparty = st.text_input("Person", key="add_counterparty",
+                                     help="Who you owe. Left empty, the name is taken from the description.")
     
     # Loan Details Section
     loan_rate = None
@@ -582,11 +698,45 @@ elif page == "➕ Add Transaction":
                  st.warning("Enter Amount, Rate and Tenure to see EMI")
                  st.info("Date must be Loan Start date, Amount will be total loan amount - once added tracations always gp to debt views to update EMI")
     
-    description = st.text_area("Description (Optional)")
-    account = st.text_input("Account (Optional)")
+    def use_suggestion(field_key, value):
+        st.session_state[field_key] = value
+    
+    def show_suggestions(field, field_key):
+        # Served from the in-memory prefix index; no database query per rerun
+        suggestions = autocomplete.suggest(user_id, field, st.session_state.get(field_key, ""))
+        if suggestions:
+            cols = st.columns(len(suggestions))
+            for i, s in enumerate(suggestions):
+                cols[i].button(s, key=f"sugg_{field}_{i}", on_click=use_suggestion, args=(field_key, s))
+    
+    description = st.text_area("Description (Optional)", key="add_description")
+    show_suggestions('description', "add_description")
+    account = st.text_input("Account (Optional)", key="add_account")
+    show_suggestions('account', "add_account")
+    
+    # Category guess from the user's history (naive Bayes on description / account / amount)
+    if not categories.empty and (description or account):
+        cat_options = categories['name'].tolist()
+        guesses = [g for g in categorizer.suggest(user_id, description, account, amount or None, trans_type)
+                   if g[1] in cat_options and g[2] >= 0.25]
+        if guesses and guesses[0][1] != category:
+            _, g_cat, g_conf = guesses[0]
+            st.button(f"🏷️ Use suggested category: {g_cat} ({g_conf:.0%} confident)", key="sugg_category",
+                      on_click=use_suggestion, args=("add_category", g_cat))
+    
+    # Duplicate check: same amount and description within a few days
+    allow_duplicate = True
+    if amount > 0:
+        dupes = db.find_duplicates(user_id, str(trans_date), amount, description, trans_type=trans_type)
+        if not dupes.empty:
+            st.warning(f"⚠️ This looks like a duplicate of {len(dupes)} existing transaction(s): " +
+                       ", ".join(f"{r['date']:%d-%b-%Y} {r['category']} {utils.format_currency(r['amount'], currency)}" for _, r in dupes.head(3).iterrows()))
+            allow_duplicate = st.checkbox("Add anyway", key="add_allow_duplicate")
     
     if st.button("➕ Add Transaction", width='stretch', type="primary"):
-        if amount > 0:
+        if amount > 0 and not allow_duplicate:
+            st.error("Possible duplicate. Tick 'Add anyway' to save it.")
+        elif amount > 0:
             trans_id = db.add_transaction(
                 user_id=user_id,
                 date=str(trans_date),
@@ -603,11 +753,17 @@ elif page == "➕ Add Transaction":
                 loan_end_date=str(loan_end_date) if loan_end_date else None,
                 loan_lender_bank=loan_lender,
                 is_reinvestment=1 if is_reinvestment else 0,
-                is_self=1 if is_self_expense else 0
+                is_self=1 if is_self_expense else 0,
+                # Amounts in the preferred currency stay untagged, like older rows
+                currency=trans_currency if trans_currency != currency else None,
+                counterparty=counterparty.strip() if counterparty else None
             )
-            st.session_state.transaction_added = True
-            st.session_state.last_transaction_id = trans_id
-            st.rerun()
+            if trans_id is None:
+                st.error(f"Account '{account}' keeps its balance in another currency. Pick its currency or another account.")
+            else:
+                st.session_state.transaction_added = True
+                st.session_state.last_transaction_id = trans_id
+                st.rerun()
         else:
             st.error("Amount must be greater than 0")
 
@@ -635,25 +791,37 @@ elif page == "📋 View Transactions":
             
         filter_category = st.selectbox("Category", ["All"] + all_categories['name'].tolist() if not all_categories.empty else ["All"])
     
+    search_text = st.text_input("🔍 Search", placeholder="Description, account, category or lender (e.g. amazon refund)")
+    
     # Get transactions
-    transactions = db.get_transactions(
-        user_id=user_id,
-        start_date=str(filter_start),
-        end_date=str(filter_end),
-        trans_type=filter_type if filter_type != "All" else None,
-        category=filter_category if filter_category != "All" else None
-    )
+    if search_text.strip():
+        # Full-text search over all dates, best matches first
+        transactions = db.search_transactions(
+            user_id,
+            search_text,
+            limit=200,
+            trans_type=filter_type if filter_type != "All" else None,
+            category=filter_category if filter_category != "All" else None
+        )
+        st.caption("Searching all dates (From/To ignored), best matches first.")
+    else:
+        transactions = db.get_transactions(
+            user_id=user_id,
+            start_date=str(filter_start),
+            end_date=str(filter_end),
+            trans_type=filter_type if filter_type != "All" else None,
+            category=filter_category if filter_category != "All" else None
+        )
     
     if not transactions.empty:
-        st.write(f"**Total: {len(transactions)} transactions | Sum: ₹{transactions['amount'].sum():,.0f}**")
+        total_amount = db.convert_frame(transactions, currency)['amount'].sum()
+        st.write(f"**Total: {len(transactions)} transactions | Sum: {utils.format_currency(total_amount, currency)}**")
         st.caption("Select a row to edit or delete.")
         st.markdown("---")
         
         # Create a container for the edit form at the top
         edit_container = st.container()
 
-        transactions['date'] = pd.to_datetime(transactions['date']).dt.date
-        
         # Display DataFrame with selection enabled
         event = st.dataframe(
             transactions,
@@ -666,6 +834,7 @@ elif page == "📋 View Transactions":
                 "amount": st.column_config.NumberColumn(f"Amount ({symbol})", format=f"{symbol}%d"),
                 "description": "Description",
                 "account": "Account",
+                "currency": "Currency",
                 "is_credit_card_payment": st.column_config.CheckboxColumn("CC Paid"),
                 "is_reinvestment": st.column_config.CheckboxColumn("Reinvest"),
                 "created_at": None,
@@ -676,6 +845,7 @@ elif page == "📋 View Transactions":
                 "is_repaid": None,
                 "subcategory": None,
                 "paid_amount": None,
+                "archived": st.column_config.CheckboxColumn("Archived"),
                 "is_self": st.column_config.CheckboxColumn("Self?")
             },
             hide_index=True,
@@ -691,12 +861,17 @@ elif page == "📋 View Transactions":
             
             with edit_container:
                 st.subheader(f"✏️ Edit Transaction: {selected_row['description'] or 'Untitled'}")
-                st.info(f"Editing Transaction ID: {selected_row['id']} | Date: {selected_row['date']}")
+                st.info(f"Editing Transaction ID: {selected_row['id']} | Date: {selected_row['date']:%d-%m-%Y}")
+                # Rows of archived years are read-only until the year is restored
+                read_only = selected_row.get('archived', 0) == 1
+                if read_only:
+                    st.warning(f"This transaction is in the archived year {selected_row['date']:%Y}. "
+                               "Restore the year in Settings → Year Archives to edit or delete it.")
                 
                 with st.form(f"edit_trans_{selected_row['id']}"):
                     c1, c2, c3 = st.columns(3)
                     with c1:
-                        e_date = st.date_input("Date", selected_row['date'])
+                        e_date = st.date_input("Date", selected_row['date'].date())
                     with c2:
                         e_type = st.selectbox("Type", ["Income", "Expense", "Investment", "Credit Card", "Debt", "Vehicle", "Banking", "Subscriptions"], 
                                             index=["Income", "Expense", "Investment", "Credit Card", "Debt", "Vehicle", "Banking", "Subscriptions"].index(selected_row['type']) if selected_row['type'] in ["Income", "Expense", "Investment", "Credit Card", "Debt", "Vehicle", "Banking", "Subscriptions"] else 0)
@@ -717,7 +892,13 @@ elif page == "📋 View Transactions":
                         if e_amount > 0:
                             st.caption(f"**{utils.number_to_words(e_amount, currency)}**")
                     with c5:
-                        e_account = st.text_input("Account", value=selected_row['account'] or "")
+                        e_account = st.text_input("Account", value=selected_row['account'] if pd.notna(selected_row['account']) else "")
+                        row_currency = selected_row['currency'] if pd.notna(selected_row['currency']) else currency
+                        curr_options = [c for c in db.convertible_currencies(currency) if c in utils.CURRENCIES]
+                        if row_currency not in curr_options:
+                            curr_options.append(row_currency)
+                        e_currency = st.selectbox("Currency", curr_options,
+                                                  index=curr_options.index(row_currency) if row_currency in curr_options else 0)
                     
                     e_desc = st.text_area("Description", value=selected_row['description'] or "")
                     
@@ -735,6 +916,11 @@ elif page == "📋 View Transactions":
                     e_loan_tenure = None
                     e_loan_emi = None
                     e_loan_lender = None
+                    e_counterparty = None
+                    
+                    if e_type == "Debt" and e_cat == "Friends":
+                        e_counterparty = st.text_input("Person", value=selected_row['counterparty'] if pd.notna(selected_row.get('counterparty')) else "")
+                        e_counterparty = e_counterparty.strip() or db.counterparty_from_description(e_desc)
                     
                     if e_type == "Debt":
                         st.markdown("#### 🏦 Loan Details")
@@ -750,11 +936,10 @@ elif page == "📋 View Transactions":
 
                     col_update, col_delete = st.columns([1, 1])
                     with col_update:
-                        if st.form_submit_button("💾 Update Transaction", type="primary"):
+                        if st.form_submit_button("💾 Update Transaction", type="primary", disabled=read_only):
                             if st.session_state.username == 'demouser':
                                  st.error("Demo User cannot edit data.")
-                            else:
-                                db.update_transaction(
+                            elif not db.update_transaction(
                                     user_id=user_id,
                                     trans_id=int(selected_row['id']),
                                     date=str(e_date),
@@ -769,17 +954,23 @@ elif page == "📋 View Transactions":
                                     loan_tenure_months=e_loan_tenure,
                                     loan_emi=e_loan_emi,
                                     loan_lender_bank=e_loan_lender,
-                                    is_self=1 if e_is_self else 0
-                                )
+                                    is_self=1 if e_is_self else 0,
+                                    currency=e_currency if e_currency != row_currency else None,
+                                    counterparty=e_counterparty
+                                ):
+                                st.error("Could not update: the transaction was archived or deleted, "
+                                         "or its account keeps its balance in another currency.")
+                            else:
                                 st.success("Transaction updated!")
                                 st.rerun()
                     
                     with col_delete:
-                        if st.form_submit_button("🗑️ Delete Transaction", type="secondary"):
+                        if st.form_submit_button("🗑️ Delete Transaction", type="secondary", disabled=read_only):
                              if st.session_state.username == 'demouser':
                                  st.error("Demo User cannot delete data.")
+                             elif not db.delete_transaction(user_id, int(selected_row['id'])):
+                                 st.error("Transaction not found; it may have been archived or deleted.")
                              else:
-                                 db.delete_transaction(user_id, int(selected_row['id']))
                                  st.error("Transaction deleted!")
                                  st.rerun()
                 st.divider()
@@ -817,6 +1008,47 @@ elif page == "🏷️ Categories":
     
     categories = db.get_categories(user_id)
     
+    with st.expander("🎯 Monthly Budgets"):
+        if not categories.empty:
+            st.caption("Spending is counted as transactions are saved, so budgets are checked on the Dashboard without scanning history.")
+            cat_labels = [f"{r['type']} · {r['name']}" for _, r in categories.iterrows()]
+            with st.form("budget_form"):
+                b1, b2 = st.columns(2)
+                with b1:
+                    budget_label = st.selectbox("Category", cat_labels)
+                with b2:
+                    budget_limit = st.number_input(f"Monthly Limit ({symbol})", min_value=0.0, step=500.0,
+                                                   help="Set 0 to remove the budget.")
+                if st.form_submit_button("💾 Save Budget"):
+                    budget_type, budget_cat = budget_label.split(" · ", 1)
+                    db.set_budget(user_id, budget_type, budget_cat, budget_limit)
+                    st.success(f"Budget saved for {budget_cat}")
+                    st.rerun()
+            
+            budget_status = db.get_budget_status(user_id)
+            if not budget_status.empty:
+                st.dataframe(
+                    budget_status.assign(
+                        monthly_limit=utils.format_currency_series(budget_status['monthly_limit'], currency),
+                        spent=utils.format_currency_series(budget_status['spent'], currency),
+                        remaining=utils.format_currency_series(budget_status['remaining'], currency),
+                        pct_used=budget_status['pct_used'].round(0),
+                    )[['type', 'category', 'monthly_limit', 'spent', 'remaining', 'pct_used', 'status']]
+                    .rename(columns={'type': 'Type', 'category': 'Category', 'monthly_limit': 'Budget', 'spent': 'Spent (this month)',
+                                     'remaining': 'Remaining', 'pct_used': '% Used', 'status': 'Status'}),
+                    width='stretch', hide_index=True)
+                r1, r2 = st.columns([3, 1])
+                with r1:
+                    budget_ids = dict(zip(budget_status['type'].astype(str) + " · " + budget_status['category'].astype(str),
+                                          budget_status['id']))
+                    remove_budget = st.selectbox("Remove budget", list(budget_ids), key="remove_budget")
+                with r2:
+                    if st.button("🗑️ Remove", key="remove_budget_btn"):
+                        db.delete_budget(user_id, int(budget_ids[remove_budget]))
+                        st.rerun()
+        else:
+            st.info("Add categories first to set budgets.")
+    
     if not categories.empty:
         if 'edit_cat_id' not in st.session_state:
             st.session_state.edit_cat_id = None
@@ -898,18 +1130,11 @@ elif page == "💸 Debt Views":
     tab_friends, tab_loans = st.tabs(["🤝 Friends Debt", "🏦 Loans"])
 
     with tab_friends:
-        # Get all friends debts
-        debts = db.get_friends_debts(user_id)
+        # Per-person totals come precomputed from the ledger; rows load only for the chosen person
+        ledger = db.get_counterparty_ledger(user_id)
         
-        if not debts.empty:
-            # Calculate remaining amount for each debt
-            debts['paid_amount'] = debts['paid_amount'].fillna(0)
-            debts['remaining'] = debts['amount'] - debts['paid_amount']
-            
-            unpaid = debts[debts['is_repaid'] == 0]
-            repaid = debts[debts['is_repaid'] == 1]
-            
-            total_outstanding = unpaid['remaining'].sum()
+        if not ledger.empty:
+            total_outstanding = ledger['outstanding'].sum()
             
             # KPI Card
             st.markdown(f"""
@@ -919,6 +1144,27 @@ elif page == "💸 Debt Views":
             </div>
             """, unsafe_allow_html=True)
             
+            with st.expander("👥 By Person", expanded=True):
+                st.dataframe(
+                    ledger.assign(
+                        outstanding=utils.format_currency_series(ledger['outstanding'], currency),
+                        total_borrowed=utils.format_currency_series(ledger['total_borrowed'], currency),
+                        total_repaid=utils.format_currency_series(ledger['total_repaid'], currency),
+                    )[['counterparty', 'outstanding', 'open_count', 'total_borrowed', 'total_repaid', 'last_activity']]
+                    .rename(columns={'counterparty': 'Person', 'outstanding': 'Outstanding', 'open_count': 'Open',
+                                     'total_borrowed': 'Borrowed', 'total_repaid': 'Repaid', 'last_activity': 'Last Activity'}),
+                    width='stretch', hide_index=True)
+            
+            person = st.selectbox("Show debts for", ["All"] + ledger['counterparty'].tolist(), key="friends_person")
+            debts = db.get_friends_debts(user_id, None if person == "All" else person)
+            
+            # Calculate remaining amount for each debt
+            debts['paid_amount'] = debts['paid_amount'].fillna(0)
+            debts['remaining'] = debts['amount'] - debts['paid_amount']
+            
+            unpaid = debts[debts['is_repaid'] == 0]
+            repaid = debts[debts['is_repaid'] == 1]
+            
             # Active Debts Accordion
             with st.expander("📝 Active Debts", expanded=True):
                 if not unpaid.empty:
@@ -926,15 +1172,15 @@ elif page == "💸 Debt Views":
                         with st.container():
                             c1, c2, c3, c4 = st.columns([2, 3, 2, 3])
                             with c1:
-                                st.write(f"📅 **{row['date']}**")
+                                st.write(f"📅 **{row['date']:%Y-%m-%d}**")
                             with c2:
                                 st.write(f"**{row['description']}**")
-                                st.caption(f"Account: {row['account'] or 'None'}")
+                                st.caption(f"Account: {row['account'] if pd.notna(row['account']) else 'None'}")
                             with c3:
-                                st.write(f"Total: ₹{row['amount']:,.0f}")
+                                st.write(f"Total: {utils.format_currency(row['amount'], currency)}")
                                 if row['paid_amount'] > 0:
-                                    st.write(f"Paid: ₹{row['paid_amount']:,.0f}")
-                                st.write(f"**Left: ₹{row['remaining']:,.0f}**")
+                                    st.write(f"Paid: {utils.format_currency(row['paid_amount'], currency)}")
+                                st.write(f"**Left: {utils.format_currency(row['remaining'], currency)}**")
                             with c4:
                                 # Repay Logic
                                 with st.popover("💸 Repay"):
@@ -950,7 +1196,7 @@ elif page == "💸 Debt Views":
                                                 st.success("Payment Recorded!")
                                                 st.rerun()
                                             else:
-                                                st.error("Error recording payment")
+                                                st.error("Error recording payment. The account may keep its balance in another currency.")
                             
                             # Progress bar
                             if row['amount'] > 0:
@@ -966,54 +1212,33 @@ elif page == "💸 Debt Views":
                     # Sort repaid by date descending (though likely already sorted coming from DB, usually safe to re-sort or rely on query)
                     # Let's show table for overview
                     st.dataframe(repaid[['date', 'description', 'amount', 'paid_amount']], width='stretch', hide_index=True)
-                    
-                    st.subheader("Recent Repayments (Undo Actions)")
-                    st.caption("You can undo repayments made within the last 48 hours.")
-                    
-                    # Need to fetch linked repayment transaction date to verify 48h limit
-                    # We iterate through recent ones
-                    conn_check = db.get_connection()
-                    
-                    for _, row in repaid.head(10).iterrows(): # Check last 10
-                         # Fetch the LAST repayment transaction for this debt
-                        repay_trans = pd.read_sql_query(
-                            "SELECT id, date, amount FROM transactions WHERE linked_id = ? AND type = 'Expense' ORDER BY date DESC LIMIT 1", 
-                            conn_check, params=[row['id']]
-                        )
-                        
-                        can_undo = False
-                        repay_date_str = "Unknown"
-                        
-                        if not repay_trans.empty:
-                            last_pay_date = pd.to_datetime(repay_trans.iloc[0]['date']).date()
-                            time_diff = (datetime.now().date() - last_pay_date).days
-                            repay_date_str = last_pay_date.strftime('%d-%b-%Y')
-                            if time_diff <= 2:
-                                can_undo = True
-                        
+                else:
+                    st.info("No repaid debts yet.")
+                
+                st.subheader("Recent Repayments (Undo Actions)")
+                st.caption("You can undo repayments made within the last 48 hours.")
+                
+                # Debts with a repayment within the window, latest payment first (last_payment_at is kept on the debt row)
+                undoable = db.get_recent_repayments(user_id, since=str(datetime.now().date() - timedelta(days=2)),
+                                                    category='Friends')
+                if person != "All":
+                    undoable = undoable[undoable['counterparty'] == person]
+                if not undoable.empty:
+                    for _, row in undoable.iterrows():
                         c1, c2, c3 = st.columns([3, 2, 2])
-                        c1.write(f"{row['date']} - {row['description']}")
-                        c2.write(f"Paid: ₹{row['amount']:,.0f}")
+                        c1.write(f"{row['date']:%Y-%m-%d} - {row['description']}")
+                        c2.write(f"Paid: {utils.format_currency(row['paid_amount'], currency)}")
                         
                         with c3:
-                            if can_undo:
-                                if st.button("↩️ Undo", key=f"undo_{row['id']}"):
-                                    # 1. Delete the linked Expense transaction(s)
-                                    db.delete_transaction_by_link(user_id, row['id'])
-                                    
-                                    # 2. Reset paid_amount to 0 and mark as unpaid
-                                    db.update_transaction(user_id, row['id'], paid_amount=0.0)
-                                    db.toggle_transaction_repaid(user_id, row['id'])
-                                    
-                                    st.success("Repayment undone!")
-                                    st.rerun()
-                            else:
-                                st.caption(f"Closed: {repay_date_str}")
+                            st.caption(f"Last paid: {pd.to_datetime(row['last_payment_at']):%d-%b-%Y}")
+                            if st.button("↩️ Undo", key=f"undo_{row['id']}"):
+                                # Delete the linked Expense transaction(s); the debt's paid amount and status follow
+                                db.delete_transaction_by_link(user_id, row['id'])
                                 
-                    conn_check.close()
-
+                                st.success("Repayment undone!")
+                                st.rerun()
                 else:
-                    st.info("No repaid debts yet.")
+                    st.caption("No repayments in the last 48 hours.")
         else:
              st.info("No debt records found.")
 
@@ -1090,15 +1315,15 @@ elif page == "💸 Debt Views":
                             st.caption(f"Bank: {row['loan_lender_bank'] or 'N/A'} | ROI: {roi}% | Tenure: {tenure_months}m | Start: {start_d} | End: {end_d}")
                             
                             m1, m2, m3 = st.columns(3)
-                            m1.metric("Total Payable", f"₹{total_payable:,.0f}", help=f"Principal: ₹{principal:,.0f} + Interest: ₹{total_interest:,.0f}")
-                            m2.metric("EMI", f"₹{emi:,.0f}")
-                            m3.metric("Balance Left", f"₹{balance_left:,.0f}", delta=f"-₹{amount_paid_so_far:,.0f} Paid", delta_color="inverse")
+                            m1.metric("Total Payable", utils.format_currency(total_payable, currency), help=f"Principal: {utils.format_currency(principal, currency)} + Interest: {utils.format_currency(total_interest, currency)}")
+                            m2.metric("EMI", utils.format_currency(emi, currency))
+                            m3.metric("Balance Left", utils.format_currency(balance_left, currency), delta=f"-{utils.format_currency(amount_paid_so_far, currency)} Paid", delta_color="inverse")
                             
                             st.divider()
                             
                             d1, d2, d3, d4 = st.columns(4)
-                            d1.metric("Principal", f"₹{principal:,.0f}")
-                            d2.metric("Interest", f"₹{total_interest:,.0f}")
+                            d1.metric("Principal", utils.format_currency(principal, currency))
+                            d2.metric("Interest", utils.format_currency(total_interest, currency))
                             d3.metric("Months Paid", f"{months_paid:.1f}")
                             d4.metric("Months Left", f"{months_left:.1f}")
                             
@@ -1120,30 +1345,15 @@ elif page == "💸 Debt Views":
                                         p_acc = st.text_input("From Account", value="Bank Account")
                                         
                                         if st.form_submit_button("Confirm Payment"):
-                                            db.add_transaction(
-                                                user_id=user_id,
-                                                date=str(p_date),
-                                                trans_type="Expense",
-                                                category="EMI", 
-                                                subcategory="Loan Repayment",
-                                                amount=p_amt,
-                                                description=f"EMI for {row['category']} ({row['loan_lender_bank']})",
-                                                account=p_acc,
-                                                linked_id=row['id']
-                                            )
-                                            new_paid = amount_paid_so_far + p_amt
-                                            is_done = 1 if new_paid >= (total_payable - 10) else 0 
-                                            
-                                            db.update_transaction(user_id, row['id'], paid_amount=new_paid)
-                                            if is_done:
-                                                db.toggle_transaction_repaid(user_id, row['id'])
-                                                
-                                            st.success("EMI Paid!")
-                                            st.rerun()
+                                            if db.pay_emi(user_id, row['id'], p_amt, p_acc, str(p_date)):
+                                                st.success("EMI Paid!")
+                                                st.rerun()
+                                            else:
+                                                st.error("Enter an amount greater than zero, from an account kept in your currency.")
                             
                             st.divider()
                             with st.expander("📜 Repayment History"):
-                                conn_hist = db.get_connection()
+                                conn_hist = db.get_connection(user_id)
                                 hist_df = pd.read_sql_query("SELECT date, amount, description, account FROM transactions WHERE linked_id = ? ORDER BY date DESC", conn_hist, params=[row['id']])
                                 conn_hist.close()
                                 if not hist_df.empty:
@@ -1155,47 +1365,23 @@ elif page == "💸 Debt Views":
 
             with sub_closed_tab:
                 if not closed_loans.empty:
-                    # Year filter
-                    closed_years = []
-                    conn_dates = db.get_connection()
-                    
-                    # We need to find closure year for each loan. 
-                    # Optimization: For now just fetch all repayment dates and map them.
-                    # Or simpler: Just user Current Year default and a number input
-                    
                     c1, c2 = st.columns(2)
                     with c1:
                          sel_year = st.number_input("Filter by Closure Year", min_value=2000, max_value=2100, value=datetime.now().year)
 
-                    # Filter logic: Check if max repayment date year == sel_year
-                    filtered_closed_loans = []
-                    
-                    for _, row in closed_loans.iterrows():
-                        last_pymt = pd.read_sql_query("SELECT date FROM transactions WHERE linked_id = ? ORDER BY date DESC LIMIT 1", conn_dates, params=[row['id']])
-                        if not last_pymt.empty:
-                            close_date = pd.to_datetime(last_pymt.iloc[0]['date']).date()
-                            if close_date.year == sel_year:
-                                row['close_date'] = close_date
-                                filtered_closed_loans.append(row)
-                        else:
-                            # If no repayments found (maybe manually closed?), check created date? Or just ignore?
-                            # Let's include if created date year matches as fallback
-                            pass
-                    
-                    conn_dates.close() # Close after loop
+                    # One range query on the indexed closed_at column
+                    df_closed = db.get_closed_loans(user_id, sel_year)
                     
-                    if filtered_closed_loans:
-                        df_closed = pd.DataFrame(filtered_closed_loans)
-                        
+                    if not df_closed.empty:
                         st.success(f"Found {len(df_closed)} closed loans in {sel_year}")
                         
                         for _, row in df_closed.iterrows():
                             with st.container():
                                 st.subheader(f"✅ {row['category']} ({row['loan_lender_bank']})")
                                 c1, c2, c3, c4 = st.columns(4)
-                                c1.caption(f"Closed on: {row['close_date'].strftime('%d-%b-%Y')}")
-                                c2.caption(f"Principal: ₹{row['amount']:,.0f}")
-                                c3.caption(f"Total Paid: ₹{row['paid_amount']:,.0f}")
+                                c1.caption(f"Closed on: {pd.to_datetime(row['closed_at']):%d-%b-%Y}")
+                                c2.caption(f"Principal: {utils.format_currency(row['amount'], currency)}")
+                                c3.caption(f"Total Paid: {utils.format_currency(row['paid_amount'], currency)}")
                                 c4.caption(f"Tenure: {row['loan_tenure_months']}m")
                                 st.markdown("---")
                     else:
@@ -1207,6 +1393,95 @@ elif page == "💸 Debt Views":
             st.info("No active or closed loans found. Create a Debt transaction with a Loan Category to see it here.")
             st.caption("Tip: Go to Categories, edit a Debt category and check 'Track as Loan'.")
 
+# ========== ACCOUNTS PAGE ==========
+elif page == "🏦 Accounts":
+    st.markdown('<div class="main-header">🏦 Accounts</div>', unsafe_allow_html=True)
+    st.info("Balances update with every transaction. Accounts typed on a transaction are created automatically.")
+    
+    accounts = db.get_accounts(user_id)
+    
+    if not accounts.empty:
+        # Each balance is kept in its account's currency; the total converts them at today's rates
+        acc_codes = accounts['currency'].astype(object).fillna(currency)
+        total_balance = db.convert_amounts(accounts['balance'], accounts['currency'],
+                                           [str(datetime.now().date())] * len(accounts), currency).sum()
+        m1, m2 = st.columns(2)
+        m1.metric("Total Balance", utils.format_currency(total_balance, currency))
+        m2.metric("Accounts", len(accounts))
+        
+        def format_balances(values):
+            return pd.concat([utils.format_currency_series(group, code)
+                              for code, group in values.groupby(acc_codes)]).reindex(values.index)
+        
+        st.dataframe(
+            accounts.assign(
+                currency=acc_codes,
+                balance=format_balances(accounts['balance']),
+                opening_balance=format_balances(accounts['opening_balance'].fillna(0)),
+            )[['name', 'type', 'currency', 'balance', 'opening_balance', 'last_activity']]
+            .rename(columns={'name': 'Account', 'type': 'Type', 'currency': 'Currency', 'balance': 'Balance',
+                             'opening_balance': 'Opening Balance', 'last_activity': 'Last Activity'}),
+            width='stretch', hide_index=True)
+    else:
+        st.info("No accounts yet. Add one below or enter an account on a transaction.")
+    
+    col_add, col_edit = st.columns(2)
+    with col_add:
+        with st.expander("➕ Add Account"):
+            with st.form("add_account_form"):
+                a_name = st.text_input("Account Name")
+                a_type = st.selectbox("Type", list(db.ACCOUNT_TYPES))
+                acc_curr_options = [c for c in db.convertible_currencies(currency) if c in utils.CURRENCIES]
+                a_currency = st.selectbox("Currency", acc_curr_options,
+                                          help="The balance is kept in this currency; transactions in others are rejected.")
+                a_opening = st.number_input("Opening Balance", value=0.0, step=100.0)
+                if st.form_submit_button("Add Account"):
+                    if db.add_account(user_id, a_name, a_type, a_opening,
+                                      currency=a_currency if a_currency != currency else None):
+                        st.success(f"Account '{a_name}' added!")
+                        st.rerun()
+                    else:
+                        st.error("Enter a name that is not already used.")
+    
+    with col_edit:
+        if not accounts.empty:
+            with st.expander("✏️ Edit Account"):
+                acc_names = accounts['name'].tolist()
+                sel_acc = st.selectbox("Account", acc_names, key="edit_account_select")
+                acc_row = accounts[accounts['name'] == sel_acc].iloc[0]
+                with st.form("edit_account_form"):
+                    e_name = st.text_input("Account Name", value=acc_row['name'])
+                    type_options = list(db.ACCOUNT_TYPES)
+                    e_type = st.selectbox("Type", type_options,
+                                          index=type_options.index(acc_row['type']) if acc_row['type'] in type_options else 0)
+                    e_opening = st.number_input(f"Opening Balance ({symbol})", value=float(acc_row['opening_balance'] or 0.0), step=100.0)
+                    c1, c2 = st.columns(2)
+                    with c1:
+                        if st.form_submit_button("💾 Update", type="primary"):
+                            if db.update_account(user_id, int(acc_row['id']), e_name, e_type, e_opening):
+                                st.success("Account updated!")
+                                st.rerun()
+                            else:
+                                st.error("Another account already has that name.")
+                    with c2:
+                        if st.form_submit_button("🗑️ Delete"):
+                            if db.delete_account(user_id, int(acc_row['id'])):
+                                st.success("Account deleted!")
+                                st.rerun()
+                            else:
+                                st.error("Accounts used by transactions cannot be deleted.")
+    
+    st.markdown("---")
+    st.subheader("🔄 Reconcile")
+    st.caption("Recomputes every balance from the full transaction history, archived years included, and fixes any drift.")
+    if st.button("🔄 Reconcile Balances"):
+        drift = db.reconcile_accounts(user_id)
+        if drift.empty:
+            st.success("All balances match the transaction history.")
+        else:
+            st.warning(f"Corrected {len(drift)} account balance(s).")
+            st.dataframe(drift, width='stretch', hide_index=True)
+
 # ========== PROFILE PAGE ==========
 elif page == "👤 Profile":
     st.markdown('<div class="main-header">👤 Profile</div>', unsafe_allow_html=True)
@@ -1235,6 +1510,26 @@ elif page == "👤 Profile":
                 st.rerun()
             else:
                 st.error("Failed to update currency.")
+    with c2:
+        st.write("**💱 Exchange Rates**")
+        fx_rates = db.get_fx_rates()
+        if fx_rates.empty:
+            st.caption("No FX rates loaded. Transactions can only be entered in your preferred currency; "
+                       "older ones in other currencies count unconverted in totals.")
+        else:
+            coverage = fx_rates.groupby('currency')['date'].agg(['min', 'max', 'count']).reset_index()
+            st.dataframe(coverage.rename(columns={'currency': 'Currency', 'min': 'From', 'max': 'To', 'count': 'Rates'}),
+                         hide_index=True)
+            st.caption(f"Rates are units of currency per 1 {db.FX_PIVOT_CURRENCY}; each transaction uses the latest rate on or before its date.")
+        if st.session_state.is_admin:
+            fx_file = st.file_uploader("Upload FX rates CSV (date, currency, rate)", type=['csv'], key="fx_upload")
+            if fx_file is not None and st.button("💾 Replace FX Rates"):
+                try:
+                    saved = db.save_fx_rates(pd.read_csv(fx_file))
+                    st.success(f"Loaded {saved} rates.")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Invalid FX rates file: {e}")
                 
     st.markdown("---")
     
@@ -1264,7 +1559,7 @@ elif page == "📈 Analytics":
     st.markdown('<div class="main-header">📈 Analytics</div>', unsafe_allow_html=True)
     
     st.subheader("Quick Views")
-    col1, col2, col3, col4, col5 = st.columns(5)
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
     
     with col1:
         if st.button("📅 Current Month", width='stretch'):
@@ -1283,6 +1578,10 @@ elif page == "📈 Analytics":
             st.session_state.view_type = "ytd"
     
     with col5:
+        if st.button("🗓️ Fiscal Year", width='stretch'):
+            st.session_state.view_type = "fiscal_year"
+    
+    with col6:
         if st.button("🔧 Custom", width='stretch'):
             st.session_state.view_type = "custom"
     
@@ -1290,17 +1589,16 @@ elif page == "📈 Analytics":
         st.session_state.view_type = "current_month"
     
     today = datetime.now().date()
+    fy_start = utils.fiscal_year_start(currency)
     
+    # Period boundaries come from the calendar table
     if st.session_state.view_type == "current_month":
-        analytics_start = today.replace(day=1)
-        next_month = today.replace(day=28) + timedelta(days=4)
-        analytics_end = next_month - timedelta(days=next_month.day)
+        analytics_start, analytics_end = db.get_period_range('month', today)
         view_label = "Current Month"
     
     elif st.session_state.view_type == "previous_month":
-        first_day_current = today.replace(day=1)
-        analytics_end = first_day_current - timedelta(days=1)
-        analytics_start = analytics_end.replace(day=1)
+        current_start, _ = db.get_period_range('month', today)
+        analytics_start, analytics_end = db.get_period_range('month', current_start - timedelta(days=1))
         view_label = "Previous Month"
     
     elif st.session_state.view_type == "quarterly":
@@ -1314,19 +1612,32 @@ elif page == "📈 Analytics":
         q_map = {"Q1 (Jan-Mar)": 1, "Q2 (Apr-Jun)": 2, "Q3 (Jul-Sep)": 3, "Q4 (Oct-Dec)": 4}
         q_num = q_map[q_select]
         
-        analytics_start = datetime(q_year, 3 * q_num - 2, 1).date()
-        if q_num == 4:
-            analytics_end = datetime(q_year, 12, 31).date()
-        else:
-            analytics_end = (datetime(q_year, 3 * q_num + 1, 1) - timedelta(days=1)).date()
-            
+        analytics_start, analytics_end = db.get_period_range('quarter', datetime(q_year, 3 * q_num - 2, 1).date())
         view_label = f"{q_select} {q_year}"
     
     elif st.session_state.view_type == "ytd":
-        analytics_start = datetime(today.year, 1, 1).date()
+        analytics_start, _ = db.get_period_range('year', today)
         analytics_end = today
         view_label = "Year to Date"
     
+    elif st.session_state.view_type == "fiscal_year":
+        st.markdown("---")
+        current_fy_start, _ = db.get_period_range('fiscal_year', today, fy_start)
+        c1, c2 = st.columns(2)
+        with c1:
+            fy_year = st.number_input("Fiscal Year (starting)", min_value=2000, max_value=2099, value=current_fy_start.year, key="fy_year_select")
+        with c2:
+            fy_quarter = st.selectbox("Quarter", ["Full Year", "Q1", "Q2", "Q3", "Q4"], key="fy_quarter_select")
+        
+        fy_first_day = datetime(fy_year, fy_start, 1).date()
+        if fy_quarter == "Full Year":
+            analytics_start, analytics_end = db.get_period_range('fiscal_year', fy_first_day, fy_start)
+        else:
+            # Any day ~1.5 months into the quarter identifies it
+            q_day = fy_first_day + timedelta(days=91 * (int(fy_quarter[1]) - 1) + 45)
+            analytics_start, analytics_end = db.get_period_range('fiscal_quarter', q_day, fy_start)
+        view_label = utils.fiscal_year_label(fy_year, fy_start) + ("" if fy_quarter == "Full Year" else f" {fy_quarter}")
+    
     else:
         st.markdown("---")
         col1, col2 = st.columns(2)
@@ -1340,9 +1651,11 @@ elif page == "📈 Analytics":
     
     st.markdown("---")
     
-    summary = db.get_summary(user_id, str(analytics_start), str(analytics_end))
+    # Load the period-dependent queries of every tab concurrently
+    analytics = db.get_analytics_data(user_id, str(analytics_start), str(analytics_end))
+    summary = analytics.summary
     
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9, tab10 = st.tabs(["📊 Overview", "💰 Income & Expense", "📈 Invest & Debt", "💳 Credit Card", "🚗 Vehicle Tracking", "⚖️ Comparison", "🔮 Forecast", "📺 Subscriptions", "🏠 Rent", "👤 Self Expenses"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9, tab10, tab11 = st.tabs(["📊 Overview", "💰 Income & Expense", "📈 Invest & Debt", "💳 Credit Card", "🚗 Vehicle Tracking", "⚖️ Comparison", "🔮 Forecast", "📺 Subscriptions", "🏠 Rent", "👤 Self Expenses", "🚨 Anomalies"])
     
     with tab1:
         col1, col2, col3, col4, col5 = st.columns(5)
@@ -1363,44 +1676,32 @@ elif page == "📈 Analytics":
         
         with col5:
             savings_rate = (summary['net_savings'] / summary['total_income'] * 100) if summary['total_income'] > 0 else 0
-            st.metric("💰 Savings", f"₹{summary['net_savings']:,.0f}", delta=f"{savings_rate:.1f}%")
+            st.metric("💰 Savings", utils.format_currency(summary['net_savings'], currency), delta=f"{savings_rate:.1f}%")
         
         st.markdown("---")
         
         st.subheader("Monthly Trend")
-        trend_data = db.get_monthly_trend(user_id, str(analytics_start), str(analytics_end))
+        trend_data = analytics.monthly_trend
         
         if not trend_data.empty:
             pivot = trend_data.pivot(index='month', columns='type', values='total').fillna(0)
             
-            fig = go.Figure()
-            
-            for col in pivot.columns:
-                color_map = {
-                    'Income': '#2ecc71',
-                    'Expense': '#e74c3c',
-                    'Investment': '#3498db',
-                    'Credit Card': '#e67e22',
-                    'Debt': '#c0392b',
-                    'Vehicle': '#7f8c8d',
-                    'Banking': '#9b59b6'
-                }
-                fig.add_trace(go.Scatter(
-                    x=pivot.index,
-                    y=pivot[col],
-                    mode='lines+markers',
-                    name=col,
-                    line=dict(color=color_map.get(col, '#95a5a6'), width=3),
-                    marker=dict(size=8)
-                ))
-            
-            fig.update_layout(
+            color_map = {
+                'Income': '#2ecc71',
+                'Expense': '#e74c3c',
+                'Investment': '#3498db',
+                'Credit Card': '#e67e22',
+                'Debt': '#c0392b',
+                'Vehicle': '#7f8c8d',
+                'Banking': '#9b59b6'
+            }
+            fig = charts.cached_figure(charts.build_trend_lines, pivot, color_map=color_map, layout=dict(
                 title=f'Monthly Trend - {view_label}',
                 xaxis_title='Month',
-                yaxis_title='Amount (₹)',
+                yaxis_title=f'Amount ({symbol})',
                 hovermode='x unified',
                 height=500
-            )
+            ))
             
             st.plotly_chart(fig, use_container_width=True)
         else:
@@ -1411,7 +1712,7 @@ elif page == "📈 Analytics":
         
         with col1:
             st.subheader("Top Expenses")
-            expense_breakdown = db.get_category_breakdown(user_id, 'Expense', str(analytics_start), str(analytics_end))
+            expense_breakdown = analytics.expense_breakdown
             if not expense_breakdown.empty:
                 fig = px.bar(expense_breakdown.head(10), x='category', y='total',
                             title='Top 10 Expense Categories',
@@ -1424,7 +1725,7 @@ elif page == "📈 Analytics":
         
         with col2:
             st.subheader("Income Sources")
-            income_breakdown = db.get_category_breakdown(user_id, 'Income', str(analytics_start), str(analytics_end))
+            income_breakdown = analytics.income_breakdown
             if not income_breakdown.empty:
                 fig = px.pie(income_breakdown, values='total', names='category',
                             title='Income Distribution',
@@ -1438,7 +1739,7 @@ elif page == "📈 Analytics":
         
         with col1:
             st.subheader("Investment Breakdown")
-            investment_breakdown = db.get_category_breakdown(user_id, 'Investment', str(analytics_start), str(analytics_end))
+            investment_breakdown = analytics.investment_breakdown
 
             # FIX: Show Lifetime Portfolio Value, not just current period investment
             # investment_breakdown = db.get_category_breakdown(user_id, 'Investment')
@@ -1454,14 +1755,14 @@ elif page == "📈 Analytics":
             st.subheader("Total Liabilities Breakdown (Outstanding)")
             
             # Fetch ALL debts for Balance Sheet view
-            all_debts_analytics = db.get_transactions(user_id, trans_type='Debt')
+            all_debts_analytics = analytics.debts.copy()
             if not all_debts_analytics.empty:
                 # Calculate outstanding
                 all_debts_analytics['pid'] = all_debts_analytics['paid_amount'].fillna(0)
                 all_debts_analytics['outstanding'] = all_debts_analytics['amount'] - all_debts_analytics['pid']
                 
                 # 1. Total Liabilities by Category (Pie Chart)
-                debt_breakdown = all_debts_analytics.groupby('category')['outstanding'].sum().reset_index()
+                debt_breakdown = all_debts_analytics.groupby('category', observed=True)['outstanding'].sum().reset_index()
                 debt_breakdown.columns = ['category', 'total']
                 debt_breakdown = debt_breakdown[debt_breakdown['total'] > 0] 
                 
@@ -1481,7 +1782,7 @@ elif page == "📈 Analytics":
                 st.subheader("🏦 Active Loans Breakdown")
                 
                 # Filter for only "Loan" categories
-                loan_cats_df = db.get_categories(user_id, 'Debt')
+                loan_cats_df = analytics.debt_categories
                 # Check if 'is_loan' column exists (it should based on schema)
                 if 'is_loan' in loan_cats_df.columns:
                     loan_cat_names = loan_cats_df[loan_cats_df['is_loan'] == 1]['name'].tolist()
@@ -1500,7 +1801,7 @@ elif page == "📈 Analytics":
                     
                     fig_loans = px.bar(active_loans, x='label', y='outstanding',
                                       title='Outstanding Balance by Loan Account',
-                                      labels={'outstanding': 'Outstanding Amount (₹)', 'label': 'Loan'},
+                                      labels={'outstanding': f'Outstanding Amount ({symbol})', 'label': 'Loan'},
                                       color='outstanding',
                                       color_continuous_scale='Reds',
                                       text_auto='.2s')
@@ -1516,6 +1817,82 @@ elif page == "📈 Analytics":
         cc_start = datetime(cc_year, 1, 1).date()
         cc_end = datetime(cc_year, 12, 31).date()
         
+        # --- Statement cycles ---
+        st.markdown("### 🧾 Statement Cycles")
+        card_cycles = db.get_card_cycles(user_id)
+        
+        with st.expander("⚙️ Card Cycle Settings", expanded=card_cycles.empty):
+            st.caption("Spend marked 'Paid via Credit Card' goes to the card named in its account, otherwise to the default card. "
+                       "Bill payments (type Credit Card) count towards the statement closed before them.")
+            cc_accounts = db.get_accounts(user_id)
+            card_names = sorted(set(db.get_categories(user_id, 'Credit Card')['name'].tolist())
+                                | set(cc_accounts.loc[cc_accounts['type'] == 'Credit Card', 'name'].tolist())
+                                | set(card_cycles['card'].tolist()))
+            with st.form("card_cycle_form"):
+                f1, f2, f3 = st.columns(3)
+                with f1:
+                    if card_names:
+                        cycle_card = st.selectbox("Card", card_names)
+                    else:
+                        cycle_card = st.text_input("Card")
+                with f2:
+                    cycle_stmt_day = st.number_input("Statement Day", min_value=1, max_value=28, value=15)
+                with f3:
+                    cycle_due_day = st.number_input("Due Day", min_value=1, max_value=28, value=5)
+                cycle_default = st.checkbox("Default card for unmatched card spend", value=card_cycles.empty)
+                if st.form_submit_button("💾 Save Cycle"):
+                    if db.save_card_cycle(user_id, cycle_card, cycle_stmt_day, cycle_due_day, cycle_default):
+                        st.success(f"Cycle saved for {cycle_card}")
+                        st.rerun()
+                    else:
+                        st.error("Enter a card name.")
+            
+            if not card_cycles.empty:
+                st.dataframe(card_cycles[['card', 'statement_day', 'due_day', 'is_default']]
+                             .rename(columns={'card': 'Card', 'statement_day': 'Statement Day', 'due_day': 'Due Day', 'is_default': 'Default'}),
+                             width='stretch', hide_index=True)
+                rm1, rm2 = st.columns([3, 1])
+                with rm1:
+                    remove_card = st.selectbox("Remove cycle", card_cycles['card'].tolist(), key="remove_card_cycle")
+                with rm2:
+                    if st.button("🗑️ Remove", key="remove_card_cycle_btn"):
+                        db.delete_card_cycle(user_id, int(card_cycles.loc[card_cycles['card'] == remove_card, 'id'].iloc[0]))
+                        st.rerun()
+        
+        if not card_cycles.empty:
+            outlook = db.get_card_outlook(user_id)
+            for _, card_row in outlook.iterrows():
+                o1, o2, o3 = st.columns(3)
+                o1.metric(f"💳 {card_row['card']} · Unbilled", utils.format_currency(card_row['unbilled'], currency),
+                          help=f"Next statement on {card_row['next_statement']}")
+                if card_row['due_date']:
+                    o2.metric("Amount Due", utils.format_currency(card_row['due_amount'], currency),
+                              f"{card_row['status']} · due {card_row['due_date']}",
+                              delta_color="inverse" if card_row['status'] == 'Overdue' else "off")
+                o3.metric("Next Statement", card_row['next_statement'])
+            
+            statements = db.get_card_statements(user_id, start_date=str(cc_start), end_date=str(cc_end))
+            if not statements.empty:
+                fig_stmt = charts.cached_figure(px.bar, charts.downsample(statements, 'amount', group='card'), x='cycle_end', y='amount', color='card',
+                                                title=f'Statements per Cycle ({cc_year})',
+                                                labels={'amount': f'Statement ({symbol})', 'cycle_end': 'Statement Date', 'card': 'Card'},
+                                                layout=dict(barmode='group'))
+                st.plotly_chart(fig_stmt, use_container_width=True)
+                st.dataframe(
+                    statements.assign(
+                        amount=utils.format_currency_series(statements['amount'], currency),
+                        paid=utils.format_currency_series(statements['paid'], currency),
+                        # First cycle of a card has nothing to compare with
+                        change=utils.format_currency_series(statements['change'], currency).where(statements['change'].notna(), ''),
+                    )[['card', 'cycle_start', 'cycle_end', 'due_date', 'amount', 'paid', 'change', 'txn_count', 'status']]
+                    .rename(columns={'card': 'Card', 'cycle_start': 'From', 'cycle_end': 'Statement Date', 'due_date': 'Due',
+                                     'amount': 'Amount', 'paid': 'Paid', 'change': 'vs Previous', 'txn_count': 'Txns', 'status': 'Status'}),
+                    width='stretch', hide_index=True)
+            else:
+                st.info(f"No card spend in statement cycles ending in {cc_year}")
+        
+        st.markdown("---")
+        
         cc_trend = db.get_monthly_category_trend(user_id, 'Credit Card', str(cc_start), str(cc_end))
         
         if not cc_trend.empty:
@@ -1534,21 +1911,20 @@ elif page == "📈 Analytics":
             min_month_val = monthly_totals.min()
             
             m1, m2, m3, m4 = st.columns(4)
-            m1.metric("Total Spends", f"₹{total_spend:,.0f}")
-            m2.metric("Monthly Average", f"₹{avg_monthly:,.0f}")
-            m3.metric("Highest Month", f"{max_month}", f"₹{max_month_val:,.0f}")
-            m4.metric("Lowest Month", f"{min_month}", f"₹{min_month_val:,.0f}")
+            m1.metric("Total Spends", utils.format_currency(total_spend, currency))
+            m2.metric("Monthly Average", utils.format_currency(avg_monthly, currency))
+            m3.metric("Highest Month", f"{max_month}", utils.format_currency(max_month_val, currency))
+            m4.metric("Lowest Month", f"{min_month}", utils.format_currency(min_month_val, currency))
             
 
             
             st.markdown("---")
             
             st.markdown("### 📊 Monthly Spend by Card")
-            fig1 = px.bar(cc_trend, x='month', y='total', color='category',
+            fig1 = charts.cached_figure(px.bar, charts.downsample(cc_trend, 'total', group='category'), x='month', y='total', color='category',
                         title='Monthly Breakdown by Card',
-                        labels={'total': 'Amount (₹)', 'month': 'Month', 'category': 'Card'},
-                        text_auto='.2s')
-            fig1.update_layout(barmode='stack')
+                        labels={'total': f'Amount ({symbol})', 'month': 'Month', 'category': 'Card'},
+                        text_auto='.2s', layout=dict(barmode='stack'))
             st.plotly_chart(fig1, use_container_width=True)
             
             # --- New Total Trend Chart ---
@@ -1557,23 +1933,13 @@ elif page == "📈 Analytics":
             # Reset index for plotting if not already done (it is done later for MoM but we need it here)
             # Use a fresh copy to avoid conflicts with downstream logic
             mt_plot = cc_trend.groupby('month')['total'].sum().reset_index()
+            mt_plot['label'] = utils.format_currency_series(mt_plot['total'], currency)
             
-            fig_total = px.line(mt_plot, x='month', y='total', markers=True,
+            # Line + text label overlay
+            fig_total = charts.cached_figure(charts.build_line_with_labels, mt_plot, x='month', y='total', text='label',
                                title='Total Monthly Credit Card Bill Trend',
-                               labels={'total': 'Total Bill Amount (₹)', 'month': 'Month'})
-            fig_total.update_traces(line_color='#e74c3c', line_width=4, marker=dict(size=10))
-            fig_total.update_layout(hovermode='x unified')
-            # Add text labels
-            fig_total.add_trace(go.Scatter(
-                x=mt_plot['month'], 
-                y=mt_plot['total'],
-                mode='text',
-                text=[f"₹{x:,.0f}" for x in mt_plot['total']],
-                textposition='top center',
-                showlegend=False,
-                textfont=dict(size=12, color='white')
-            ))
-            fig_total.update_layout(margin=dict(t=30, b=10))
+                               labels={'total': f'Total Bill Amount ({symbol})', 'month': 'Month'},
+                               layout=dict(margin=dict(t=30, b=10)))
             
             st.plotly_chart(fig_total, use_container_width=True)
             # -----------------------------
@@ -1583,7 +1949,7 @@ elif page == "📈 Analytics":
             with col_g1:
                 st.markdown("### 💳 Total Spend per Card")
                 card_totals = cc_trend.groupby('category')['total'].sum().reset_index()
-                fig2 = px.pie(card_totals, values='total', names='category', hole=0.4)
+                fig2 = charts.cached_figure(px.pie, card_totals, values='total', names='category', hole=0.4)
                 st.plotly_chart(fig2, use_container_width=True)
                 
             with col_g2:
@@ -1601,10 +1967,10 @@ elif page == "📈 Analytics":
                         x=mom_data['month'],
                         y=mom_data['diff'],
                         marker_color=mom_data['color'],
-                        text=mom_data['diff'].apply(lambda x: f"₹{x:,.0f}"),
+                        text=utils.format_currency_series(mom_data['diff'], currency),
                         textposition='auto'
                     ))
-                    fig3.update_layout(title="Change from Previous Month", yaxis_title="Difference (₹)")
+                    fig3.update_layout(title="Change from Previous Month", yaxis_title=f"Difference ({symbol})")
                     st.plotly_chart(fig3, use_container_width=True)
                 else:
                     st.info("Not enough data for MoM comparison")
@@ -1620,10 +1986,10 @@ elif page == "📈 Analytics":
             
             if selected_card:
                 card_data = cc_trend[cc_trend['category'] == selected_card]
-                fig_card = px.line(card_data, x='month', y='total', markers=True,
+                fig_card = charts.cached_figure(px.line, charts.downsample(card_data, 'total'), x='month', y='total', markers=True,
                                   title=f'{selected_card} - Monthly Trend',
-                                  labels={'total': 'Amount (₹)', 'month': 'Month'})
-                fig_card.update_traces(line_color='#8e44ad', line_width=3)
+                                  labels={'total': f'Amount ({symbol})', 'month': 'Month'},
+                                  traces=dict(line_color='#8e44ad', line_width=3))
                 st.plotly_chart(fig_card, use_container_width=True)
 
             st.markdown("### 🔮 Next Year Prediction (Trend-Based)")
@@ -1643,7 +2009,7 @@ elif page == "📈 Analytics":
                     z = np.polyfit(trend_df['month_num'], trend_df['total'], 1)
                     p = np.poly1d(z)
                     
-                    st.info(f"Projected spending for {cc_year + 1} based on current trend (Slope: ₹{z[0]:.2f}/month).")
+                    st.info(f"Projected spending for {cc_year + 1} based on current trend (Slope: {symbol}{z[0]:.2f}/month).")
                     
                     last_month_num = trend_df['month_num'].iloc[-1]
                     
@@ -1672,7 +2038,7 @@ elif page == "📈 Analytics":
                 line=dict(color='#9b59b6', dash='dash'),
                 fill='tozeroy'
             ))
-            fig4.update_layout(title=f"Projected Spending for {cc_year + 1}", yaxis_title="Amount (₹)")
+            fig4.update_layout(title=f"Projected Spending for {cc_year + 1}", yaxis_title=f"Amount ({symbol})")
             st.plotly_chart(fig4, use_container_width=True)
             
         else:
@@ -1680,9 +2046,9 @@ elif page == "📈 Analytics":
 
     with tab5:
         st.subheader("🚗 Vehicle Tracking")
-        st.metric("Total Vehicle Spend", f"₹{summary['total_vehicle']:,.0f}")
+        st.metric("Total Vehicle Spend", utils.format_currency(summary['total_vehicle'], currency))
         
-        vehicle_breakdown = db.get_category_breakdown(user_id, 'Vehicle', str(analytics_start), str(analytics_end))
+        vehicle_breakdown = analytics.vehicle_breakdown
         if not vehicle_breakdown.empty:
             fig = px.bar(vehicle_breakdown, x='category', y='total',
                         title='Vehicle Expenses Breakdown',
@@ -1730,14 +2096,14 @@ elif page == "📈 Analytics":
         
         c1, c2, c3 = st.columns(3)
         with c1:
-            st.metric("Income Difference", f"₹{p2_summary['total_income']:,.0f}", 
-                     delta=f"₹{p2_summary['total_income'] - p1_summary['total_income']:,.0f}")
+            st.metric("Income Difference", utils.format_currency(p2_summary['total_income'], currency), 
+                     delta=utils.format_currency(p2_summary['total_income'] - p1_summary['total_income'], currency))
         with c2:
-            st.metric("Expense Difference", f"₹{p2_summary['total_expense']:,.0f}", 
-                     delta=f"₹{p2_summary['total_expense'] - p1_summary['total_expense']:,.0f}", delta_color="inverse")
+            st.metric("Expense Difference", utils.format_currency(p2_summary['total_expense'], currency), 
+                     delta=utils.format_currency(p2_summary['total_expense'] - p1_summary['total_expense'], currency), delta_color="inverse")
         with c3:
-            st.metric("Savings Difference", f"₹{p2_summary['net_savings']:,.0f}", 
-                     delta=f"₹{p2_summary['net_savings'] - p1_summary['net_savings']:,.0f}")
+            st.metric("Savings Difference", utils.format_currency(p2_summary['net_savings'], currency), 
+                     delta=utils.format_currency(p2_summary['net_savings'] - p1_summary['net_savings'], currency))
              
         st.subheader("Comparison Chart")
         
@@ -1757,7 +2123,7 @@ elif page == "📈 Analytics":
         st.subheader("🔮 12-Month Forecast (Reference)")
         st.info("This forecast is based on your historical average monthly income and expenses.")
         
-        trend_all = db.get_monthly_trend(user_id)
+        trend_all = analytics.lifetime_trend
         
         if not trend_all.empty:
             monthly_stats = trend_all.groupby('type')['total'].mean()
@@ -1765,7 +2131,7 @@ elif page == "📈 Analytics":
             avg_expense = monthly_stats.get('Expense', 0)
             avg_savings = avg_income - avg_expense
             
-            st.write(f"**Historical Monthly Average:** Income: ₹{avg_income:,.0f} | Expense: ₹{avg_expense:,.0f} | Savings: ₹{avg_savings:,.0f}")
+            st.write(f"**Historical Monthly Average:** Income: {utils.format_currency(avg_income, currency)} | Expense: {utils.format_currency(avg_expense, currency)} | Savings: {utils.format_currency(avg_savings, currency)}")
             
             forecast_months = []
             forecast_income = []
@@ -1793,12 +2159,12 @@ elif page == "📈 Analytics":
                 line=dict(color='#e74c3c', dash='dash')
             ))
             
-            fig.update_layout(title="Projected Income & Expense (Next 12 Months)", xaxis_title="Month", yaxis_title="Amount (₹)")
+            fig.update_layout(title="Projected Income & Expense (Next 12 Months)", xaxis_title="Month", yaxis_title=f"Amount ({symbol})")
             st.plotly_chart(fig, use_container_width=True)
             
             st.subheader("💰 Projected Cumulative Savings")
             fig2 = px.area(x=forecast_months, y=forecast_savings, title="Projected Cumulative Savings Growth",
-                          labels={'x': 'Month', 'y': 'Cumulative Savings (₹)'})
+                          labels={'x': 'Month', 'y': f'Cumulative Savings ({symbol})'})
             fig2.update_traces(line_color='#2980b9')
             st.plotly_chart(fig2, use_container_width=True)
             
@@ -1810,7 +2176,7 @@ elif page == "📈 Analytics":
         
         # Get Subscriptions Data
         # Updated to respect Quick View filters
-        ott_trend = db.get_monthly_category_trend(user_id, 'Subscriptions', str(analytics_start), str(analytics_end))
+        ott_trend = analytics.subscriptions_trend
         
         if ott_trend.empty:
             st.info("No Subscriptions data found.")
@@ -1820,8 +2186,8 @@ elif page == "📈 Analytics":
             avg_ott = total_ott / months_active if months_active > 0 else 0
             
             c1, c2 = st.columns(2)
-            c1.metric("Total Subs Spend", f"₹{total_ott:,.0f}")
-            c2.metric("Monthly Average", f"₹{avg_ott:,.0f}")
+            c1.metric("Total Subs Spend", utils.format_currency(total_ott, currency))
+            c2.metric("Monthly Average", utils.format_currency(avg_ott, currency))
             
             st.divider()
             
@@ -1830,32 +2196,21 @@ elif page == "📈 Analytics":
             with col_chart1:
                 st.markdown("### Cost by Platform")
                 cat_split = ott_trend.groupby('category')['total'].sum().reset_index()
-                fig_ott_pie = px.pie(cat_split, values='total', names='category', hole=0.4)
+                fig_ott_pie = charts.cached_figure(px.pie, cat_split, values='total', names='category', hole=0.4)
                 st.plotly_chart(fig_ott_pie, use_container_width=True)
                 
             with col_chart2:
                 st.markdown("### Monthly Trend")
                 monthly_ott = ott_trend.groupby('month')['total'].sum().reset_index()
-                fig_ott_bar = px.bar(monthly_ott, x='month', y='total', text_auto='.0f')
+                fig_ott_bar = charts.cached_figure(px.bar, charts.downsample(monthly_ott, 'total'), x='month', y='total', text_auto='.0f')
                 st.plotly_chart(fig_ott_bar, use_container_width=True)
 
     with tab9:
         st.subheader("🏠 Rent Tracking")
         st.info("Tracks expenses where category starts with 'Rent'.")
         
-        # Logic: Get Monthly Category Trend for Expense, then filter result
-        # This gives us monthly buckets. 
-        # But wait, we also want total breakdown by Rent Type (e.g. Rent Home vs Rent Office)
-        
-        # 1. Fetch ALL expense trend data for the period (lowest granularity if possible? No, monthly is fine for trend)
-        # Actually, get_monthly_category_trend groups by Month, Category. Perfect.
-        
-        rent_trend = db.get_monthly_category_trend(user_id, 'Expense', str(analytics_start), str(analytics_end))
-        
-        if not rent_trend.empty:
-            # Filter for categories starting with "Rent"
-            # Using case-insensitive match for robustness
-            rent_trend = rent_trend[rent_trend['category'].str.startswith("Rent", na=False) | rent_trend['category'].str.startswith("rent", na=False)]
+        # Filtered in SQL: Expense rows whose category starts with 'Rent' (case-insensitive)
+        rent_trend = analytics.rent_trend
             
         if rent_trend.empty:
              st.info("No Rent-related expenses found for this period.")
@@ -1866,8 +2221,8 @@ elif page == "📈 Analytics":
             avg_rent = total_rent / months_active if months_active > 0 else 0
             
             c1, c2 = st.columns(2)
-            c1.metric("Total Rent Paid", f"₹{total_rent:,.0f}")
-            c2.metric("Monthly Average", f"₹{avg_rent:,.0f}")
+            c1.metric("Total Rent Paid", utils.format_currency(total_rent, currency))
+            c2.metric("Monthly Average", utils.format_currency(avg_rent, currency))
             
             st.divider()
             
@@ -1876,40 +2231,34 @@ elif page == "📈 Analytics":
             with col_r1:
                  st.markdown("### Cost by Type")
                  rent_split = rent_trend.groupby('category')['total'].sum().reset_index()
-                 fig_rent_pie = px.pie(rent_split, values='total', names='category', hole=0.4)
+                 fig_rent_pie = charts.cached_figure(px.pie, rent_split, values='total', names='category', hole=0.4)
                  st.plotly_chart(fig_rent_pie, use_container_width=True)
             
             with col_r2:
                 st.markdown("### Monthly Trend")
                 monthly_rent = rent_trend.groupby('month')['total'].sum().reset_index()
-                fig_rent_bar = px.bar(monthly_rent, x='month', y='total', text_auto='.0f', title="Total Rent per Month")
+                fig_rent_bar = charts.cached_figure(px.bar, charts.downsample(monthly_rent, 'total'), x='month', y='total', text_auto='.0f', title="Total Rent per Month")
                 st.plotly_chart(fig_rent_bar, use_container_width=True)
 
     with tab10:
         st.subheader("👤 Self Expenses Tracking")
         st.info("Tracks expenses marked as 'Self / Personal'. These are specific to you and not shared.")
         
-        # Logic: Fetch all expenses, then filter by is_self = 1
-        # reusing get_monthly_category_trend won't give us the is_self column if it aggregates.
-        # So we need to fetch transactions directly.
-        
-        self_trans = db.get_transactions(user_id, str(analytics_start), str(analytics_end), trans_type='Expense')
-        
-        if not self_trans.empty and 'is_self' in self_trans.columns:
-            self_trans = self_trans[self_trans['is_self'] == 1]
+        # Aggregated in SQL over Expense rows with is_self = 1
+        self_split = analytics.self_by_category
+        monthly_self = analytics.self_by_month
             
-        if self_trans.empty:
+        if self_split.empty:
              st.info("No Self Expenses found for this period.")
         else:
-            total_self = self_trans['amount'].sum()
+            total_self = self_split['total'].sum()
             # Monthly Average
-            self_trans['month'] = pd.to_datetime(self_trans['date']).dt.strftime('%Y-%m')
-            months_active = len(self_trans['month'].unique())
+            months_active = len(monthly_self)
             avg_self = total_self / months_active if months_active > 0 else 0
             
             c1, c2 = st.columns(2)
-            c1.metric("Total Self Expenses", f"₹{total_self:,.0f}")
-            c2.metric("Monthly Average", f"₹{avg_self:,.0f}")
+            c1.metric("Total Self Expenses", utils.format_currency(total_self, currency))
+            c2.metric("Monthly Average", utils.format_currency(avg_self, currency))
             
             st.divider()
             
@@ -1917,17 +2266,61 @@ elif page == "📈 Analytics":
             
             with col_s1:
                  st.markdown("### Cost by Category")
-                 self_split = self_trans.groupby('category')['amount'].sum().reset_index()
-                 fig_self_pie = px.pie(self_split, values='amount', names='category', hole=0.4)
+                 fig_self_pie = charts.cached_figure(px.pie, self_split, values='total', names='category', hole=0.4)
                  st.plotly_chart(fig_self_pie, use_container_width=True)
             
             with col_s2:
                 st.markdown("### Monthly Trend")
-                monthly_self = self_trans.groupby('month')['amount'].sum().reset_index()
-                fig_self_bar = px.bar(monthly_self, x='month', y='amount', text_auto='.0f', title="Total Self Expenses per Month")
-                st.update_layout = fig_self_bar.update_layout(xaxis_title="Month", yaxis_title="Amount (₹)")
+                fig_self_bar = charts.cached_figure(px.bar, charts.downsample(monthly_self, 'total'), x='month', y='total', text_auto='.0f', title="Total Self Expenses per Month",
+                                                    layout=dict(xaxis_title="Month", yaxis_title=f"Amount ({symbol})"))
                 st.plotly_chart(fig_self_bar, use_container_width=True)
 
+    with tab11:
+        st.subheader("🚨 Spending Anomalies")
+        st.info("Each category's monthly spend is compared with its own last 12 months (median and spread) and with the same "
+                "month in earlier years, so seasonal bills are not flagged. Independent of the date range above.")
+
+        col_a1, col_a2 = st.columns(2)
+        with col_a1:
+            anomaly_threshold = st.slider("Sensitivity (z-score threshold)", 2.0, 6.0, anomalies.THRESHOLD, 0.5,
+                                          help="Lower values flag smaller deviations")
+        with col_a2:
+            anomaly_months = st.slider("Months to check", 1, 12, 3)
+
+        # One scored matrix for the table and the heatmap (reused until budget_usage changes)
+        anomaly_analysis = anomalies.analyze(user_id)
+        found = anomalies.detect_anomalies(user_id, recent_months=anomaly_months, threshold=anomaly_threshold,
+                                           analysis=anomaly_analysis)
+        if found.empty:
+            st.success("✅ No unusual category spending in this period.")
+        else:
+            c1, c2 = st.columns(2)
+            c1.metric("Spikes", int((found['direction'] == 'spike').sum()))
+            c2.metric("Drops", int((found['direction'] == 'drop').sum()))
+            st.dataframe(found.assign(
+                direction=found['direction'].map({'spike': '🔺 Spike', 'drop': '🔻 Drop'}),
+                amount=utils.format_currency_series(found['amount'], currency),
+                expected=utils.format_currency_series(found['expected'], currency),
+                z=found['z'].round(1),
+                seasonal_z=found['seasonal_z'].round(1),
+            ).rename(columns={'month': 'Month', 'type': 'Type', 'category': 'Category', 'amount': 'Spent',
+                              'expected': 'Expected', 'z': 'Z-Score', 'seasonal_z': 'Seasonal Z', 'direction': 'Direction'}),
+                width='stretch', hide_index=True)
+
+        zscores = anomalies.zscore_frame(user_id, analysis=anomaly_analysis)
+        if not zscores.empty and zscores.notna().any().any():
+            st.markdown("### Deviation Heatmap (last 24 months)")
+            # Only categories that stood out at least once, strongest first
+            peaks = zscores.abs().max().dropna()
+            shown = zscores[peaks[peaks >= 2].sort_values(ascending=False).index[:30]]
+            if shown.empty:
+                st.caption("No category moved more than 2 deviations from its usual level.")
+            else:
+                fig_z = charts.cached_figure(px.imshow, shown.T.clip(-6, 6), color_continuous_scale='RdBu_r', zmin=-6, zmax=6,
+                                             aspect='auto', labels=dict(x="Month", y="Category", color="Z"),
+                                             layout=dict(height=max(300, 24 * shown.shape[1])))
+                st.plotly_chart(fig_z, width='stretch')
+
 
 
 
@@ -1948,16 +2341,16 @@ elif page == "💼 Portfolio":
     st.markdown(f"""
     <div style="background: linear-gradient(135deg, #2c3e50 0%, #4ca1af 100%); padding: 30px; border-radius: 15px; color: white; text-align: center; margin-bottom: 30px; box-shadow: 0 4px 15px rgba(0,0,0,0.1);">
         <h3 style="margin:0; font-weight: 300; opacity: 0.9;">NET WORTH</h3>
-        <h1 style="margin:10px 0; font-size: 4rem; font-weight: 700;">₹{net_worth:,.0f}</h1>
+        <h1 style="margin:10px 0; font-size: 4rem; font-weight: 700;">{utils.format_currency(net_worth, currency)}</h1>
         <div style="display: flex; justify-content: center; gap: 40px; margin-top: 15px;">
             <div>
                 <span style="font-size: 0.9rem; opacity: 0.8;">TOTAL ASSETS</span><br>
-                <span style="font-size: 1.5rem; font-weight: bold;">₹{total_assets:,.0f}</span>
+                <span style="font-size: 1.5rem; font-weight: bold;">{utils.format_currency(total_assets, currency)}</span>
             </div>
             <div style="border-left: 1px solid rgba(255,255,255,0.3);"></div>
             <div>
                 <span style="font-size: 0.9rem; opacity: 0.8;">TOTAL LIABILITIES</span><br>
-                <span style="font-size: 1.5rem; font-weight: bold;">₹{total_liabs:,.0f}</span>
+                <span style="font-size: 1.5rem; font-weight: bold;">{utils.format_currency(total_liabs, currency)}</span>
             </div>
         </div>
     </div>
@@ -1972,7 +2365,7 @@ elif page == "💼 Portfolio":
         
         # Breakdown
         for name, val in assets.items():
-            st.metric(name, f"₹{val:,.0f}")
+            st.metric(name, utils.format_currency(val, currency))
         
         # Donut Chart
         if total_assets > 0:
@@ -1989,7 +2382,7 @@ elif page == "💼 Portfolio":
             if not invest_data.empty:
                fig_inv = px.bar(invest_data, x='category', y='total', 
                                text_auto='.2s', 
-                               labels={'total': 'Amount (₹)', 'category': 'Mode'},
+                               labels={'total': f'Amount ({symbol})', 'category': 'Mode'},
                                color='category')
                fig_inv.update_layout(showlegend=False, height=300)
                st.plotly_chart(fig_inv, use_container_width=True)
@@ -2001,7 +2394,7 @@ elif page == "💼 Portfolio":
         
         # Breakdown
         for name, val in liabs.items():
-            st.metric(name, f"₹{val:,.0f}")
+            st.metric(name, utils.format_currency(val, currency))
             
         # Bar Chart
         if total_liabs > 0:
@@ -2096,6 +2489,62 @@ elif page == "⚙️ Settings":
                     else:
                         st.info("Cannot delete yourself")
 
+    st.subheader("🧬 Suspected Duplicates")
+    st.caption(f"Transactions with the same amount and description within {db.DUPLICATE_WINDOW_DAYS} days of each other.")
+    clusters = db.get_duplicate_clusters(user_id)
+    if clusters.empty:
+        st.success("No suspected duplicates found.")
+    else:
+        st.warning(f"{clusters['cluster'].nunique()} suspected duplicate group(s), {len(clusters)} transactions")
+        for cluster_id, group in list(clusters.groupby('cluster'))[:20]:
+            first = group.iloc[0]
+            with st.expander(f"{first['description'] or first['category']} · {utils.format_currency(first['amount'], currency)} · {len(group)} entries"):
+                for _, row in group.iterrows():
+                    c1, c2 = st.columns([4, 1])
+                    c1.write(f"{row['date']:%d-%b-%Y} | {row['type']} / {row['category']} | {row['account'] if pd.notna(row['account']) else '-'} (ID {row['id']})")
+                    if c2.button("🗑️ Delete", key=f"dup_del_{row['id']}"):
+                        if st.session_state.username == 'demouser':
+                            st.error("Demo User cannot delete data.")
+                        else:
+                            db.delete_transaction(user_id, int(row['id']))
+                            st.rerun()
+    
+    st.subheader("🗄️ Year Archives")
+    st.caption("Closed years can be moved to read-only archive files to keep everyday queries fast. "
+               "Reports still include them; archived transactions cannot be edited until the year is restored. "
+               "Debts and linked repayments always stay active.")
+    archived_years = db.get_archived_years(user_id)
+    candidates = db.get_archive_candidates(user_id)
+    a1, a2 = st.columns(2)
+    with a1:
+        if candidates.empty:
+            st.info("No closed years to archive.")
+        else:
+            archive_choice = st.selectbox("Closed year", candidates['year'].tolist(),
+                                          format_func=lambda y: f"{y} ({int(candidates.loc[candidates['year'] == y, 'rows'].iloc[0])} transactions)",
+                                          key="archive_year_select")
+            if st.button("🗄️ Archive Year"):
+                if st.session_state.username == 'demouser':
+                    st.error("Demo User cannot archive data.")
+                else:
+                    try:
+                        moved = db.archive_year(user_id, archive_choice)
+                        st.success(f"Archived {moved} transactions from {archive_choice}.")
+                        st.rerun()
+                    except ValueError as e:
+                        st.error(str(e))
+    with a2:
+        if archived_years:
+            restore_choice = st.selectbox("Archived year", archived_years, key="unarchive_year_select")
+            if st.button("♻️ Restore Year"):
+                moved = db.unarchive_year(user_id, restore_choice)
+                st.success(f"Restored {moved} transactions from {restore_choice}.")
+                st.rerun()
+        else:
+            st.caption("No archived years yet.")
+    
+    st.markdown("---")
+    
     if st.button("📤 Export to Excel"):
         transactions = db.get_transactions(user_id)
         if not transactions.empty:
@@ -0,0 +1,133 @@
+"""
+In-memory prefix index for Description / Account autocomplete.
+
+One index per (user, field), built from SQLite on first use and then kept
+current through database.add_transaction_listener, so reruns while typing
+never query the database again.
+
+Ranking uses an exponentially decayed frequency: every past use adds
+2 ** (days_since_epoch / HALF_LIFE_DAYS). The common decay factor cancels
+when comparing entries, so the sums can be updated incrementally and still
+rank recent, frequent values first.
+"""
+import bisect
+import heapq
+import threading
+from datetime import date, datetime
+
+import database as db
+
+FIELDS = ('description', 'account')
+
+# A use HALF_LIFE_DAYS ago counts half as much as one today
+HALF_LIFE_DAYS = 90
+_EPOCH = date(2000, 1, 1)
+
+# Longest prefix scan before giving up on collecting more candidates
+MAX_SCAN = 5000
+
+def _weight(date_str) -> float:
+    try:
+        d = datetime.strptime(str(date_str)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        d = date.today()
+    return 2.0 ** ((d - _EPOCH).days / HALF_LIFE_DAYS)
+
+class PrefixIndex:
+    """Sorted (key, entry) array searched with bisect; keys are lowercased word starts"""
+
+    def __init__(self):
+        self._keys = []      # sorted list of (key, text_lower)
+        self._texts = {}     # text_lower -> display text (most recent spelling)
+        self._scores = {}    # text_lower -> decayed frequency
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._texts)
+
+    def add(self, text: str, date_str=None, count: int = 1):
+        """Record count uses of text on date_str"""
+        text = (text or '').strip()
+        if not text:
+            return
+        lower = text.lower()
+        with self._lock:
+            if lower not in self._texts:
+                # Index the whole value and every later word, so "ref" finds "Amazon refund"
+                words = lower.split()
+                for i in range(len(words)):
+                    bisect.insort(self._keys, (' '.join(words[i:]), lower))
+                self._scores[lower] = 0.0
+            self._texts[lower] = text
+            self._scores[lower] += count * _weight(date_str or date.today())
+
+    def suggest(self, prefix: str, limit: int = 5) -> list:
+        """Best matching values for a prefix (most frequent / recent first)"""
+        prefix = (prefix or '').strip().lower()
+        with self._lock:
+            if not prefix:
+                best = heapq.nlargest(limit, self._scores.items(), key=lambda kv: kv[1])
+                return [self._texts[t] for t, _ in best]
+
+            start = bisect.bisect_left(self._keys, (prefix,))
+            candidates = set()
+            for key, lower in self._keys[start:start + MAX_SCAN]:
+                if not key.startswith(prefix):
+                    break
+                candidates.add(lower)
+            # An exact match is already typed; offer it only alongside longer values
+            best = heapq.nlargest(limit + 1, candidates, key=self._scores.get)
+            return [self._texts[t] for t in best if t != prefix][:limit]
+
+# (user_id, field) -> PrefixIndex
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _build_index(user_id: int, field: str) -> PrefixIndex:
+    index = PrefixIndex()
+    conn = db.get_connection(user_id)
+    rows = conn.execute(f'''
+        SELECT {field}, date, COUNT(*) FROM transactions
+        WHERE user_id = ? AND {field} IS NOT NULL AND TRIM({field}) != ''
+        GROUP BY {field}, date
+        ORDER BY date
+    ''', (user_id,)).fetchall()
+    conn.close()
+    for text, date_str, count in rows:
+        index.add(text, date_str, count)
+    return index
+
+def get_index(user_id: int, field: str) -> PrefixIndex:
+    """The user's index for a field, built on first use"""
+    if field not in FIELDS:
+        raise ValueError(f"Unknown autocomplete field '{field}'")
+    key = (user_id, field)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = _build_index(user_id, field)
+                _indexes[key] = index
+    return index
+
+def suggest(user_id: int, field: str, prefix: str, limit: int = 5) -> list:
+    return get_index(user_id, field).suggest(prefix, limit)
+
+def invalidate(user_id: int = None):
+    """Drop cached indexes (all users when user_id is None); they rebuild on next use"""
+    with _indexes_lock:
+        for key in list(_indexes):
+            if user_id is None or key[0] == user_id:
+                del _indexes[key]
+
+def _on_transactions_added(user_id: int, rows: list):
+    """database listener: fold new rows into indexes that are already built"""
+    for field in FIELDS:
+        index = _indexes.get((user_id, field))
+        if index is None:
+            continue  # built lazily later, will read the new rows from SQLite
+        for row in rows:
+            index.add(row.get(field), row.get('date'))
+
+db.add_transaction_listener(_on_transactions_added)
@@ -0,0 +1,124 @@
+"""
+Benchmark the transactions indexes on a synthetic database.
+
+Runs the hot queries that the partial indexes were designed for, first with
+the indexes in place and then with them dropped, and prints the query plan
+and the median time of each. The database is built in a temporary directory;
+finance.db is not touched.
+
+Usage:
+    python bench_indexes.py [--rows 200000] [--users 5] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+import database as db
+
+def _build_database(path: str, rows: int, users: int, seed: int = 7):
+    db.DATABASE_NAME = path
+    db.SHARDED_MODE = False
+    db.init_db()
+    rnd = random.Random(seed)
+    start = date.today() - timedelta(days=5 * 365)
+    types = ['Income', 'Expense', 'Expense', 'Expense', 'Investment', 'Vehicle', 'Subscriptions', 'Banking', 'Credit Card']
+    for user_id in range(1, users + 1):
+        n = rows // users
+        frame = pd.DataFrame({
+            'date': [str(start + timedelta(days=rnd.randrange(5 * 365))) for _ in range(n)],
+            'type': [rnd.choice(types) for _ in range(n)],
+            'category': [rnd.choice(['Groceries', 'Rent', 'Salary', 'Car Fuel', 'SIP', 'Netflix']) for _ in range(n)],
+            'amount': [rnd.randint(50, 50000) for _ in range(n)],
+            'description': [f"payee {rnd.randrange(500)}" for _ in range(n)],
+            'is_credit_card_payment': [int(rnd.random() < 0.2) for _ in range(n)],
+            'is_reinvestment': [int(rnd.random() < 0.02) for _ in range(n)],
+            'is_self': [int(rnd.random() < 0.05) for _ in range(n)],
+        })
+        # A handful of debts per user, as in real data
+        debts = pd.DataFrame({
+            'date': [str(start + timedelta(days=rnd.randrange(5 * 365))) for _ in range(40)],
+            'type': 'Debt',
+            'category': [rnd.choice(['Friends', 'Home Loan', 'Car Loan']) for _ in range(40)],
+            'amount': [rnd.randint(1000, 500000) for _ in range(40)],
+            'is_repaid': [int(rnd.random() < 0.5) for _ in range(40)],
+        })
+        db.add_transactions_bulk(user_id, pd.concat([frame, debts], ignore_index=True), skip_duplicates=False)
+    conn = sqlite3.connect(path)
+    conn.execute("ANALYZE")
+    conn.close()
+
+def _aggregate_sql(filters: dict, measures=('total',), group_by=()):
+    shape, params = db._normalize_filters(filters)
+    query = db._compile_aggregate(tuple(measures), tuple(group_by), shape, tuple(group_by), 1, None, None)
+    return query, params
+
+def _queries(user_id: int, year_start: str, year_end: str):
+    period = {'start_date': year_start, 'end_date': year_end}
+    vehicle_sql, vehicle_params = _aggregate_sql({'type': 'Vehicle', 'is_credit_card_payment': 1, **period})
+    self_sql, self_params = _aggregate_sql({'type': 'Expense', 'is_self': 1, **period}, group_by=('category',))
+    month_sql, month_params = _aggregate_sql({'start_date': year_start[:7] + '-01', 'end_date': year_start[:7] + '-31'},
+                                             group_by=('type',))
+    return [
+        ('unpaid debts (portfolio)',
+         "SELECT * FROM transactions WHERE user_id = ? AND type = 'Debt' AND is_repaid = 0", [user_id]),
+        ('friends debts',
+         "SELECT * FROM transactions WHERE user_id = ? AND type = 'Debt' AND category = 'Friends' ORDER BY date DESC",
+         [user_id]),
+        ('CC-paid vehicle total (summary)', vehicle_sql, [user_id] + vehicle_params),
+        ('self expenses by category', self_sql, [user_id] + self_params),
+        ('one month by type (dashboard)', month_sql, [user_id] + month_params),
+    ]
+
+def _time(conn, sql: str, params: list, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+def _plan(conn, sql: str, params: list) -> str:
+    return '; '.join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the transactions partial indexes")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        print(f"Building {args.rows} transactions for {args.users} users...")
+        _build_database(path, args.rows, args.users)
+        this_year = date.today().year
+        queries = _queries(1, f"{this_year - 1}-01-01", f"{this_year - 1}-12-31")
+
+        conn = sqlite3.connect(path)
+        results = {}
+        for name, sql, params in queries:
+            results[name] = [_plan(conn, sql, params), _time(conn, sql, params, args.repeat)]
+
+        index_names = ['idx_transactions_user_date'] + [name for name, _, _ in db.TRANSACTION_PARTIAL_INDEXES]
+        for name in index_names:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.execute("ANALYZE")
+        for name, sql, params in queries:
+            results[name] += [_plan(conn, sql, params), _time(conn, sql, params, args.repeat)]
+        conn.close()
+
+    for name, (plan, ms, plan_without, ms_without) in results.items():
+        print(f"\n{name}")
+        print(f"  with indexes    {ms:8.2f} ms  {plan}")
+        print(f"  without indexes {ms_without:8.2f} ms  {plan_without}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
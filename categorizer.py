@@ -0,0 +1,238 @@
+"""
+Per-user transaction categorizer (multinomial naive Bayes).
+
+Features are description words, the account and a coarse amount bucket;
+labels are (type, category) pairs taken from the user's own history.
+The model keeps raw token counts per label, so new transactions are
+folded in incrementally (database.add_transaction_listener) and the
+log-probabilities are recomputed lazily on the next prediction.
+
+Tokenizing and scoring are vectorized with pandas / numpy, so a batch
+of imported rows is classified in one call, chunked to bound memory.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+import database as db
+
+# Laplace smoothing
+ALPHA = 1.0
+
+# Rows scored per chunk in classify_frame (memory ~ rows * tokens * labels * 4 bytes)
+CHUNK_ROWS = 20000
+
+_WORD_PATTERN = r'[a-z0-9]{2,}'
+_LABEL_SEP = '\x1f'
+
+def _amount_bucket(amount: pd.Series) -> pd.Series:
+    """'amt:<n>' with n = floor(log2(amount)), so similar sized payments share a token"""
+    values = pd.to_numeric(amount, errors='coerce').abs()
+    buckets = np.floor(np.log2(values.where(values >= 1)))
+    return ('amt:' + buckets.astype('Int64').astype(str)).where(buckets.notna())
+
+def tokenize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Long (row, token) frame for the description / account / amount columns of df.
+
+    row is the position of the row in df.
+    """
+    n = len(df)
+    positions = pd.RangeIndex(n)
+    parts = []
+
+    if 'description' in df.columns:
+        words = pd.Series(df['description'].to_numpy(), index=positions, dtype=object) \
+            .fillna('').astype(str).str.lower().str.findall(_WORD_PATTERN).explode().dropna()
+        parts.append(words)
+    if 'account' in df.columns:
+        account = pd.Series(df['account'].to_numpy(), index=positions, dtype=object).fillna('').astype(str).str.strip().str.lower()
+        parts.append(('acct:' + account).where(account != ''))
+    if 'amount' in df.columns:
+        parts.append(_amount_bucket(pd.Series(df['amount'].to_numpy(), index=positions)))
+
+    if not parts:
+        return pd.DataFrame({'row': np.empty(0, dtype=np.int64), 'token': np.empty(0, dtype=object)})
+    tokens = pd.concat(parts).dropna()
+    return pd.DataFrame({'row': tokens.index.to_numpy(dtype=np.int64), 'token': tokens.to_numpy(dtype=object)})
+
+class NaiveBayesCategorizer:
+    """Token counts per (type, category) label with lazily derived log-probabilities"""
+
+    def __init__(self):
+        self.labels = pd.Index([], dtype=object)   # 'type\x1fcategory'
+        self.vocab = pd.Index([], dtype=object)
+        self.counts = np.zeros((0, 0), dtype=np.float64)   # labels x vocab
+        self.label_counts = np.zeros(0, dtype=np.float64)  # training rows per label
+        self._log_prior = None
+        self._log_lik = None
+        self._lock = threading.Lock()
+
+    @property
+    def n_samples(self) -> int:
+        return int(self.label_counts.sum())
+
+    def partial_fit(self, df: pd.DataFrame):
+        """Add labelled rows (description, account, amount, type, category) to the counts"""
+        df = df[df['type'].notna() & df['category'].notna()]
+        if df.empty:
+            return
+        row_labels = (df['type'].astype(str) + _LABEL_SEP + df['category'].astype(str)).to_numpy(dtype=object)
+        tokens = tokenize_frame(df)
+
+        with self._lock:
+            self.labels = self.labels.append(pd.Index(pd.unique(row_labels)).difference(self.labels))
+            self.vocab = self.vocab.append(pd.Index(tokens['token'].unique()).difference(self.vocab))
+            if self.counts.shape != (len(self.labels), len(self.vocab)):
+                grown = np.zeros((len(self.labels), len(self.vocab)))
+                grown[:self.counts.shape[0], :self.counts.shape[1]] = self.counts
+                self.counts = grown
+                self.label_counts = np.concatenate(
+                    [self.label_counts, np.zeros(len(self.labels) - len(self.label_counts))])
+
+            label_idx = self.labels.get_indexer(row_labels)
+            np.add.at(self.label_counts, label_idx, 1)
+            if not tokens.empty:
+                np.add.at(self.counts, (label_idx[tokens['row'].to_numpy()], self.vocab.get_indexer(tokens['token'])), 1)
+            self._log_prior = None
+
+    def fit(self, df: pd.DataFrame):
+        self.__init__()
+        self.partial_fit(df)
+        return self
+
+    def _log_probs(self):
+        with self._lock:
+            if self._log_prior is None:
+                totals = self.counts.sum(axis=1, keepdims=True)
+                self._log_lik = np.log((self.counts + ALPHA) / (totals + ALPHA * max(len(self.vocab), 1))).astype(np.float32)
+                self._log_prior = np.log(self.label_counts / max(self.label_counts.sum(), 1)).astype(np.float32)
+            return self._log_prior, self._log_lik, self.labels
+
+    def predict_proba(self, df: pd.DataFrame, trans_type: str = None) -> np.ndarray:
+        """rows x labels posterior probabilities (labels of other types get 0 when trans_type is set)"""
+        log_prior, log_lik, labels = self._log_probs()
+        scores = np.tile(log_prior, (len(df), 1))
+        tokens = tokenize_frame(df)
+        tok_idx = self.vocab.get_indexer(tokens['token'])
+        known = tok_idx >= 0
+        if known.any():
+            rows = tokens['row'].to_numpy()[known]
+            # Sum log-likelihood columns per row: (tokens x labels) reduced by row
+            contrib = log_lik[:, tok_idx[known]].T
+            order = np.argsort(rows, kind='stable')
+            rows, contrib = rows[order], contrib[order]
+            starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            scores[rows[starts]] += np.add.reduceat(contrib, starts, axis=0)
+        if trans_type is not None:
+            allowed = labels.str.startswith(str(trans_type) + _LABEL_SEP)
+            scores[:, ~np.asarray(allowed)] = -np.inf
+        scores -= scores.max(axis=1, keepdims=True)
+        probs = np.exp(scores)
+        probs /= probs.sum(axis=1, keepdims=True)
+        return np.nan_to_num(probs)
+
+    def label_parts(self, idx: np.ndarray):
+        split = self.labels[idx].str.split(_LABEL_SEP, n=1)
+        return split.str[0], split.str[1]
+
+# user_id -> NaiveBayesCategorizer
+_models = {}
+_models_lock = threading.Lock()
+
+def _training_frame(user_id: int) -> pd.DataFrame:
+    conn = db.get_connection(user_id)
+    df = pd.read_sql_query(
+        "SELECT description, account, amount, type, category FROM transactions WHERE user_id = ?",
+        conn, params=[user_id])
+    conn.close()
+    return df
+
+def get_model(user_id: int) -> NaiveBayesCategorizer:
+    """The user's model, trained from their history on first use"""
+    model = _models.get(user_id)
+    if model is None:
+        with _models_lock:
+            model = _models.get(user_id)
+            if model is None:
+                model = NaiveBayesCategorizer().fit(_training_frame(user_id))
+                _models[user_id] = model
+    return model
+
+def invalidate(user_id: int = None):
+    """Forget trained models (all users when user_id is None); they retrain on next use"""
+    with _models_lock:
+        for uid in list(_models):
+            if user_id is None or uid == user_id:
+                del _models[uid]
+
+def classify_frame(user_id: int, df: pd.DataFrame, trans_type: str = None,
+                   chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    """Predicted type / category and confidence (0-1) for every row of df (same index)"""
+    model = get_model(user_id)
+    result = pd.DataFrame(index=df.index, columns=['suggested_type', 'suggested_category', 'confidence'])
+    result['confidence'] = 0.0
+    if model.n_samples == 0 or df.empty:
+        return result
+
+    types, categories, confidence = [], [], []
+    for start in range(0, len(df), chunk_rows):
+        probs = model.predict_proba(df.iloc[start:start + chunk_rows], trans_type)
+        best = probs.argmax(axis=1)
+        t, c = model.label_parts(best)
+        types.append(np.asarray(t, dtype=object))
+        categories.append(np.asarray(c, dtype=object))
+        confidence.append(probs[np.arange(len(best)), best])
+    result['suggested_type'] = np.concatenate(types)
+    result['suggested_category'] = np.concatenate(categories)
+    result['confidence'] = np.concatenate(confidence).astype(float)
+    return result
+
+def suggest(user_id: int, description: str = None, account: str = None, amount: float = None,
+            trans_type: str = None, limit: int = 3) -> list:
+    """Top (type, category, confidence) guesses for a single transaction"""
+    model = get_model(user_id)
+    if model.n_samples == 0 or not (description or account):
+        return []
+    row = pd.DataFrame({'description': [description], 'account': [account], 'amount': [amount]})
+    probs = model.predict_proba(row, trans_type)[0]
+    top = np.argsort(probs)[::-1][:limit]
+    top = top[probs[top] > 0]
+    types, categories = model.label_parts(top)
+    return [(t, c, float(p)) for t, c, p in zip(types, categories, probs[top])]
+
+def fill_missing_categories(user_id: int, df: pd.DataFrame, min_confidence: float = 0.5) -> pd.DataFrame:
+    """Copy of df with empty type/category filled from the model where it is confident enough.
+
+    Adds a 'category_confidence' column (NaN for rows that already had a category).
+    """
+    df = df.copy()
+    if 'type' not in df.columns:
+        df['type'] = None
+    if 'category' not in df.columns:
+        df['category'] = None
+    missing = df['category'].isna() | (df['category'].astype(str).str.strip() == '')
+    df['category_confidence'] = np.nan
+    if not missing.any():
+        return df
+
+    todo = df[missing]
+    # Keep a given type and only guess its category; rows without a type get both
+    predicted = classify_frame(user_id, todo)
+    for t_type, group in todo[todo['type'].notna()].groupby('type'):
+        predicted.loc[group.index] = classify_frame(user_id, group, trans_type=t_type)
+
+    sure = predicted['confidence'] >= min_confidence
+    idx = predicted.index[sure]
+    df.loc[idx, 'type'] = df.loc[idx, 'type'].fillna(predicted.loc[idx, 'suggested_type'])
+    df.loc[idx, 'category'] = predicted.loc[idx, 'suggested_category']
+    df.loc[missing, 'category_confidence'] = predicted['confidence'].astype(float)
+    return df
+
+def _on_transactions_added(user_id: int, rows: list):
+    """database listener: update models that are already trained"""
+    model = _models.get(user_id)
+    if model is not None:
+        model.partial_fit(pd.DataFrame(rows))
+
+db.add_transaction_listener(_on_transactions_added)
@@ -0,0 +1,170 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# Figures kept in memory (shared by all sessions, least recently used evicted first)
+FIGURE_CACHE_SIZE = 256
+
+# Series longer than this are downsampled before plotting
+MAX_SERIES_POINTS = 500
+
+# Series with more points than this (before downsampling) are drawn with WebGL (scattergl)
+DENSE_TRACE_POINTS = 1000
+
+_figure_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _feed_hash(h, obj):
+    """Feed a stable representation of chart input into a hash"""
+    if isinstance(obj, pd.DataFrame):
+        h.update(repr((list(obj.columns), [str(t) for t in obj.dtypes])).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    elif isinstance(obj, (pd.Series, pd.Index)):
+        h.update(repr((obj.name, str(obj.dtype))).encode())
+        h.update(pd.util.hash_pandas_object(obj).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(repr((obj.dtype.str, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes() if obj.dtype != object else repr(obj.tolist()).encode())
+    elif isinstance(obj, dict):
+        for k in sorted(obj, key=str):
+            h.update(repr(k).encode())
+            _feed_hash(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}{len(obj)}".encode())
+        for item in obj:
+            _feed_hash(h, item)
+    else:
+        h.update(repr(obj).encode())
+
+def figure_key(builder, data, options: dict) -> str:
+    """Cache key: builder identity + hash of the input data + chart options"""
+    h = hashlib.sha1()
+    h.update(f"{getattr(builder, '__module__', '')}.{getattr(builder, '__qualname__', repr(builder))}".encode())
+    _feed_hash(h, data)
+    _feed_hash(h, options)
+    return h.hexdigest()
+
+def cached_figure(builder, data, layout: dict = None, traces: dict = None, **options):
+    """Build a Plotly figure once per (data, options) and reuse it on later reruns.
+
+    builder is called as builder(data, **options), e.g. px.pie or one of the
+    build_* functions below. layout / traces are applied with update_layout /
+    update_traces afterwards. The returned figure is shared: do not modify it.
+    """
+    key = figure_key(builder, data, {'layout': layout, 'traces': traces, 'options': options})
+    with _cache_lock:
+        fig = _figure_cache.get(key)
+        if fig is not None:
+            _figure_cache.move_to_end(key)
+            return fig
+
+    fig = builder(data, **options)
+    if traces:
+        fig.update_traces(**traces)
+    if layout:
+        fig.update_layout(**layout)
+
+    with _cache_lock:
+        _figure_cache[key] = fig
+        while len(_figure_cache) > FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    return fig
+
+def clear_figure_cache():
+    with _cache_lock:
+        _figure_cache.clear()
+
+# ========== DOWNSAMPLING ==========
+
+def lttb_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of n_out points that keep the visual shape of y"""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=float)
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket is the third triangle corner
+        nxt_start, nxt_end = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[nxt_start:nxt_end].mean()
+        avg_y = y[nxt_start:nxt_end].mean()
+
+        bx = x[start:end]
+        by = y[start:end]
+        area = np.abs((x[prev] - avg_x) * (by - y[prev]) - (x[prev] - bx) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
+
+def downsample(df: pd.DataFrame, y: str, group: str = None, max_points: int = MAX_SERIES_POINTS) -> pd.DataFrame:
+    """Reduce a (sorted) time series frame to at most max_points rows per series.
+
+    Small frames are returned unchanged; the threshold adapts per group.
+    """
+    if df.empty:
+        return df
+    if group is None:
+        if len(df) <= max_points:
+            return df
+        return df.iloc[lttb_indices(df[y].to_numpy(), max_points)]
+
+    parts = []
+    for _, part in df.groupby(group, sort=False, observed=True):
+        parts.append(part if len(part) <= max_points else part.iloc[lttb_indices(part[y].to_numpy(), max_points)])
+    return pd.concat(parts) if parts else df
+
+def scatter(x, y, points: int = None, **kwargs):
+    """go.Scatter, or go.Scattergl for dense traces.
+
+    points is the length of the series before downsampling (defaults to len(x)).
+    """
+    trace_cls = go.Scattergl if (len(x) if points is None else points) > DENSE_TRACE_POINTS else go.Scatter
+    return trace_cls(x=x, y=y, **kwargs)
+
+# ========== FIGURE BUILDERS ==========
+# Plain functions of (data, options) so cached_figure can key on them.
+
+def build_trend_lines(pivot: pd.DataFrame, color_map: dict = None, width: int = 3, marker_size: int = 8):
+    """One line per column of a month-indexed pivot table"""
+    color_map = color_map or {}
+    fig = go.Figure()
+    for col in pivot.columns:
+        series = downsample(pivot[[col]].reset_index(), col)
+        fig.add_trace(scatter(
+            series.iloc[:, 0],
+            series[col],
+            points=len(pivot),
+            mode='lines+markers',
+            name=col,
+            line=dict(color=color_map.get(col, '#95a5a6'), width=width),
+            marker=dict(size=marker_size)
+        ))
+    return fig
+
+def build_line_with_labels(df: pd.DataFrame, x: str, y: str, text: str = None, title: str = None,
+                           labels: dict = None, color: str = '#e74c3c', width: int = 4, marker_size: int = 10,
+                           text_color: str = 'white'):
+    """Line with markers plus a text overlay trace (text column of df) showing each value"""
+    points = len(df)
+    df = downsample(df, y)
+    labels = labels or {}
+    fig = go.Figure()
+    fig.add_trace(scatter(df[x], df[y], points=points, mode='lines+markers', name=labels.get(y, y), showlegend=False,
+                          line=dict(color=color, width=width), marker=dict(size=marker_size)))
+    if text is not None:
+        fig.add_trace(scatter(df[x], df[y], points=points, mode='text', text=df[text], textposition='top center',
+                              showlegend=False, textfont=dict(size=12, color=text_color)))
+    fig.update_layout(title=title, xaxis_title=labels.get(x, x), yaxis_title=labels.get(y, y), hovermode='x unified')
+    return fig
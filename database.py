@@ -1,44 +1,584 @@
 import sqlite3
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Optional, Sequence, Tuple
+import calendar
 import hashlib
+import logging
+import re
 import shutil
 import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 DATABASE_NAME = 'finance.db'
 
-def get_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_NAME)
+# Worker threads for loading independent read queries of a page concurrently
+READ_POOL_WORKERS = int(os.environ.get('INEXO_READ_WORKERS', 6))
+
+# Full integrity_check runs in the background at most once per interval (hours)
+INTEGRITY_CHECK_INTERVAL_HOURS = float(os.environ.get('INEXO_INTEGRITY_INTERVAL_HOURS', 24))
+
+# Optional sharded mode: one SQLite file per user under SHARD_DIR.
+# DATABASE_NAME then acts as the catalog (users, password_requests, integrity_checks).
+SHARDED_MODE = os.environ.get('INEXO_SHARDED', '0') == '1'
+SHARD_DIR = os.environ.get('INEXO_SHARD_DIR', 'shards')
+
+# Tables holding per-user rows (user_id column). These live in the user's shard in sharded mode.
+# accounts comes first: transactions reference it through account_id. card_cycles precedes
+# transactions so the copied rows mark its statements for a rebuild. recurring_postings precedes
+# transactions so postings whose rows were deleted come over too (the insert trigger ignores the rest).
+USER_TABLES = ['accounts', 'card_cycles', 'recurring_postings', 'transactions', 'categories', 'recurring_items', 'budgets']
+
+# Transactions with the same fingerprint this many days apart are reported as suspected duplicates
+DUPLICATE_WINDOW_DAYS = int(os.environ.get('INEXO_DUPLICATE_WINDOW_DAYS', 3))
+
+# Exchange rates: CSV of date,currency,rate with rate = units of currency per 1 FX_PIVOT_CURRENCY
+FX_RATES_CSV = os.environ.get('INEXO_FX_RATES_CSV', 'fx_rates.csv')
+FX_PIVOT_CURRENCY = 'USD'
+
+# Calendar dimension covers these years (same range as the app's year pickers)
+CALENDAR_FIRST_YEAR = 2000
+CALENDAR_LAST_YEAR = 2100
+
+_initialized_shards = set()
+_shard_lock = threading.Lock()
+
+def get_shard_path(user_id: int) -> str:
+    """Path of the shard file holding a user's data"""
+    return os.path.join(SHARD_DIR, f"user_{int(user_id)}.db")
+
+# Callables fn(statement) run for every SQL statement on app connections (e.g. query counting in tests)
+_query_listeners = []
+
+def add_query_listener(fn):
+    """Register a callback receiving each SQL statement executed through get_connection / get_lifetime_connection"""
+    if fn not in _query_listeners:
+        _query_listeners.append(fn)
+
+def remove_query_listener(fn):
+    if fn in _query_listeners:
+        _query_listeners.remove(fn)
+
+def _trace_statement(statement: str):
+    for fn in list(_query_listeners):
+        fn(statement)
+
+def _connect(database: str, **kwargs) -> sqlite3.Connection:
+    """sqlite3.connect with the query listeners attached (no tracing cost when there are none)"""
+    conn = sqlite3.connect(database, **kwargs)
+    if _query_listeners:
+        conn.set_trace_callback(_trace_statement)
+    return conn
+
+def get_connection(user_id: int = None):
+    """Get database connection (routed to the user's shard in sharded mode)"""
+    if SHARDED_MODE and user_id is not None:
+        path = get_shard_path(user_id)
+        if path not in _initialized_shards:
+            _init_shard(path)
+        conn = _connect(path)
+    else:
+        conn = _connect(DATABASE_NAME)
     conn.row_factory = sqlite3.Row
     return conn
 
+def _init_shard(path: str):
+    """Create a shard file with the per-user schema (once per process)"""
+    with _shard_lock:
+        if path in _initialized_shards:
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = sqlite3.connect(path)
+        _init_user_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+        _initialized_shards.add(path)
+
+def get_shard_user_ids() -> List[int]:
+    """User ids that have a shard file"""
+    if not os.path.isdir(SHARD_DIR):
+        return []
+    ids = []
+    for f in os.listdir(SHARD_DIR):
+        if f.startswith('user_') and f.endswith('.db'):
+            try:
+                ids.append(int(f[len('user_'):-len('.db')]))
+            except ValueError:
+                pass
+    return sorted(ids)
+
 def hash_password(password):
     """Hash a password for storing."""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def init_db():
-    """Initialize database with tables and perform migration if needed"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Check if users table exists (Migration check)
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-    users_exist = cursor.fetchone()
+def normalize_description(text) -> str:
+    """Lowercase, punctuation-free, single-spaced description used for duplicate matching"""
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', str(text or '').lower()).split())
+
+def transaction_fingerprint(user_id, trans_type, amount, description) -> Optional[str]:
+    """Hash of user, type, amount and normalized description (None without a description).
+
+    The date is left out on purpose: rows sharing a fingerprint within
+    DUPLICATE_WINDOW_DAYS of each other are treated as duplicates, which
+    catches statement imports whose dates are off by a day or two. An amount
+    alone says too little, so rows without a description are never matched.
+    """
+    description = normalize_description(description)
+    if not description:
+        return None
+    key = f"{int(user_id) if user_id is not None else ''}|{trans_type or ''}|{round(float(amount or 0), 2):.2f}|{description}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def _backfill_fingerprints(cursor):
+    """Recompute every row's fingerprint (run when the fingerprint definition changes)"""
+    cursor.execute("SELECT id, user_id, type, amount, description FROM transactions WHERE user_id IS NOT NULL")
+    rows = cursor.fetchall()
+    if rows:
+        cursor.executemany("UPDATE transactions SET fingerprint = ? WHERE id = ?",
+                           [(transaction_fingerprint(uid, t, amount, desc), tid) for tid, uid, t, amount, desc in rows])
+
+# Partial indexes on transactions: (name, columns, predicate)
+TRANSACTION_PARTIAL_INDEXES = [
+    # Outstanding debts and loans (get_portfolio_status)
+    ('idx_transactions_unpaid_debt', 'user_id, category', "type = 'Debt' AND is_repaid = 0"),
+    # Friends debts (get_friends_debts), newest first
+    ('idx_transactions_friends_debt', 'user_id, date', "type = 'Debt' AND category = 'Friends'"),
+    # Vehicle spend paid by credit card (get_summary)
+    ('idx_transactions_vehicle_cc', 'user_id, date', "type = 'Vehicle' AND is_credit_card_payment = 1"),
+    # Self / personal expenses (Analytics)
+    ('idx_transactions_self', 'user_id, date', "is_self = 1"),
+    # One person's Friends debts (counterparty_ledger refresh and drill-down)
+    ('idx_transactions_counterparty', 'user_id, counterparty', "type = 'Debt' AND category = 'Friends'"),
+]
+
+# Leading phrases stripped when guessing a Friends debt's counterparty from its description
+_COUNTERPARTY_PREFIX = re.compile(
+    r'^(?:(?:borrowed|took|taken|got|loan|money|cash|debt)\s+(?:from\s+)?|owe[ds]?\s+(?:to\s+)?|from\s+|to\s+)', re.I)
+_COUNTERPARTY_END = re.compile(r'\s+(?:for|-|\u2013)\s+|[,(:;]')
+
+def counterparty_from_description(description) -> str:
+    """Person named by a Friends debt description ("Borrowed from Ravi for rent" -> "Ravi")"""
+    text = ' '.join(str(description or '').split())
+    name = _COUNTERPARTY_END.split(_COUNTERPARTY_PREFIX.sub('', text), maxsplit=1)[0].strip()
+    return name[:60] if name else 'Unknown'
+
+def _ledger_refresh_sql(ref: str) -> str:
+    """Trigger statements recomputing the ledger row of <ref>.counterparty (ref is new or old)"""
+    return f'''
+            DELETE FROM counterparty_ledger WHERE user_id = {ref}.user_id AND counterparty = {ref}.counterparty;
+            INSERT INTO counterparty_ledger
+            SELECT user_id, MIN(counterparty), COUNT(*), SUM(is_repaid = 0), SUM(amount),
+                   SUM(COALESCE(paid_amount, 0)), SUM(CASE WHEN is_repaid = 0 THEN amount - COALESCE(paid_amount, 0) ELSE 0 END),
+                   MIN(date), MAX(MAX(date, COALESCE(last_payment_at, date)))
+            FROM transactions
+            WHERE user_id = {ref}.user_id AND counterparty = {ref}.counterparty AND type = 'Debt' AND category = 'Friends'
+            GROUP BY user_id;'''
+
+def _init_counterparty_ledger(cursor):
+    """Per-person Friends debt totals, kept current by triggers on transactions"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='counterparty_ledger'")
+    exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS counterparty_ledger (
+            user_id INTEGER NOT NULL,
+            counterparty TEXT NOT NULL COLLATE NOCASE,
+            debt_count INTEGER NOT NULL,
+            open_count INTEGER NOT NULL,
+            total_borrowed REAL NOT NULL,
+            total_repaid REAL NOT NULL,
+            outstanding REAL NOT NULL,
+            first_date TEXT,
+            last_activity TEXT,
+            PRIMARY KEY (user_id, counterparty)
+        ) WITHOUT ROWID
+    ''')
+    # Every write that changes a Friends debt (insert, repayment, repaid toggle,
+    # edit, delete) recomputes only the affected person(s) with one indexed GROUP BY
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS counterparty_ledger_insert AFTER INSERT ON transactions
+        WHEN new.type = 'Debt' AND new.counterparty IS NOT NULL BEGIN{_ledger_refresh_sql('new')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS counterparty_ledger_delete AFTER DELETE ON transactions
+        WHEN old.type = 'Debt' AND old.counterparty IS NOT NULL BEGIN{_ledger_refresh_sql('old')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS counterparty_ledger_update
+        AFTER UPDATE OF user_id, date, type, category, amount, paid_amount, is_repaid, counterparty, last_payment_at ON transactions
+        WHEN (old.type = 'Debt' AND old.counterparty IS NOT NULL) OR (new.type = 'Debt' AND new.counterparty IS NOT NULL)
+        BEGIN{_ledger_refresh_sql('old')}{_ledger_refresh_sql('new')}
+        END
+    ''')
+    if not exists:
+        rebuild_counterparty_ledger(cursor)
+
+# Account kinds; new names typed on a transaction get a guessed kind (see _ACCOUNT_TYPE_SQL)
+ACCOUNT_TYPES = ('Bank', 'Cash', 'Credit Card', 'Wallet', 'Investment')
+
+# Transaction types that bring money into an account; every other type takes it out
+ACCOUNT_INFLOW_TYPES = ('Income', 'Debt')
+
+def _account_delta_sql(ref: str, account_currency: str = 'accounts.currency') -> str:
+    """Signed effect of a transaction row on its account's balance (0 when the row is in another currency)"""
+    inflow = ', '.join(f"'{t}'" for t in ACCOUNT_INFLOW_TYPES)
+    return f"""(CASE WHEN {ref}.currency IS NOT {account_currency} THEN 0
+        WHEN {ref}.type IN ({inflow}) THEN {ref}.amount ELSE -{ref}.amount END)"""
+
+_ACCOUNT_TYPE_SQL = """CASE
+    WHEN LOWER({name}) LIKE '%card%' OR LOWER({name}) LIKE '%credit%' THEN 'Credit Card'
+    WHEN LOWER({name}) LIKE '%cash%' THEN 'Cash'
+    WHEN LOWER({name}) LIKE '%wallet%' OR LOWER({name}) LIKE '%upi%' THEN 'Wallet'
+    ELSE 'Bank' END"""
+
+def _link_account_sql(ref: str) -> str:
+    """Trigger statements that create <ref>.account in accounts if needed and store its id (NULL when blank) on the row.
+
+    A new account takes the currency of the row that created it.
+    """
+    name = f"TRIM({ref}.account)"
+    return f'''
+            INSERT OR IGNORE INTO accounts (user_id, name, type, currency)
+            SELECT {ref}.user_id, {name}, {_ACCOUNT_TYPE_SQL.format(name=name)}, {ref}.currency WHERE {name} != '';
+            UPDATE transactions SET account_id = (
+                SELECT id FROM accounts WHERE user_id = {ref}.user_id AND name = {name} COLLATE NOCASE
+            ) WHERE id = {ref}.id;'''
+
+def _account_currency_conflict(conn, user_id: int, account: str, currency: str = None) -> bool:
+    """True when account exists with a balance kept in another currency (such rows are rejected)"""
+    name = (account or '').strip()
+    if not name:
+        return False
+    row = conn.execute("SELECT currency FROM accounts WHERE user_id = ? AND name = ? COLLATE NOCASE",
+                       (user_id, name)).fetchone()
+    return row is not None and row[0] != (currency or None)
+
+def _init_account_ledger(cursor):
+    """Link transactions to accounts and keep account balances current with triggers"""
+    cursor.execute("PRAGMA table_info(accounts)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'opening_balance' not in columns:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN opening_balance REAL DEFAULT 0")
+    if 'last_activity' not in columns:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN last_activity TEXT")
+    # Currency the balance is kept in (NULL = the user's base currency, as in transactions.currency)
+    add_currency = 'currency' not in columns
+    if add_currency:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN currency TEXT")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_accounts_user_name ON accounts (user_id, name COLLATE NOCASE)")
     
-    # Users table
+    cursor.execute("PRAGMA table_info(transactions)")
+    columns = [column[1] for column in cursor.fetchall()]
+    backfill = 'account_id' not in columns
+    if backfill:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN account_id INTEGER REFERENCES accounts (id)")
+        # Existing free-text accounts become rows of the accounts table
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO accounts (user_id, name, type)
+            SELECT user_id, TRIM(account), {_ACCOUNT_TYPE_SQL.format(name='TRIM(account)')} FROM transactions
+            WHERE user_id IS NOT NULL AND account IS NOT NULL AND TRIM(account) != ''
+            GROUP BY user_id, TRIM(account) COLLATE NOCASE
+        ''')
+        cursor.execute('''
+            UPDATE transactions SET account_id = (
+                SELECT a.id FROM accounts a WHERE a.user_id = transactions.user_id AND a.name = TRIM(transactions.account) COLLATE NOCASE
+            ) WHERE account IS NOT NULL AND TRIM(account) != ''
+        ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions (account_id, date) WHERE account_id IS NOT NULL")
+    if add_currency:
+        # Each account keeps the currency most of its rows use; rows in other currencies
+        # stop counting towards its balance (archived ones on the next reconcile)
+        cursor.execute('''
+            UPDATE accounts SET currency = (
+                SELECT currency FROM transactions WHERE account_id = accounts.id
+                GROUP BY currency ORDER BY COUNT(*) DESC, currency LIMIT 1
+            )
+        ''')
+        # (comparing t.currency with itself gives the row's full delta)
+        cursor.execute(f'''
+            UPDATE accounts SET balance = balance - (
+                SELECT SUM({_account_delta_sql('t', 't.currency')}) FROM transactions t
+                WHERE t.account_id = accounts.id AND t.currency IS NOT accounts.currency
+            ) WHERE EXISTS (SELECT 1 FROM transactions t WHERE t.account_id = accounts.id AND t.currency IS NOT accounts.currency)
+        ''')
+        for trigger in ('accounts_balance_insert', 'accounts_balance_update', 'accounts_balance_delete'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    
+    # Balances move by the row's signed amount on every insert, edit and delete,
+    # so reading a balance is a primary-key lookup on accounts
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS accounts_link_insert AFTER INSERT ON transactions
+        WHEN new.account_id IS NULL AND new.account IS NOT NULL AND TRIM(new.account) != '' BEGIN{_link_account_sql('new')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS accounts_link_update AFTER UPDATE OF account ON transactions
+        WHEN new.account IS NOT old.account BEGIN{_link_account_sql('new')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS accounts_balance_insert AFTER INSERT ON transactions
+        WHEN new.account_id IS NOT NULL BEGIN
+            UPDATE accounts SET balance = balance + {_account_delta_sql('new')},
+                last_activity = MAX(COALESCE(last_activity, ''), new.date) WHERE id = new.account_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS accounts_balance_update AFTER UPDATE OF account_id, type, amount, currency ON transactions
+        WHEN old.account_id IS NOT NULL OR new.account_id IS NOT NULL BEGIN
+            UPDATE accounts SET balance = balance - {_account_delta_sql('old')} WHERE id = old.account_id;
+            UPDATE accounts SET balance = balance + {_account_delta_sql('new')},
+                last_activity = MAX(COALESCE(last_activity, ''), new.date) WHERE id = new.account_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS accounts_balance_delete AFTER DELETE ON transactions
+        WHEN old.account_id IS NOT NULL BEGIN
+            UPDATE accounts SET balance = balance - {_account_delta_sql('old')} WHERE id = old.account_id;
+        END
+    ''')
+    if backfill:
+        _recompute_account_balances(cursor, 'transactions')
+
+def _recompute_account_balances(cursor, source: str, user_id: int = None):
+    """Set every account's balance to opening balance + its rows in source, in one GROUP BY pass.
+
+    Rows without account_id (archives written before the column existed) are matched by name.
+    """
+    user_filter = "WHERE t.user_id = ?" if user_id is not None else ""
+    cursor.execute("DROP TABLE IF EXISTS temp.account_totals")
+    cursor.execute(f'''
+        CREATE TEMP TABLE account_totals AS
+        SELECT ac.id AS account_id, SUM({_account_delta_sql('t', 'ac.currency')}) AS total, MAX(t.date) AS last_date
+        FROM {source} t
+        LEFT JOIN accounts a ON t.account_id IS NULL AND a.user_id = t.user_id AND a.name = TRIM(t.account) COLLATE NOCASE
+        JOIN accounts ac ON ac.id = COALESCE(t.account_id, a.id)
+        {user_filter}
+        GROUP BY 1
+    ''', [] if user_id is None else [user_id])
+    cursor.execute(f'''
+        UPDATE accounts SET
+            balance = COALESCE(opening_balance, 0) + COALESCE((SELECT total FROM temp.account_totals WHERE account_id = accounts.id), 0),
+            last_activity = (SELECT last_date FROM temp.account_totals WHERE account_id = accounts.id)
+        {'WHERE user_id = ?' if user_id is not None else ''}
+    ''', [] if user_id is None else [user_id])
+    cursor.execute("DROP TABLE temp.account_totals")
+
+# Transaction types paid by card (is_credit_card_payment = 1) that land on a statement
+CARD_SPEND_TYPES = ('Expense', 'Vehicle', 'Subscriptions')
+
+def _card_spend_sql(ref: str) -> str:
+    types = ', '.join(f"'{t}'" for t in CARD_SPEND_TYPES)
+    return f"(({ref}.is_credit_card_payment = 1 AND {ref}.type IN ({types})) OR {ref}.type = 'Credit Card')"
+
+def _init_card_statements(cursor):
+    """Per-card cycle settings and the statements built from them (rebuilt when marked dirty)"""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
+        CREATE TABLE IF NOT EXISTS card_cycles (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL,
-            is_admin INTEGER DEFAULT 0,
-            currency TEXT DEFAULT 'INR',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            user_id INTEGER NOT NULL,
+            card TEXT NOT NULL COLLATE NOCASE,
+            statement_day INTEGER NOT NULL CHECK (statement_day BETWEEN 1 AND 28),
+            due_day INTEGER NOT NULL CHECK (due_day BETWEEN 1 AND 28),
+            is_default INTEGER DEFAULT 0,
+            dirty INTEGER DEFAULT 1,
+            UNIQUE (user_id, card)
         )
     ''')
-    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS card_statements (
+            user_id INTEGER NOT NULL,
+            card TEXT NOT NULL,
+            cycle_start TEXT NOT NULL,
+            cycle_end TEXT NOT NULL,
+            due_date TEXT NOT NULL,
+            amount REAL NOT NULL,
+            paid REAL NOT NULL,
+            txn_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, card, cycle_end)
+        ) WITHOUT ROWID
+    ''')
+    # Any write touching card spend or a bill payment only flags the user's
+    # statements; they are rebuilt in one pass the next time they are read
+    for event, ref in (('INSERT', 'new'), ('DELETE', 'old')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS card_statements_dirty_{event.lower()} AFTER {event} ON transactions
+            WHEN {_card_spend_sql(ref)} BEGIN
+                UPDATE card_cycles SET dirty = 1 WHERE user_id = {ref}.user_id AND dirty = 0;
+            END
+        ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS card_statements_dirty_update
+        AFTER UPDATE OF date, type, category, amount, account, is_credit_card_payment, currency ON transactions
+        WHEN {_card_spend_sql('old')} OR {_card_spend_sql('new')} BEGIN
+            UPDATE card_cycles SET dirty = 1 WHERE user_id IN (old.user_id, new.user_id) AND dirty = 0;
+        END
+    ''')
+
+def _init_recurring_postings(cursor):
+    """recurring_postings: every occurrence_key ever inserted, so skipped (deleted) occurrences stay posted"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='recurring_postings'")
+    is_new = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recurring_postings (
+            user_id INTEGER NOT NULL,
+            occurrence_key TEXT NOT NULL,
+            posted_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, occurrence_key)
+        ) WITHOUT ROWID
+    ''')
+    if is_new:
+        cursor.execute('''
+            INSERT OR IGNORE INTO recurring_postings (user_id, occurrence_key)
+            SELECT user_id, occurrence_key FROM transactions WHERE occurrence_key IS NOT NULL AND user_id IS NOT NULL
+        ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS recurring_postings_insert AFTER INSERT ON transactions
+        WHEN new.occurrence_key IS NOT NULL AND new.user_id IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO recurring_postings (user_id, occurrence_key) VALUES (new.user_id, new.occurrence_key);
+        END
+    ''')
+
+def _budget_usage_sql(ref: str, sign: str) -> str:
+    """Trigger statements adding (sign '+') or removing (sign '-') a row from its month's counter"""
+    key = f"{ref}.user_id, substr({ref}.date, 1, 7), {ref}.type, {ref}.category, COALESCE({ref}.currency, '')"
+    if sign == '+':
+        return f'''
+            INSERT INTO budget_usage (user_id, month, type, category, currency, spent, txn_count)
+            VALUES ({key}, {ref}.amount, 1)
+            ON CONFLICT (user_id, month, type, category, currency)
+            DO UPDATE SET spent = spent + excluded.spent, txn_count = txn_count + 1;'''
+    return f'''
+            UPDATE budget_usage SET spent = spent - {ref}.amount, txn_count = txn_count - 1
+            WHERE (user_id, month, type, category, currency) = ({key});
+            DELETE FROM budget_usage WHERE (user_id, month, type, category, currency) = ({key}) AND txn_count <= 0;'''
+
+def _init_budget_usage(cursor):
+    """budgets (limits) and budget_usage (spend per user, month, type, category, currency) kept by triggers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS budgets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            monthly_limit REAL NOT NULL,
+            UNIQUE (user_id, type, category)
+        )
+    ''')
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='budget_usage'")
+    exists = cursor.fetchone() is not None
+    # currency '' = the user's base currency
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS budget_usage (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            currency TEXT NOT NULL DEFAULT '',
+            spent REAL NOT NULL,
+            txn_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, month, type, category, currency)
+        ) WITHOUT ROWID
+    ''')
+    if not exists:
+        rebuild_budget_usage(cursor, 'transactions')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS budget_usage_insert AFTER INSERT ON transactions
+        WHEN new.user_id IS NOT NULL BEGIN{_budget_usage_sql('new', '+')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS budget_usage_delete AFTER DELETE ON transactions
+        WHEN old.user_id IS NOT NULL BEGIN{_budget_usage_sql('old', '-')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS budget_usage_update
+        AFTER UPDATE OF user_id, date, type, category, amount, currency ON transactions BEGIN{_budget_usage_sql('old', '-')}{_budget_usage_sql('new', '+')}
+        END
+    ''')
+
+def rebuild_budget_usage(cursor, source: str = 'transactions', user_id: int = None):
+    """Recount budget_usage from source in one GROUP BY (all_transactions on a lifetime connection includes archives)"""
+    user_filter = "AND user_id = ?" if user_id is not None else ""
+    params = [] if user_id is None else [user_id]
+    cursor.execute(f"DELETE FROM budget_usage WHERE 1 = 1 {user_filter}", params)
+    cursor.execute(f'''
+        INSERT INTO budget_usage (user_id, month, type, category, currency, spent, txn_count)
+        SELECT user_id, substr(date, 1, 7), type, category, COALESCE(currency, ''), SUM(amount), COUNT(*)
+        FROM {source} WHERE user_id IS NOT NULL {user_filter}
+        GROUP BY 1, 2, 3, 4, 5
+    ''', params)
+
+def rebuild_counterparty_ledger(cursor):
+    """Recompute every ledger row from transactions"""
+    cursor.execute("DELETE FROM counterparty_ledger")
+    cursor.execute('''
+        INSERT INTO counterparty_ledger
+        SELECT user_id, MIN(counterparty), COUNT(*), SUM(is_repaid = 0), SUM(amount),
+               SUM(COALESCE(paid_amount, 0)), SUM(CASE WHEN is_repaid = 0 THEN amount - COALESCE(paid_amount, 0) ELSE 0 END),
+               MIN(date), MAX(MAX(date, COALESCE(last_payment_at, date)))
+        FROM transactions
+        WHERE type = 'Debt' AND category = 'Friends' AND counterparty IS NOT NULL AND user_id IS NOT NULL
+        GROUP BY user_id, counterparty
+    ''')
+
+# Columns indexed by transactions_fts (bm25 weight per column for ranking)
+FTS_COLUMNS = {'description': 10.0, 'account': 2.0, 'category': 4.0, 'loan_lender_bank': 2.0}
+
+def _create_fts_table(cursor, schema: str = 'main'):
+    """FTS5 index over schema.transactions (external content: stores only the index, rows are read from transactions)"""
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.transactions_fts USING fts5(
+            {', '.join(FTS_COLUMNS)},
+            content='transactions', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+
+def _init_transactions_fts(cursor) -> bool:
+    """Create the FTS5 index on transactions and its sync triggers. False if FTS5 is unavailable."""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transactions_fts'")
+    exists = cursor.fetchone() is not None
+    cols = ', '.join(FTS_COLUMNS)
+    new_cols = ', '.join(f"new.{c}" for c in FTS_COLUMNS)
+    old_cols = ', '.join(f"old.{c}" for c in FTS_COLUMNS)
+    try:
+        _create_fts_table(cursor)
+    except sqlite3.OperationalError:
+        return False  # SQLite built without FTS5; search_transactions falls back to LIKE
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN
+            INSERT INTO transactions_fts (rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN
+            INSERT INTO transactions_fts (transactions_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF {cols} ON transactions BEGIN
+            INSERT INTO transactions_fts (transactions_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+            INSERT INTO transactions_fts (rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+    ''')
+    if not exists:
+        # Index rows that existed before the FTS table
+        cursor.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+    return True
+
+def _init_user_tables(cursor):
+    """Create per-user tables and run their column migrations"""
     # Transactions table - Add user_id if not exists
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS transactions (
@@ -100,6 +640,63 @@ def init_db():
     if 'is_self' not in columns:
         cursor.execute("ALTER TABLE transactions ADD COLUMN is_self INTEGER DEFAULT 0")
     
+    # Debt closure metadata: last linked repayment and the day the debt was settled
+    if 'last_payment_at' not in columns:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN last_payment_at TEXT")
+        cursor.execute('''
+            UPDATE transactions SET last_payment_at = (
+                SELECT MAX(p.date) FROM transactions p WHERE p.linked_id = transactions.id
+            ) WHERE type = 'Debt'
+        ''')
+    if 'closed_at' not in columns:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN closed_at TEXT")
+        # Debts closed without any recorded repayment keep an unknown closure date
+        cursor.execute("UPDATE transactions SET closed_at = last_payment_at WHERE type = 'Debt' AND is_repaid = 1")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_closed ON transactions (user_id, closed_at) WHERE closed_at IS NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_last_payment ON transactions (user_id, last_payment_at) WHERE last_payment_at IS NOT NULL")
+    
+    # Person a Friends debt is owed to, guessed from the description for existing rows
+    if 'counterparty' not in columns:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN counterparty TEXT COLLATE NOCASE")
+        cursor.execute("SELECT id, description FROM transactions WHERE type = 'Debt' AND category = 'Friends'")
+        cursor.executemany("UPDATE transactions SET counterparty = ? WHERE id = ?",
+                           [(counterparty_from_description(desc), tid) for tid, desc in cursor.fetchall()])
+    
+    # Currency the amount was entered in (NULL = the user's base currency)
+    if 'currency' not in columns:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN currency TEXT")
+    
+    # Recurring occurrence that generated the row (scheduler.py); unique so re-runs never double post
+    if 'occurrence_key' not in columns:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN occurrence_key TEXT")
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_occurrence
+        ON transactions (occurrence_key) WHERE occurrence_key IS NOT NULL
+    ''')
+    
+    # Duplicate detection fingerprint (see transaction_fingerprint)
+    if 'fingerprint' not in columns:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN fingerprint TEXT")
+    # The index name marks the fingerprint definition: v2 added the type and dropped description-less rows
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_transactions_fingerprint_v2'")
+    if cursor.fetchone() is None:
+        cursor.execute("DROP INDEX IF EXISTS idx_transactions_fingerprint")
+        _backfill_fingerprints(cursor)
+        cursor.execute("CREATE INDEX idx_transactions_fingerprint_v2 ON transactions (user_id, fingerprint, date)")
+    
+    # Date range scans per user, plus partial indexes for the narrow flag slices.
+    # Queries spell these predicates with the same literals so the planner can
+    # match them (bound parameters never match a partial index); see bench_indexes.py.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_id, date)")
+    for name, columns, predicate in TRANSACTION_PARTIAL_INDEXES:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON transactions ({columns}) WHERE {predicate}")
+    
+    # Full-text index over the searchable transaction columns
+    _init_transactions_fts(cursor)
+    
+    # Per-person Friends debt summary
+    _init_counterparty_ledger(cursor)
+    
     # Categories table - Add user_id if not exists
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS categories (
@@ -140,6 +737,15 @@ def init_db():
     if 'user_id' not in columns:
         cursor.execute("ALTER TABLE accounts ADD COLUMN user_id INTEGER")
     
+    # Transactions -> accounts link and incrementally maintained balances
+    _init_account_ledger(cursor)
+    
+    # Credit card statement cycles and their precomputed statements
+    _init_card_statements(cursor)
+    
+    # Monthly category budgets and the spend counters they are checked against
+    _init_budget_usage(cursor)
+    
     # Recurring Items table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS recurring_items (
@@ -155,6 +761,76 @@ def init_db():
         )
     ''')
     
+    # Schedule columns: items with auto_post = 1 are turned into transactions by scheduler.py
+    cursor.execute("PRAGMA table_info(recurring_items)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'auto_post' not in columns:
+        cursor.execute("ALTER TABLE recurring_items ADD COLUMN auto_post INTEGER DEFAULT 0")
+    if 'frequency' not in columns:
+        cursor.execute("ALTER TABLE recurring_items ADD COLUMN frequency TEXT DEFAULT 'monthly'")
+    if 'day_of_month' not in columns:
+        cursor.execute("ALTER TABLE recurring_items ADD COLUMN day_of_month INTEGER DEFAULT 1")
+    if 'start_date' not in columns:
+        cursor.execute("ALTER TABLE recurring_items ADD COLUMN start_date TEXT")
+    if 'end_date' not in columns:
+        cursor.execute("ALTER TABLE recurring_items ADD COLUMN end_date TEXT")
+    if 'account' not in columns:
+        cursor.execute("ALTER TABLE recurring_items ADD COLUMN account TEXT")
+
+    # Occurrence keys the scheduler has posted, kept when the transaction is deleted or archived
+    _init_recurring_postings(cursor)
+
+    # Calendar dimension (shared, no user_id): one row per day and fiscal year start month.
+    # Lives next to transactions so reports can join on it; rows are filled lazily by _ensure_calendar.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS calendar (
+            fy_start_month INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            week TEXT NOT NULL,
+            month TEXT NOT NULL,
+            quarter TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            fiscal_year INTEGER NOT NULL,
+            fiscal_quarter TEXT NOT NULL,
+            PRIMARY KEY (fy_start_month, date)
+        ) WITHOUT ROWID
+    ''')
+
+    # Exchange rates (shared, no user_id), copied from FX_RATES_CSV by _ensure_fx_rates.
+    # Keyed for the as-of lookup: latest date <= transaction date per currency.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            currency TEXT NOT NULL,
+            date TEXT NOT NULL,
+            rate REAL NOT NULL,
+            PRIMARY KEY (currency, date)
+        ) WITHOUT ROWID
+    ''')
+
+def init_db():
+    """Initialize database with tables and perform migration if needed"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    # Check if users table exists (Migration check)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
+    users_exist = cursor.fetchone()
+    
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            is_admin INTEGER DEFAULT 0,
+            currency TEXT DEFAULT 'INR',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Per-user tables (also created in every shard in sharded mode)
+    _init_user_tables(cursor)
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS password_requests (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -166,6 +842,18 @@ def init_db():
         )
     ''')
     
+    # Integrity check history (latest row per check_type is the cached verdict)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS integrity_checks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            check_type TEXT NOT NULL,
+            is_ok INTEGER NOT NULL,
+            result TEXT,
+            duration_ms INTEGER,
+            checked_at TEXT NOT NULL
+        )
+    ''')
+    
     conn.commit()
 
     # --- MIGRATION LOGIC ---
@@ -312,7 +1000,7 @@ def init_default_categories(user_id: int):
         ('Friends', 'Debt'),
     ]
     
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     
     for name, cat_type in default_categories:
@@ -380,6 +1068,9 @@ def update_user_currency(user_id: int, currency: str):
     try:
         cursor.execute("UPDATE users SET currency = ? WHERE id = ?", (currency, user_id))
         conn.commit()
+        _user_currency.pop(user_id, None)
+        # Statements are stored in the base currency
+        mark_card_statements_dirty(user_id)
         return True
     except Exception as e:
         print(f"Error updating currency: {e}")
@@ -387,6 +1078,20 @@ def update_user_currency(user_id: int, currency: str):
     finally:
         conn.close()
 
+# user_id -> base currency (reports convert into it)
+_user_currency = {}
+
+def get_user_currency(user_id: int) -> str:
+    """The user's base currency code"""
+    currency = _user_currency.get(user_id)
+    if currency is None:
+        conn = get_connection()
+        row = conn.execute("SELECT currency FROM users WHERE id = ?", (user_id,)).fetchone()
+        conn.close()
+        currency = (row[0] if row else None) or 'INR'
+        _user_currency[user_id] = currency
+    return currency
+
 def get_all_users():
     """Get all users (for admin)"""
     conn = get_connection()
@@ -426,57 +1131,314 @@ def reset_user_password(user_id: int, new_password: str):
 
 def delete_user(user_id: int):
     """Delete a user and all their data (admin only)"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    if SHARDED_MODE:
+        # The user's data is the whole shard file
+        path = get_shard_path(user_id)
+        with _shard_lock:
+            _initialized_shards.discard(path)
+            if os.path.exists(path):
+                os.remove(path)
+    else:
+        conn = get_connection(user_id)
+        cursor = conn.cursor()
+        
+        # Delete user's transactions
+        cursor.execute("DELETE FROM transactions WHERE user_id = ?", (user_id,))
+        # Delete user's categories
+        cursor.execute("DELETE FROM categories WHERE user_id = ?", (user_id,))
+        # Delete user's accounts
+        cursor.execute("DELETE FROM accounts WHERE user_id = ?", (user_id,))
+        conn.commit()
+        conn.close()
     
-    # Delete user's transactions
-    cursor.execute("DELETE FROM transactions WHERE user_id = ?", (user_id,))
-    # Delete user's categories
-    cursor.execute("DELETE FROM categories WHERE user_id = ?", (user_id,))
-    # Delete user's accounts
-    cursor.execute("DELETE FROM accounts WHERE user_id = ?", (user_id,))
     # Delete user
+    conn = get_connection()
+    cursor = conn.cursor()
     cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
     
     conn.commit()
     conn.close()
     return True
 
+# ========== TYPED FRAME LOADING ==========
+# Dtypes are set once at read time so pages get compact frames that Streamlit's
+# Arrow serializer ships without conversion (dictionary-encoded strings, int8 flags).
+
+CATEGORICAL_COLUMNS = ('type', 'category', 'account', 'currency')
+FLAG_COLUMNS = ('is_repaid', 'is_credit_card_payment', 'is_reinvestment', 'is_self', 'is_active', 'is_loan')
+# Only rates go to float32; money stays float64 so totals match to the paisa
+FLOAT32_COLUMNS = ('loan_interest_rate',)
+DATE_COLUMNS = ('date',)
+
+def _apply_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert known columns of a row-level frame to their compact dtypes"""
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format='ISO8601', errors='coerce')
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col in FLAG_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].fillna(0).astype('int8')
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('float32')
+    return df
+
+def read_frame(query: str, conn, params=None) -> pd.DataFrame:
+    """pd.read_sql_query with the typed column conversions applied"""
+    return _apply_dtypes(pd.read_sql_query(query, conn, params=params))
+
 # ========== TRANSACTION OPERATIONS ==========
 
+# Callables fn(user_id, rows) run after transactions are inserted (rows: list of column dicts)
+_transaction_listeners = []
+
+def add_transaction_listener(fn):
+    """Register a callback for newly inserted transactions (e.g. in-memory indexes)"""
+    if fn not in _transaction_listeners:
+        _transaction_listeners.append(fn)
+
+def _notify_transaction_listeners(user_id: int, rows: List[Dict]):
+    for fn in list(_transaction_listeners):
+        try:
+            fn(user_id, rows)
+        except Exception as e:
+            print(f"Transaction listener {getattr(fn, '__name__', fn)} failed: {e}")
+
 def add_transaction(user_id: int, date: str, trans_type: str, category: str, amount: float, 
                    subcategory: str = None, description: str = None, account: str = None, 
                    is_repaid: int = 0, linked_id: int = None, is_credit_card_payment: int = 0,
                    paid_amount: float = 0.0, loan_interest_rate: float = None, 
                    loan_tenure_months: int = None, loan_emi: float = None, 
                    loan_start_date: str = None, loan_end_date: str = None, loan_lender_bank: str = None,
-                   is_reinvestment: int = 0, is_self: int = 0):
-    """Add a new transaction for a user"""
-    conn = get_connection()
+                   is_reinvestment: int = 0, is_self: int = 0, currency: str = None, counterparty: str = None):
+    """Add a new transaction for a user (currency None = the user's base currency).
+
+    Returns the new id, or None when the account keeps its balance in another currency.
+    """
+    if trans_type == 'Debt' and category == 'Friends' and not counterparty:
+        counterparty = counterparty_from_description(description)
+    
+    conn = get_connection(user_id)
     cursor = conn.cursor()
+    if _account_currency_conflict(conn, user_id, account, currency):
+        conn.close()
+        return None
     
     cursor.execute('''
         INSERT INTO transactions (user_id, date, type, category, subcategory, amount, description, account, 
                                 is_repaid, linked_id, is_credit_card_payment, paid_amount,
                                 loan_interest_rate, loan_tenure_months, loan_emi, loan_start_date, loan_end_date, loan_lender_bank,
-                                is_reinvestment, is_self)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                is_reinvestment, is_self, currency, counterparty, fingerprint)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (user_id, date, trans_type, category, subcategory, amount, description, account, 
           is_repaid, linked_id, is_credit_card_payment, paid_amount,
           loan_interest_rate, loan_tenure_months, loan_emi, loan_start_date, loan_end_date, loan_lender_bank,
-          is_reinvestment, is_self))
+          is_reinvestment, is_self, currency, counterparty, transaction_fingerprint(user_id, trans_type, amount, description)))
     
     conn.commit()
     trans_id = cursor.lastrowid
     conn.close()
+    
+    _notify_transaction_listeners(user_id, [{
+        'id': trans_id, 'date': date, 'type': trans_type, 'category': category, 'amount': amount,
+        'description': description, 'account': account
+    }])
     return trans_id
 
+# Columns accepted by add_transactions_bulk (besides user_id)
+BULK_COLUMNS = ['date', 'type', 'category', 'subcategory', 'amount', 'description', 'account',
+                'is_repaid', 'linked_id', 'is_credit_card_payment', 'paid_amount',
+                'loan_interest_rate', 'loan_tenure_months', 'loan_emi', 'loan_start_date', 'loan_end_date',
+                'loan_lender_bank', 'is_reinvestment', 'is_self', 'currency', 'occurrence_key', 'counterparty']
+
+def add_transactions_bulk(user_id: int, rows, skip_duplicates: bool = True,
+                          window_days: int = None, ignore_conflicts: bool = False, return_skipped: bool = False):
+    """Insert many transactions in one database transaction.
+
+    rows is a DataFrame or list of dicts using the transactions column names
+    (date, type, category and amount required). With skip_duplicates, rows
+    matching an existing transaction (same fingerprint within window_days)
+    are left out; each existing row absorbs at most one incoming row, so
+    genuinely repeated purchases in a statement still get in. With
+    ignore_conflicts, rows hitting a unique index (occurrence_key) are skipped.
+    Rows whose account keeps its balance in another currency are always left out.
+    Returns the number of rows inserted, or (inserted, skipped rows of rows)
+    with return_skipped.
+    """
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+    if df.empty:
+        return (0, df) if return_skipped else 0
+    missing = [c for c in ('date', 'type', 'category', 'amount') if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    if df[['date', 'type', 'category', 'amount']].isna().any().any():
+        raise ValueError("date, type, category and amount must be set on every row")
+
+    friends = (df['type'] == 'Debt') & (df['category'] == 'Friends')
+    if friends.any():
+        df = df.copy()
+        given = df['counterparty'] if 'counterparty' in df.columns else pd.Series(None, index=df.index, dtype=object)
+        descriptions = df['description'] if 'description' in df.columns else pd.Series(None, index=df.index, dtype=object)
+        guessed = descriptions[friends & given.isna()].map(counterparty_from_description)
+        df['counterparty'] = given.astype(object).where(given.notna(), guessed)
+
+    columns = [c for c in BULK_COLUMNS if c in df.columns] + ['fingerprint']
+    data = df.reindex(columns=columns).copy()
+    data['date'] = pd.to_datetime(data['date'], format='mixed').dt.strftime('%Y-%m-%d')
+    data['fingerprint'] = [transaction_fingerprint(user_id, t, a, d) for t, a, d in
+                           zip(data['type'], data['amount'], data.get('description', pd.Series(None, index=data.index)))]
+    # Plain Python values for sqlite3 (None for missing)
+    data = data.astype(object).where(data.notna(), None)
+
+    conn = get_connection(user_id)
+    left_out = np.zeros(len(data), dtype=bool)
+    if 'account' in data.columns:
+        left_out |= _match_account_currency_conflicts(conn, user_id, data).to_numpy()
+        if left_out.any():
+            logger.info("add_transactions_bulk: left out %d row(s) in another currency than their account for user %s",
+                        int(left_out.sum()), user_id)
+    if skip_duplicates:
+        kept = np.flatnonzero(~left_out)
+        duplicate = _match_existing_duplicates(conn, user_id, data.iloc[kept], window_days).to_numpy()
+        left_out[kept[duplicate]] = True
+        if duplicate.any():
+            logger.info("add_transactions_bulk: left out %d suspected duplicate(s) for user %s", int(duplicate.sum()), user_id)
+    skipped = df[left_out]
+    data = data[~left_out]
+    if data.empty:
+        conn.close()
+        return (0, skipped) if return_skipped else 0
+    verb = "INSERT OR IGNORE" if ignore_conflicts else "INSERT"
+    cursor = conn.executemany(
+        f"{verb} INTO transactions (user_id, {', '.join(columns)}) VALUES (?, {', '.join('?' for _ in columns)})",
+        ((user_id,) + row for row in data.itertuples(index=False, name=None))
+    )
+    inserted = cursor.rowcount
+    conn.commit()
+    conn.close()
+
+    _notify_transaction_listeners(user_id, data.to_dict('records'))
+    return (inserted, skipped) if return_skipped else inserted
+
+def _match_account_currency_conflicts(conn, user_id: int, data: pd.DataFrame) -> pd.Series:
+    """Boolean mask of rows in data (account, currency) whose existing account is in another currency"""
+    accounts = pd.read_sql_query("SELECT LOWER(name) AS name, currency FROM accounts WHERE user_id = ?",
+                                 conn, params=[user_id])
+    names = data['account'].map(lambda a: a.strip().lower() if isinstance(a, str) else None)
+    account_currency = names.map(dict(zip(accounts['name'], accounts['currency'])))
+    known = names.isin(set(accounts['name']))
+    currency = data['currency'] if 'currency' in data.columns else pd.Series(None, index=data.index, dtype=object)
+    return known & (account_currency.fillna('') != currency.fillna(''))
+
+def _match_existing_duplicates(conn, user_id: int, data: pd.DataFrame, window_days: int = None) -> pd.Series:
+    """Boolean mask of rows in data (date, fingerprint) that duplicate stored transactions.
+
+    Matching is one-to-one: each stored row absorbs at most one incoming row.
+    Both sides are sorted by (fingerprint, day) and walked once together, so
+    the cost stays linear however many rows share a fingerprint.
+    """
+    window = DUPLICATE_WINDOW_DAYS if window_days is None else window_days
+    # Rows without a description have no fingerprint and are never duplicates
+    fingerprints = [fp for fp in data['fingerprint'].unique() if fp is not None]
+    existing = []
+    # Stay under SQLite's bound-parameter limit
+    for i in range(0, len(fingerprints), 500):
+        chunk = fingerprints[i:i + 500]
+        existing.append(pd.read_sql_query(
+            f"SELECT fingerprint, date FROM transactions WHERE user_id = ? AND fingerprint IN ({', '.join('?' * len(chunk))})",
+            conn, params=[user_id] + chunk))
+    existing = pd.concat(existing) if existing else pd.DataFrame(columns=['fingerprint', 'date'])
+
+    mask = np.zeros(len(data), dtype=bool)
+    if existing.empty:
+        return pd.Series(mask, index=data.index)
+
+    # Fingerprint codes shared by both sides, and days as integers
+    candidates = np.flatnonzero(data['fingerprint'].isin(set(existing['fingerprint'])).to_numpy())
+    codes, _ = pd.factorize(pd.concat([existing['fingerprint'], data['fingerprint'].iloc[candidates]], ignore_index=True))
+    stored_code, incoming_code = codes[:len(existing)], codes[len(existing):]
+    stored_day = pd.to_datetime(existing['date'], format='mixed').to_numpy(dtype='datetime64[D]').astype(np.int64)
+    incoming_day = pd.to_datetime(data['date'].iloc[candidates], format='mixed').to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+    stored_order = np.lexsort((stored_day, stored_code))
+    incoming_order = np.lexsort((incoming_day, incoming_code))
+    stored_keys = list(zip(stored_code[stored_order].tolist(), stored_day[stored_order].tolist()))
+    j = 0
+    for k in incoming_order.tolist():
+        code, day = int(incoming_code[k]), int(incoming_day[k])
+        # Skip stored rows of earlier fingerprints or too old for this row; they cannot match later rows either
+        while j < len(stored_keys) and stored_keys[j] < (code, day - window):
+            j += 1
+        # The earliest unused stored row inside the window absorbs this row (maximal one-to-one matching)
+        if j < len(stored_keys) and stored_keys[j][0] == code and stored_keys[j][1] <= day + window:
+            mask[candidates[k]] = True
+            j += 1
+    return pd.Series(mask, index=data.index)
+
+def find_duplicates(user_id: int, date: str, amount: float, description: str = None,
+                    window_days: int = None, trans_type: str = None) -> pd.DataFrame:
+    """Stored transactions that a new entry would duplicate (same type and fingerprint within the window)"""
+    window = DUPLICATE_WINDOW_DAYS if window_days is None else window_days
+    fingerprint = transaction_fingerprint(user_id, trans_type, amount, description)
+    if fingerprint is None:
+        return pd.DataFrame(columns=['id', 'date', 'type', 'category', 'amount', 'description', 'account'])
+    conn = get_connection(user_id)
+    df = read_frame('''
+        SELECT id, date, type, category, amount, description, account FROM transactions
+        WHERE user_id = ? AND fingerprint = ? AND date BETWEEN date(?, ?) AND date(?, ?)
+        ORDER BY date DESC
+    ''', conn, params=[user_id, fingerprint,
+                       str(date), f"-{int(window)} days", str(date), f"+{int(window)} days"])
+    conn.close()
+    return df
+
+def get_duplicate_clusters(user_id: int, window_days: int = None) -> pd.DataFrame:
+    """Suspected duplicates: transactions sharing a fingerprint whose dates chain within the window.
+
+    One windowed pass: LAG gives the gap to the previous row of the same
+    fingerprint, a running sum of gaps larger than the window numbers the
+    clusters, and clusters with more than one row are returned.
+    """
+    window = DUPLICATE_WINDOW_DAYS if window_days is None else window_days
+    conn = get_connection(user_id)
+    df = read_frame('''
+        WITH ordered AS (
+            SELECT id, date, type, category, amount, description, account, fingerprint,
+                   julianday(date) - julianday(LAG(date) OVER (PARTITION BY fingerprint ORDER BY date, id)) AS gap_days
+            FROM transactions
+            WHERE user_id = ? AND fingerprint IS NOT NULL
+        ),
+        grouped AS (
+            SELECT *, SUM(CASE WHEN gap_days IS NULL OR gap_days > ? THEN 1 ELSE 0 END)
+                          OVER (PARTITION BY fingerprint ORDER BY date, id) AS grp
+            FROM ordered
+        ),
+        sized AS (
+            SELECT *, COUNT(*) OVER (PARTITION BY fingerprint, grp) AS cluster_size,
+                      MAX(date) OVER (PARTITION BY fingerprint, grp) AS cluster_last_date
+            FROM grouped
+        )
+        SELECT DENSE_RANK() OVER (ORDER BY cluster_last_date DESC, fingerprint, grp) AS cluster,
+               id, date, type, category, amount, description, account, cluster_size
+        FROM sized
+        WHERE cluster_size > 1
+        ORDER BY cluster, date, id
+    ''', conn, params=[user_id, window])
+    conn.close()
+    return df
+
 def get_transactions(user_id: int, start_date: str = None, end_date: str = None, 
                     trans_type: str = None, category: str = None) -> pd.DataFrame:
-    """Get transactions for a user with optional filters"""
-    conn = get_connection()
-    
-    query = 'SELECT * FROM transactions WHERE user_id = ?'
+    """Get transactions for a user with optional filters (archived years included when in range)"""
+    if _touches_archive(user_id, start_date, end_date):
+        conn = get_lifetime_connection(user_id)
+        query = 'SELECT * FROM all_transactions WHERE user_id = ?'
+    else:
+        conn = get_connection(user_id)
+        query = 'SELECT * FROM transactions WHERE user_id = ?'
     params = [user_id]
     
     if start_date:
@@ -497,11 +1459,72 @@ def get_transactions(user_id: int, start_date: str = None, end_date: str = None,
     
     query += ' ORDER BY date DESC, id DESC'
     
-    df = pd.read_sql_query(query, conn, params=params)
+    df = read_frame(query, conn, params=params)
     conn.close()
     
     return df
 
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, as a prefix"""
+    terms = [t.replace('"', '') for t in text.split()]
+    return ' '.join(f'"{t}"*' for t in terms if t)
+
+def search_transactions(user_id: int, query: str, limit: int = 100, trans_type: str = None,
+                        category: str = None) -> pd.DataFrame:
+    """Full-text search over description, account, category and lender, best matches first (bm25).
+
+    Archived years are searched through their own FTS index (archives written
+    before they had one are matched with LIKE) and come back with archived = 1.
+    """
+    match = _fts_query(query or '')
+    if not match:
+        return get_transactions(user_id, trans_type=trans_type, category=category).head(0)
+
+    filters = ''
+    params = [user_id]
+    if trans_type:
+        filters += ' AND t.type = ?'
+        params.append(trans_type)
+    if category:
+        filters += ' AND t.category = ?'
+        params.append(category)
+
+    conn = get_lifetime_connection(user_id) if get_archived_years(user_id) else get_connection(user_id)
+    columns = [row[1] for row in conn.execute("PRAGMA main.table_info(transactions)")]
+    schemas = [row[1] for row in conn.execute("PRAGMA database_list") if row[1] == 'main' or row[1].startswith('archive_')]
+    terms = query.split()
+
+    def source_sql(schema: str, use_fts: bool):
+        """One source's matches as (sql, params) with aligned columns and a rank (lower is better)"""
+        present = {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(transactions)")}
+        cols = ', '.join(f"t.{c}" if c in present else f"NULL AS {c}" for c in columns)
+        flag = ", 0 AS archived" if schema == 'main' else ", 1 AS archived"
+        if use_fts:
+            weights = ', '.join(str(w) for w in FTS_COLUMNS.values())
+            return (f"SELECT {cols}{flag}, bm25(f, {weights}) AS _rank FROM {schema}.transactions_fts AS f "
+                    f"JOIN {schema}.transactions t ON t.id = f.rowid WHERE f MATCH ? AND t.user_id = ?{filters}",
+                    [match] + params)
+        searched = [c for c in FTS_COLUMNS if c in present]
+        like = ' AND '.join('(' + ' OR '.join(f"t.{c} LIKE ?" for c in searched) + ')' for _ in terms)
+        return (f"SELECT {cols}{flag}, 0.0 AS _rank FROM {schema}.transactions t WHERE {like} AND t.user_id = ?{filters}",
+                [f"%{t}%" for t in terms for _ in searched] + params)
+
+    def run(sources):
+        sql = ' UNION ALL '.join(f"SELECT * FROM ({q})" for q, _ in sources)
+        df = read_frame(f"SELECT * FROM ({sql}) ORDER BY _rank, date DESC, id DESC LIMIT ?", conn,
+                        params=[p for _, ps in sources for p in ps] + [int(limit)])
+        return df.drop(columns='_rank')
+
+    try:
+        has_fts = {schema: conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'transactions_fts'").fetchone()
+                   is not None for schema in schemas}
+        df = run([source_sql(schema, has_fts[schema]) for schema in schemas])
+    except (sqlite3.OperationalError, pd.errors.DatabaseError):
+        # No FTS5 in this SQLite build: substring match on the same columns
+        df = run([source_sql(schema, False) for schema in schemas])
+    conn.close()
+    return df
+
 def update_transaction(user_id: int, trans_id: int, date: str = None, trans_type: str = None, 
                       category: str = None, amount: float = None, 
                       subcategory: str = None, description: str = None, account: str = None,
@@ -509,14 +1532,24 @@ def update_transaction(user_id: int, trans_id: int, date: str = None, trans_type
                       loan_interest_rate: float = None, loan_tenure_months: int = None, 
                       loan_emi: float = None, loan_start_date: str = None, 
                       loan_end_date: str = None, loan_lender_bank: str = None,
-                      is_reinvestment: int = None, is_self: int = None):
-    """Update an existing transaction for a user"""
-    conn = get_connection()
+                      is_reinvestment: int = None, is_self: int = None, currency: str = None,
+                      counterparty: str = None):
+    """Update an existing transaction for a user.
+
+    False when it is not in the hot table or would land in an account kept in another currency.
+    """
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     
     # Verify ownership
-    cursor.execute("SELECT id FROM transactions WHERE id = ? AND user_id = ?", (trans_id, user_id))
-    if not cursor.fetchone():
+    cursor.execute("SELECT type, amount, description, account, currency FROM transactions WHERE id = ? AND user_id = ?",
+                   (trans_id, user_id))
+    current = cursor.fetchone()
+    if not current:
+        conn.close()
+        return False
+    if _account_currency_conflict(conn, user_id, current['account'] if account is None else account,
+                                  current['currency'] if currency is None else currency):
         conn.close()
         return False
     
@@ -574,6 +1607,19 @@ def update_transaction(user_id: int, trans_id: int, date: str = None, trans_type
     if is_self is not None:
         updates.append('is_self = ?')
         params.append(is_self)
+    if currency is not None:
+        updates.append('currency = ?')
+        params.append(currency)
+    if counterparty is not None:
+        updates.append('counterparty = ?')
+        params.append(counterparty.strip() or None)
+    if trans_type is not None or amount is not None or description is not None:
+        updates.append('fingerprint = ?')
+        params.append(transaction_fingerprint(
+            user_id,
+            trans_type if trans_type is not None else current['type'],
+            amount if amount is not None else current['amount'],
+            description if description is not None else current['description']))
     
     if updates:
         params.append(trans_id)
@@ -586,28 +1632,63 @@ def update_transaction(user_id: int, trans_id: int, date: str = None, trans_type
     conn.close()
     return True
 
-def delete_transaction(user_id: int, trans_id: int):
-    """Delete a transaction for a user"""
-    conn = get_connection()
+def delete_transaction(user_id: int, trans_id: int) -> bool:
+    """Delete a transaction for a user (False when it is not in the hot table, e.g. archived)"""
+    conn = get_connection(user_id)
     cursor = conn.cursor()
+    cursor.execute('SELECT linked_id FROM transactions WHERE id = ? AND user_id = ?', (trans_id, user_id))
+    row = cursor.fetchone()
     cursor.execute('DELETE FROM transactions WHERE id = ? AND user_id = ?', (trans_id, user_id))
-    conn.commit()
+    deleted = cursor.rowcount > 0
+    if row and row['linked_id'] is not None:
+        _refresh_debt_payments(cursor, row['linked_id'])
     conn.commit()
     conn.close()
+    return deleted
 
 def delete_transaction_by_link(user_id: int, linked_id: int):
-    """Delete a transaction that is linked to another id"""
-    conn = get_connection()
+    """Delete the repayments linked to a debt; the debt is reopened unless its own amount is covered"""
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     cursor.execute('DELETE FROM transactions WHERE linked_id = ? AND user_id = ?', (linked_id, user_id))
+    _refresh_debt_payments(cursor, linked_id)
     conn.commit()
     conn.close()
 
+def _refresh_last_payment(cursor, debt_id: int):
+    """Recompute a debt's last_payment_at from its remaining linked repayments"""
+    cursor.execute('''
+        UPDATE transactions SET last_payment_at = (
+            SELECT MAX(date) FROM transactions WHERE linked_id = ?
+        ) WHERE id = ?
+    ''', (debt_id, debt_id))
+
+def _refresh_debt_payments(cursor, debt_id: int):
+    """Recompute paid_amount, is_repaid, last_payment_at and closed_at from the remaining linked repayments.
+
+    Uses the settlement rules of repay_debt / pay_emi: EMI loans are settled by EMI x tenure
+    (10 tolerance), other debts by their amount (0.1 tolerance).
+    """
+    cursor.execute('''
+        UPDATE transactions SET
+            paid_amount = (SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE linked_id = ?),
+            last_payment_at = (SELECT MAX(date) FROM transactions WHERE linked_id = ?)
+        WHERE id = ?
+    ''', (debt_id, debt_id, debt_id))
+    cursor.execute('''
+        UPDATE transactions SET is_repaid = CASE
+            WHEN COALESCE(loan_emi, 0) != 0 THEN paid_amount >= loan_emi * COALESCE(NULLIF(loan_tenure_months, 0), 1) - 10
+            ELSE paid_amount >= amount - 0.1
+        END WHERE id = ?
+    ''', (debt_id,))
+    cursor.execute("UPDATE transactions SET closed_at = CASE WHEN is_repaid = 1 THEN last_payment_at END WHERE id = ?",
+                   (debt_id,))
+
 # ========== CATEGORY OPERATIONS ==========
 
 def get_categories(user_id: int, cat_type: str = None) -> pd.DataFrame:
     """Get categories for a user, optionally filtered by type"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     
     query = 'SELECT * FROM categories WHERE user_id = ? AND is_active = 1'
     params = [user_id]
@@ -618,14 +1699,14 @@ def get_categories(user_id: int, cat_type: str = None) -> pd.DataFrame:
         
     query += ' ORDER BY type, name'
     
-    df = pd.read_sql_query(query, conn, params=params)
+    df = read_frame(query, conn, params=params)
     
     conn.close()
     return df
 
 def add_category(user_id: int, name: str, cat_type: str, is_loan: int = 0):
     """Add a new category for a user"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     
     try:
@@ -657,11 +1738,17 @@ def add_category(user_id: int, name: str, cat_type: str, is_loan: int = 0):
 
 def update_category(user_id: int, cat_id: int, name: str, cat_type: str, is_loan: int = 0):
     """Update a category for a user"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     
     try:
+        cursor.execute('SELECT name, type FROM categories WHERE id = ? AND user_id = ?', (cat_id, user_id))
+        old = cursor.fetchone()
         cursor.execute('UPDATE categories SET name = ?, type = ?, is_loan = ? WHERE id = ? AND user_id = ?', (name, cat_type, is_loan, cat_id, user_id))
+        if old:
+            # A budget follows its category
+            cursor.execute('UPDATE budgets SET category = ?, type = ? WHERE user_id = ? AND category = ? AND type = ?',
+                           (name, cat_type, user_id, old['name'], old['type']))
         conn.commit()
         conn.close()
         return True
@@ -671,7 +1758,7 @@ def update_category(user_id: int, cat_id: int, name: str, cat_type: str, is_loan
 
 def delete_category(user_id: int, cat_id: int):
     """Soft delete a category for a user"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     cursor.execute('UPDATE categories SET is_active = 0 WHERE id = ? AND user_id = ?', (cat_id, user_id))
     conn.commit()
@@ -679,15 +1766,23 @@ def delete_category(user_id: int, cat_id: int):
 
 # ========== RECURRING ITEMS OPERATIONS ==========
 
-def add_recurring_item(user_id: int, name: str, trans_type: str, category: str, amount: float, is_active: int = 1):
-    """Add a new recurring item"""
-    conn = get_connection()
+RECURRING_FREQUENCIES = {'monthly': 1, 'quarterly': 3, 'half_yearly': 6, 'yearly': 12}
+
+def add_recurring_item(user_id: int, name: str, trans_type: str, category: str, amount: float, is_active: int = 1,
+                       auto_post: int = 0, frequency: str = 'monthly', day_of_month: int = 1,
+                       start_date: str = None, end_date: str = None, account: str = None):
+    """Add a new recurring item (auto_post items are materialized by scheduler.py)"""
+    if frequency not in RECURRING_FREQUENCIES:
+        raise ValueError(f"Unknown frequency '{frequency}'")
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     
     cursor.execute('''
-        INSERT INTO recurring_items (user_id, name, type, category, amount, is_active)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (user_id, name, trans_type, category, amount, is_active))
+        INSERT INTO recurring_items (user_id, name, type, category, amount, is_active,
+                                     auto_post, frequency, day_of_month, start_date, end_date, account)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, name, trans_type, category, amount, is_active,
+          auto_post, frequency, day_of_month, start_date, end_date, account))
     
     conn.commit()
     item_id = cursor.lastrowid
@@ -696,64 +1791,507 @@ def add_recurring_item(user_id: int, name: str, trans_type: str, category: str,
 
 def get_recurring_items(user_id: int) -> pd.DataFrame:
     """Get all recurring items for a user"""
-    conn = get_connection()
-    df = pd.read_sql_query("SELECT * FROM recurring_items WHERE user_id = ? ORDER BY type, amount DESC", conn, params=[user_id])
+    conn = get_connection(user_id)
+    df = read_frame("SELECT * FROM recurring_items WHERE user_id = ? ORDER BY type, amount DESC", conn, params=[user_id])
     conn.close()
     return df
 
-def update_recurring_item(item_id: int, user_id: int, name: str, trans_type: str, category: str, amount: float, is_active: int):
-    """Update a recurring item"""
-    conn = get_connection()
+def update_recurring_item(item_id: int, user_id: int, name: str, trans_type: str, category: str, amount: float, is_active: int,
+                          schedule: Dict = None):
+    """Update a recurring item. schedule optionally sets auto_post, frequency, day_of_month, start_date, end_date, account."""
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     
-    cursor.execute('''
+    updates = ['name = ?', 'type = ?', 'category = ?', 'amount = ?', 'is_active = ?']
+    params = [name, trans_type, category, amount, is_active]
+    for key, value in (schedule or {}).items():
+        if key not in ('auto_post', 'frequency', 'day_of_month', 'start_date', 'end_date', 'account'):
+            raise ValueError(f"Unknown schedule field '{key}'")
+        if key == 'frequency' and value not in RECURRING_FREQUENCIES:
+            raise ValueError(f"Unknown frequency '{value}'")
+        updates.append(f"{key} = ?")
+        params.append(value)
+    
+    cursor.execute(f'''
         UPDATE recurring_items 
-        SET name = ?, type = ?, category = ?, amount = ?, is_active = ?
+        SET {', '.join(updates)}
         WHERE id = ? AND user_id = ?
-    ''', (name, trans_type, category, amount, is_active, item_id, user_id))
+    ''', params + [item_id, user_id])
     
     conn.commit()
     success = cursor.rowcount > 0
     conn.close()
     return success
 
+def get_scheduled_recurring_items(user_id: int) -> pd.DataFrame:
+    """Active recurring items that the scheduler posts as transactions"""
+    conn = get_connection(user_id)
+    df = pd.read_sql_query(
+        "SELECT * FROM recurring_items WHERE user_id = ? AND is_active = 1 AND auto_post = 1 ORDER BY id",
+        conn, params=[user_id])
+    conn.close()
+    return df
+
+def get_existing_occurrence_keys(user_id: int, keys: List[str]) -> set:
+    """Subset of keys already posted, including occurrences deleted or archived since"""
+    found = set()
+    # recurring_postings outlives deletes; all_transactions covers rows archived before it existed
+    conn = get_lifetime_connection(user_id)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        marks = ', '.join('?' * len(chunk))
+        rows = conn.execute(
+            f"SELECT occurrence_key FROM main.recurring_postings WHERE user_id = ? AND occurrence_key IN ({marks}) "
+            f"UNION SELECT occurrence_key FROM all_transactions WHERE occurrence_key IN ({marks})",
+            [user_id, *chunk, *chunk])
+        found.update(r[0] for r in rows)
+    conn.close()
+    return found
+
 def delete_recurring_item(item_id: int, user_id: int):
     """Delete a recurring item"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM recurring_items WHERE id = ? AND user_id = ?", (item_id, user_id))
+    if cursor.rowcount:
+        cursor.execute("DELETE FROM recurring_postings WHERE user_id = ? AND occurrence_key LIKE ?",
+                       (user_id, f"rec:{int(item_id)}:%"))
     conn.commit()
     conn.close()
 
-# ========== SUMMARY & ANALYTICS ==========
+# ========== CALENDAR ==========
+# Period bucketing (weeks, quarters, fiscal years) comes from the calendar table:
+# bounds are a primary key range lookup and multi-period reports join on date.
+
+# Period keys stored per day (also usable as aggregate() dimensions, except month/year)
+CALENDAR_PERIODS = ('week', 'quarter', 'fiscal_year', 'fiscal_quarter')
+PERIOD_KEYS = ('week', 'month', 'quarter', 'year', 'fiscal_year', 'fiscal_quarter')
+
+_calendar_lock = threading.Lock()
+
+def _check_fy_start(fy_start_month) -> int:
+    fy_start_month = int(fy_start_month)
+    if not 1 <= fy_start_month <= 12:
+        raise ValueError("fy_start_month must be between 1 and 12")
+    return fy_start_month
+
+def _calendar_rows(fy_start_month: int):
+    """One tuple per day in the calendar range for the given fiscal year start"""
+    days = pd.date_range(f"{CALENDAR_FIRST_YEAR}-01-01", f"{CALENDAR_LAST_YEAR}-12-31", freq='D')
+    iso = days.isocalendar()
+    fiscal_year = days.year - (days.month < fy_start_month).astype(int)
+    fiscal_q = (days.month - fy_start_month) % 12 // 3 + 1
+    frame = pd.DataFrame({
+        'fy_start_month': fy_start_month,
+        'date': days.strftime('%Y-%m-%d'),
+        'week': iso['year'].astype(str).values + '-W' + iso['week'].astype(str).str.zfill(2).values,
+        'month': days.strftime('%Y-%m'),
+        'quarter': days.year.astype(str) + '-Q' + ((days.month - 1) // 3 + 1).astype(str),
+        'year': days.year,
+        'fiscal_year': fiscal_year,
+        'fiscal_quarter': 'FY' + fiscal_year.astype(str) + '-Q' + fiscal_q.astype(str),
+    })
+    return frame.itertuples(index=False, name=None)
+
+def _ensure_calendar(conn, fy_start_month: int):
+    """Populate the calendar rows for a fiscal year start on first use"""
+    last_day = f"{CALENDAR_LAST_YEAR}-12-31"
+    check = "SELECT 1 FROM calendar WHERE fy_start_month = ? AND date = ?"
+    if conn.execute(check, (fy_start_month, last_day)).fetchone():
+        return
+    with _calendar_lock:
+        if conn.execute(check, (fy_start_month, last_day)).fetchone():
+            return
+        conn.executemany("INSERT OR IGNORE INTO calendar VALUES (?, ?, ?, ?, ?, ?, ?, ?)", _calendar_rows(fy_start_month))
+        conn.commit()
+
+def get_period_range(period: str, ref_date, fy_start_month: int = 1) -> Tuple[date, date]:
+    """First and last day of the week / month / quarter / year / fiscal_year / fiscal_quarter containing ref_date"""
+    if period not in PERIOD_KEYS:
+        raise ValueError(f"Unknown period '{period}'")
+    fy_start_month = _check_fy_start(fy_start_month)
+    ref = ref_date if isinstance(ref_date, date) else date.fromisoformat(str(ref_date)[:10])
+    if isinstance(ref, datetime):
+        ref = ref.date()
 
-def get_summary(user_id: int, start_date: str = None, end_date: str = None) -> Dict:
-    """Get summary statistics for a user"""
     conn = get_connection()
-    
-    # Exclude Friends Debt and Credit Card marked Expenses from generic summary
-    query = """
-        SELECT type, SUM(amount) as total 
-        FROM transactions 
-        WHERE user_id = ? 
-        AND NOT (type = 'Debt' AND category = 'Friends')
+    _ensure_calendar(conn, fy_start_month)
+    # No period is longer than a year, so the PK range around ref_date bounds the scan
+    row = conn.execute(f"""
+        SELECT MIN(date), MAX(date) FROM calendar
+        WHERE fy_start_month = ? AND date BETWEEN ? AND ?
+        AND {period} = (SELECT {period} FROM calendar WHERE fy_start_month = ? AND date = ?)
+    """, (fy_start_month, str(ref - timedelta(days=366)), str(ref + timedelta(days=366)),
+          fy_start_month, str(ref))).fetchone()
+    conn.close()
+
+    if row is None or row[0] is None:
+        raise ValueError(f"{ref} is outside the calendar range")
+    return date.fromisoformat(row[0]), date.fromisoformat(row[1])
+
+# ========== FX RATES ==========
+# transactions.currency holds the currency an amount was entered in (NULL means
+# the user's base currency). Rates from FX_RATES_CSV are copied into the
+# fx_rates table of each database file on first use, so aggregate() converts
+# with an as-of lookup inside SQL; convert_amounts() is the NumPy equivalent
+# for frames that are already loaded.
+
+_fx_loaded = {}  # database file -> signature of the CSV copied into it
+_fx_lock = threading.Lock()
+_fx_frame = (None, None)  # (CSV signature, rates frame) for convert_amounts
+
+def _fx_csv_signature(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _check_currency(code) -> str:
+    """Validated currency code (safe to inline into SQL)"""
+    code = str(code or '').strip().upper()
+    if not re.fullmatch(r'[A-Z]{3}', code):
+        raise ValueError(f"Invalid currency code '{code}'")
+    return code
+
+def read_fx_csv(path: str = None) -> pd.DataFrame:
+    """Rates from a CSV with date, currency, rate columns (empty frame when the file is missing)"""
+    path = path or FX_RATES_CSV
+    if not os.path.exists(path):
+        return pd.DataFrame({'currency': pd.Series(dtype=object), 'date': pd.Series(dtype=object),
+                             'rate': pd.Series(dtype=float)})
+    raw = pd.read_csv(path)
+    raw.columns = [str(c).strip().lower() for c in raw.columns]
+    missing = [c for c in ('date', 'currency', 'rate') if c not in raw.columns]
+    if missing:
+        raise ValueError(f"FX rates CSV is missing columns: {', '.join(missing)}")
+    rates = pd.DataFrame({
+        'currency': raw['currency'].astype(str).str.strip().str.upper(),
+        'date': pd.to_datetime(raw['date'], format='mixed').dt.strftime('%Y-%m-%d'),
+        'rate': pd.to_numeric(raw['rate'], errors='coerce'),
+    })
+    rates = rates[rates['rate'] > 0]
+    return rates.drop_duplicates(['currency', 'date'], keep='last').sort_values(['currency', 'date'], ignore_index=True)
+
+def save_fx_rates(rates: pd.DataFrame, path: str = None) -> int:
+    """Replace the FX rates CSV (validated); databases pick it up on their next report. Returns rows saved."""
+    path = path or FX_RATES_CSV
+    tmp = path + '.tmp'
+    rates.to_csv(tmp, index=False)
+    try:
+        clean = read_fx_csv(tmp)
+    except Exception:
+        os.remove(tmp)
+        raise
+    clean.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return len(clean)
+
+def _ensure_fx_rates(conn):
+    """Copy FX_RATES_CSV into this database's fx_rates table when the file changed"""
+    signature = _fx_csv_signature(FX_RATES_CSV)
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    if signature is None or _fx_loaded.get(db_file) == signature:
+        return
+    with _fx_lock:
+        if _fx_loaded.get(db_file) == signature:
+            return
+        rates = read_fx_csv(FX_RATES_CSV)
+        conn.execute("DELETE FROM fx_rates")
+        conn.executemany("INSERT INTO fx_rates (currency, date, rate) VALUES (?, ?, ?)",
+                         rates.itertuples(index=False, name=None))
+        conn.commit()
+        _fx_loaded[db_file] = signature
+
+def get_fx_rates() -> pd.DataFrame:
+    """Loaded rates (currency, date, rate), re-read only when the CSV changes"""
+    global _fx_frame
+    signature = _fx_csv_signature(FX_RATES_CSV)
+    if _fx_frame[0] != signature or _fx_frame[1] is None:
+        _fx_frame = (signature, read_fx_csv(FX_RATES_CSV))
+    return _fx_frame[1]
+
+def _fx_rate_sql(currency_sql: str) -> str:
+    """Units of currency per pivot on transactions.date (latest earlier rate, else the first known)"""
+    return f"""CASE WHEN {currency_sql} = '{FX_PIVOT_CURRENCY}' THEN 1.0 ELSE COALESCE(
+            (SELECT rate FROM fx_rates WHERE currency = {currency_sql} AND date <= transactions.date ORDER BY date DESC LIMIT 1),
+            (SELECT rate FROM fx_rates WHERE currency = {currency_sql} ORDER BY date LIMIT 1)) END"""
+
+def fx_factor_sql(to_currency: str, base_currency: str = None) -> str:
+    """SQL factor turning transactions.amount into to_currency (1.0 when a rate is missing).
+
+    Untagged rows are in base_currency (default: to_currency). Without a rate the
+    amount counts unconverted rather than dropping out of totals.
+    """
+    to_currency = _check_currency(to_currency)
+    base_currency = _check_currency(base_currency or to_currency)
+    source = f"COALESCE(transactions.currency, '{base_currency}')"
+    return f"""(CASE WHEN {source} = '{to_currency}' THEN 1.0
+        ELSE COALESCE(({_fx_rate_sql(f"'{to_currency}'")}) / ({_fx_rate_sql(source)}), 1.0) END)"""
+
+def convertible_currencies(to_currency: str, rates: pd.DataFrame = None) -> List[str]:
+    """Currency codes that convert into to_currency with the loaded rates (to_currency first)"""
+    to_currency = _check_currency(to_currency)
+    rates = get_fx_rates() if rates is None else rates
+    known = set(rates['currency']) | {FX_PIVOT_CURRENCY}
+    if to_currency not in known:
+        return [to_currency]
+    return [to_currency] + sorted(known - {to_currency})
+
+def _rates_on(currencies: np.ndarray, days: np.ndarray, rates: pd.DataFrame) -> np.ndarray:
+    """As-of rate per element, one searchsorted per currency (NaN when unknown)"""
+    out = np.full(len(currencies), np.nan)
+    out[currencies == FX_PIVOT_CURRENCY] = 1.0
+    for code, group in rates.groupby('currency', sort=False):
+        mask = currencies == code
+        if not mask.any():
+            continue
+        rate_days = group['date'].to_numpy(dtype='datetime64[D]')
+        idx = np.searchsorted(rate_days, days[mask], side='right') - 1
+        out[mask] = group['rate'].to_numpy()[np.clip(idx, 0, None)]
+    return out
+
+def convert_amounts(amounts, currencies, dates, to_currency: str, base_currency: str = None,
+                    rates: pd.DataFrame = None) -> np.ndarray:
+    """Vectorized conversion of amounts (entered in currencies on dates) into to_currency.
+
+    Missing currencies mean base_currency (default: to_currency). Uses the same
+    as-of rule as the SQL conversion; amounts without a known rate stay unconverted.
+    """
+    to_currency = _check_currency(to_currency)
+    base_currency = _check_currency(base_currency or to_currency)
+    rates = get_fx_rates() if rates is None else rates
+    amounts = np.asarray(amounts, dtype=float)
+    codes = pd.Series(np.asarray(currencies, dtype=object)).fillna(base_currency).str.upper().to_numpy(dtype=object)
+    foreign = codes != to_currency
+    if not foreign.any():
+        return amounts.copy()
+
+    days = pd.to_datetime(pd.Series(np.asarray(dates, dtype=object))[foreign]).to_numpy(dtype='datetime64[D]')
+    factor = np.ones(len(amounts))
+    factor[foreign] = (_rates_on(np.full(foreign.sum(), to_currency, dtype=object), days, rates)
+                       / _rates_on(codes[foreign], days, rates))
+    return amounts * np.nan_to_num(factor, nan=1.0)
+
+def convert_frame(df: pd.DataFrame, to_currency: str, columns: Sequence[str] = ('amount',),
+                  base_currency: str = None) -> pd.DataFrame:
+    """Copy of a transactions frame with the money columns converted into to_currency"""
+    if df.empty or 'currency' not in df.columns:
+        return df
+    if df['currency'].isna().all() and (base_currency is None or base_currency == to_currency):
+        return df
+    df = df.copy()
+    for col in columns:
+        if col in df.columns:
+            df[col] = convert_amounts(df[col], df['currency'], df['date'], to_currency, base_currency)
+    return df
+
+# ========== AGGREGATION ENGINE ==========
+# aggregate() compiles measures / group_by / filters into one parameterized
+# GROUP BY over transactions. Compiled SQL is cached per query shape.
+
+# Expense-like outflows are reported together as 'Expense' (CC-paid Vehicle/Subscriptions stay separate)
+FLOW_TYPE_SQL = """CASE
+        WHEN type IN ('Expense', 'Banking') THEN 'Expense'
+        WHEN (type IN ('Vehicle', 'Subscriptions') AND is_credit_card_payment != 1) THEN 'Expense'
+        ELSE type
+    END"""
+
+AGG_DIMENSIONS = {
+    'month': "strftime('%Y-%m', transactions.date)",
+    'year': "strftime('%Y', transactions.date)",
+    'date': 'transactions.date',
+    # Calendar dimensions (joined on date for the requested fiscal year start)
+    'week': 'calendar.week',
+    'quarter': 'calendar.quarter',
+    'fiscal_year': 'calendar.fiscal_year',
+    'fiscal_quarter': 'calendar.fiscal_quarter',
+    'type': 'type',
+    'flow_type': FLOW_TYPE_SQL,
+    'category': 'category',
+    'subcategory': 'subcategory',
+    'account': 'account',
+    'is_credit_card_payment': 'is_credit_card_payment',
+    'is_reinvestment': 'is_reinvestment',
+    'is_self': 'is_self',
+    'is_repaid': 'is_repaid',
+}
+
+# {amount} / {paid} are filled with the money columns converted into the report currency
+AGG_MEASURES = {
+    'total': 'SUM({amount})',
+    'count': 'COUNT(*)',
+    'avg': 'AVG({amount})',
+    'min': 'MIN({amount})',
+    'max': 'MAX({amount})',
+    'paid': 'SUM({paid})',
+    'outstanding': 'SUM({amount} - {paid})',
+}
+
+# Flag filters are inlined as 0/1 literals (not bound) so SQLite can match partial indexes
+AGG_FLAG_FILTERS = ('is_credit_card_payment', 'is_reinvestment', 'is_self', 'is_repaid')
+
+# Known types are inlined for the same reason (e.g. type = 'Vehicle' for idx_transactions_vehicle_cc)
+TRANSACTION_TYPES = ('Income', 'Expense', 'Investment', 'Credit Card', 'Debt', 'Vehicle', 'Banking', 'Subscriptions')
+
+# Named row scopes used by the summaries
+AGG_SCOPES = {
+    # Cash flow view: Friends debt, CC-paid expenses/subscriptions and reinvestments excluded
+    'cash_flow': """NOT (type = 'Debt' AND category = 'Friends')
         AND NOT (type = 'Expense' AND is_credit_card_payment = 1)
         AND NOT (type = 'Subscriptions' AND is_credit_card_payment = 1)
-        AND is_reinvestment = 0
+        AND is_reinvestment = 0""",
+    # Debt repayments: EMI / loan repayment expenses or expenses linked to a debt
+    'debt_repayment': """type = 'Expense'
+        AND (category = 'EMI' OR subcategory = 'Loan Repayment' OR linked_id IS NOT NULL)""",
+}
+
+def _as_values(value) -> tuple:
+    if isinstance(value, (list, tuple, set)):
+        return tuple(value)
+    return (value,)
+
+def _normalize_filters(filters: Dict) -> Tuple[tuple, list]:
+    """Split filters into a hashable query shape and the bound parameters"""
+    shape = []
+    params = []
+    for key in sorted(filters):
+        value = filters[key]
+        if value is None:
+            continue
+        if key in ('start_date', 'end_date', 'category_prefix'):
+            shape.append((key, 1))
+            if key == 'category_prefix':
+                value = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            params.append(str(value))
+        elif key in ('type', 'flow_type', 'category', 'account'):
+            values = _as_values(value)
+            if not values:
+                raise ValueError(f"Empty value list for filter '{key}'")
+            if key == 'type' and all(v in TRANSACTION_TYPES for v in values):
+                shape.append((key, values))  # inlined literals
+                continue
+            shape.append((key, len(values)))
+            params.extend(values)
+        elif key in AGG_FLAG_FILTERS:
+            if int(value) not in (0, 1):
+                raise ValueError(f"Flag filter '{key}' must be 0 or 1")
+            shape.append((key, int(value)))
+        elif key == 'scope':
+            if value not in AGG_SCOPES:
+                raise ValueError(f"Unknown scope '{value}'")
+            shape.append((key, value))
+        else:
+            raise ValueError(f"Unknown filter '{key}'")
+    return tuple(shape), params
+
+@lru_cache(maxsize=256)
+def _compile_aggregate(measures: tuple, group_by: tuple, filter_shape: tuple, order_by: tuple,
+                       fy_start_month: int = 1, currency: str = None, base_currency: str = None,
+                       lifetime: bool = False) -> str:
+    """Build the SQL for one aggregate() query shape"""
+    for m in measures:
+        if m not in AGG_MEASURES:
+            raise ValueError(f"Unknown measure '{m}'")
+    for g in group_by:
+        if g not in AGG_DIMENSIONS:
+            raise ValueError(f"Unknown dimension '{g}'")
+
+    if currency is None:
+        money = {'amount': 'amount', 'paid': 'COALESCE(paid_amount, 0)'}
+    else:
+        factor = fx_factor_sql(currency, base_currency)
+        money = {'amount': f"amount * {factor}", 'paid': f"COALESCE(paid_amount, 0) * {factor}"}
+    select = [f"{AGG_DIMENSIONS[g]} AS {g}" for g in group_by]
+    select += [f"{AGG_MEASURES[m].format(**money)} AS {m}" for m in measures]
+
+    where = ['user_id = ?']
+    for key, spec in filter_shape:
+        if key == 'start_date':
+            where.append('transactions.date >= ?')
+        elif key == 'end_date':
+            where.append('transactions.date <= ?')
+        elif key == 'category_prefix':
+            where.append("category LIKE ? ESCAPE '\\'")
+        elif key in AGG_FLAG_FILTERS:
+            where.append(f"{key} = {spec}")
+        elif key == 'scope':
+            where.append(f"({AGG_SCOPES[spec]})")
+        elif isinstance(spec, tuple):
+            literals = [f"'{v}'" for v in spec]
+            where.append(f"{key} = {literals[0]}" if len(literals) == 1 else f"{key} IN ({', '.join(literals)})")
+        else:
+            column = FLOW_TYPE_SQL if key == 'flow_type' else key
+            where.append(f"{column} = ?" if spec == 1 else f"{column} IN ({', '.join('?' * spec)})")
+
+    # lifetime: read the archive-spanning temp view (see get_lifetime_connection)
+    source = "all_transactions AS transactions" if lifetime else "transactions"
+    query = f"SELECT {', '.join(select)} FROM {source}"
+    if any(g in CALENDAR_PERIODS for g in group_by):
+        query += f" JOIN calendar ON calendar.fy_start_month = {int(fy_start_month)} AND calendar.date = transactions.date"
+    query += f" WHERE {' AND '.join(where)}"
+    if group_by:
+        query += f" GROUP BY {', '.join(AGG_DIMENSIONS[g] for g in group_by)}"
+
+    order = []
+    for name in order_by:
+        desc = name.startswith('-')
+        name = name.lstrip('-')
+        if name not in group_by and name not in measures:
+            raise ValueError(f"Cannot order by '{name}'")
+        order.append(f"{name} DESC" if desc else name)
+    if order:
+        query += f" ORDER BY {', '.join(order)}"
+    return query
+
+def aggregate(user_id: int, measures: Sequence[str] = ('total',), group_by: Sequence[str] = (),
+              filters: Dict = None, order_by: Sequence[str] = None, fy_start_month: int = 1,
+              currency: str = None) -> pd.DataFrame:
+    """Aggregate a user's transactions in SQL.
+
+    measures: keys of AGG_MEASURES, group_by: keys of AGG_DIMENSIONS.
+    filters: start_date, end_date, type, flow_type, category, account (value or list),
+    category_prefix (case-insensitive), flag columns (0/1) and scope (AGG_SCOPES).
+    order_by: dimension / measure names, '-' prefix for descending (default: group_by).
+    fy_start_month: first month of the fiscal year for the week/quarter/fiscal_* dimensions.
+    currency: report currency for money measures (default: the user's base currency);
+    rows in other currencies are converted at the rate of their date.
     """
-    params = [user_id]
-    
-    if start_date:
-        query += ' AND date >= ?'
-        params.append(start_date)
-    
-    if end_date:
-        query += ' AND date <= ?'
-        params.append(end_date)
-    query += ' GROUP BY type'
-    
-    df = pd.read_sql_query(query, conn, params=params)
+    measures = tuple(measures)
+    group_by = tuple(group_by)
+    filter_shape, filter_params = _normalize_filters(filters or {})
+    order_by = group_by if order_by is None else tuple(_as_values(order_by))
+    if not any(g in CALENDAR_PERIODS for g in group_by):
+        fy_start_month = 1  # no calendar join, keep one cache entry per shape
+    base_currency = _check_currency(get_user_currency(user_id))
+    currency = _check_currency(currency or base_currency)
+    filters = filters or {}
+    lifetime = _touches_archive(user_id, filters.get('start_date'), filters.get('end_date'))
+    query = _compile_aggregate(measures, group_by, filter_shape, order_by, _check_fy_start(fy_start_month),
+                               currency, base_currency, lifetime)
+
+    conn = get_lifetime_connection(user_id) if lifetime else get_connection(user_id)
+    _ensure_fx_rates(conn)
+    if fy_start_month != 1 or any(g in CALENDAR_PERIODS for g in group_by):
+        _ensure_calendar(conn, fy_start_month)
+    df = pd.read_sql_query(query, conn, params=[user_id] + filter_params)
     conn.close()
+    return df
+
+def _aggregate_total(user_id: int, filters: Dict) -> float:
+    """Single SUM(amount) for the given filters (0.0 when nothing matches)"""
+    df = aggregate(user_id, ['total'], filters=filters)
+    total = df['total'].iloc[0] if not df.empty else None
+    return float(total) if pd.notnull(total) else 0.0
+
+# ========== SUMMARY & ANALYTICS ==========
+
+def get_summary(user_id: int, start_date: str = None, end_date: str = None) -> Dict:
+    """Get summary statistics for a user"""
+    period = {'start_date': start_date, 'end_date': end_date}
+
+    # Exclude Friends Debt and Credit Card marked Expenses from generic summary
+    df = aggregate(user_id, ['total'], ['type'], {'scope': 'cash_flow', **period})
     
     summary = {
         'total_income': 0,
@@ -784,45 +2322,11 @@ def get_summary(user_id: int, start_date: str = None, end_date: str = None) -> D
         elif row['type'] == 'Subscriptions':
             summary['total_subs'] = row['total']
     
-    # Calculate Debt Repayments (Expenses that are EMI or Loan Repayments)
-    # We define Repayments as Expenses with category='EMI', subcategory='Loan Repayment', or linked_id is not null
-    # For now, let's query specifically for this
-    query_repay = '''
-        SELECT SUM(amount) as total 
-        FROM transactions 
-        WHERE user_id = ? 
-        AND type = 'Expense' 
-        AND (category = 'EMI' OR subcategory = 'Loan Repayment' OR linked_id IS NOT NULL)
-    '''
-    params_repay = [user_id]
-    if start_date:
-        query_repay += ' AND date >= ?'
-        params_repay.append(start_date)
-    if end_date:
-        query_repay += ' AND date <= ?'
-        params_repay.append(end_date)
-        
-    conn = get_connection()
-    df_repay = pd.read_sql_query(query_repay, conn, params=params_repay)
-    conn.close()
-    
-    total_repaid = df_repay['total'].iloc[0] if not df_repay.empty and pd.notnull(df_repay['total'].iloc[0]) else 0.0
-    summary['total_debt_repayment'] = total_repaid
+    # Debt Repayments: Expenses with category='EMI', subcategory='Loan Repayment', or linked_id is not null
+    summary['total_debt_repayment'] = _aggregate_total(user_id, {'scope': 'debt_repayment', **period})
 
-    # Calculate Vehicle expenses paid via Credit Card (to exclude from savings deduction)
-    query_vehicle_cc = "SELECT SUM(amount) as total FROM transactions WHERE user_id = ? AND type = 'Vehicle' AND is_credit_card_payment = 1"
-    params_vcc = [user_id]
-    if start_date:
-        query_vehicle_cc += ' AND date >= ?'
-        params_vcc.append(start_date)
-    if end_date:
-        query_vehicle_cc += ' AND date <= ?'
-        params_vcc.append(end_date)
-        
-    conn = get_connection()
-    df_vcc = pd.read_sql_query(query_vehicle_cc, conn, params=params_vcc)
-    conn.close()
-    vehicle_cc = df_vcc['total'].iloc[0] if not df_vcc.empty and pd.notnull(df_vcc['total'].iloc[0]) else 0.0
+    # Vehicle expenses paid via Credit Card (to exclude from savings deduction)
+    vehicle_cc = _aggregate_total(user_id, {'type': 'Vehicle', 'is_credit_card_payment': 1, **period})
 
     # Include Banking and OTT in expense calculation for net savings
     # FIX: Do NOT subtract total_debt (New Debt) from savings. Borrowing is not an expense.
@@ -835,49 +2339,21 @@ def get_summary(user_id: int, start_date: str = None, end_date: str = None) -> D
 
 def get_category_breakdown(user_id: int, trans_type: str, start_date: str = None, end_date: str = None) -> pd.DataFrame:
     """Get breakdown by category for a specific transaction type and user"""
-    conn = get_connection()
-    
-    query = 'SELECT category, SUM(amount) as total FROM transactions WHERE user_id = ?'
-    params = [user_id]
-    
-    if trans_type == 'Expense':
-        # Aggregate all expense types, excluding CC payments for Vehicle/Subs
-        query += """ AND (
-            type IN ('Expense', 'Banking') 
-            OR (type IN ('Vehicle', 'Subscriptions') AND is_credit_card_payment != 1)
-        )"""
-    else:
-        query += ' AND type = ?'
-        params.append(trans_type)
-    
-    if start_date:
-        query += ' AND date >= ?'
-        params.append(start_date)
-    
-    if end_date:
-        query += ' AND date <= ?'
-        params.append(end_date)
-    
-    query += ' GROUP BY category ORDER BY total DESC'
-    
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    
-    return df
+    # 'Expense' aggregates all expense types, excluding CC payments for Vehicle/Subs
+    type_filter = {'flow_type': 'Expense'} if trans_type == 'Expense' else {'type': trans_type}
+    return aggregate(user_id, ['total'], ['category'],
+                     {**type_filter, 'start_date': start_date, 'end_date': end_date},
+                     order_by='-total')
 
 def get_portfolio_status(user_id: int) -> dict:
     """Get overall portfolio status (Assets vs Liabilities) for a user"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     
-    # 1. Fetch Lifetime Totals for Cash Flow calc
+    currency = get_user_currency(user_id)
+    
+    # 1. Fetch Lifetime Totals for Cash Flow calc (converted into the base currency)
     # Group by Type AND is_credit_card_payment to exclude CC expenses from Cash deduction
-    query_totals = '''
-        SELECT type, is_credit_card_payment, SUM(amount) as total 
-        FROM transactions 
-        WHERE user_id = ?
-        GROUP BY type, is_credit_card_payment
-    '''
-    df_totals = pd.read_sql_query(query_totals, conn, params=[user_id])
+    df_totals = aggregate(user_id, ['total'], ['type', 'is_credit_card_payment'], currency=currency)
     
     lifetime_income = 0
     lifetime_expense = 0
@@ -890,6 +2366,8 @@ def get_portfolio_status(user_id: int) -> dict:
     for _, row in df_totals.iterrows():
         t = row['type']
         amt = row['total']
+        if pd.isna(amt):
+            continue  # only rows without an exchange rate
         is_cc = row['is_credit_card_payment'] == 1
         
         if t == 'Income':
@@ -915,7 +2393,8 @@ def get_portfolio_status(user_id: int) -> dict:
         SELECT * FROM transactions 
         WHERE user_id = ? AND type = 'Debt' AND is_repaid = 0
     '''
-    df_loans = pd.read_sql_query(query_loans, conn, params=[user_id])
+    df_loans = convert_frame(pd.read_sql_query(query_loans, conn, params=[user_id]), currency,
+                             ('amount', 'paid_amount', 'loan_emi'))
     
     query_cats = "SELECT name, is_loan FROM categories WHERE user_id = ?"
     df_cats = pd.read_sql_query(query_cats, conn, params=[user_id])
@@ -958,78 +2437,26 @@ def get_portfolio_status(user_id: int) -> dict:
 
 def get_monthly_trend(user_id: int, start_date: str = None, end_date: str = None) -> pd.DataFrame:
     """Get monthly trend data for a user"""
-    conn = get_connection()
-    
-    query = '''
-        SELECT month, mapped_type as type, SUM(amount) as total
-        FROM (
-            SELECT 
-                strftime('%Y-%m', date) as month,
-                CASE 
-                    WHEN type IN ('Expense', 'Banking') THEN 'Expense'
-                    WHEN (type IN ('Vehicle', 'Subscriptions') AND is_credit_card_payment != 1) THEN 'Expense'
-                    ELSE type 
-                END as mapped_type,
-                amount
-            FROM transactions
-            WHERE user_id = ?
-    '''
-    params = [user_id]
-    
-    if start_date:
-        query += ' AND date >= ?'
-        params.append(start_date)
-    
-    if end_date:
-        query += ' AND date <= ?'
-        params.append(end_date)
-    
-    query += ') GROUP BY month, mapped_type ORDER BY month'
-    
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    
-    return df
+    df = aggregate(user_id, ['total'], ['month', 'flow_type'], {'start_date': start_date, 'end_date': end_date},
+                   order_by='month')
+    return df.rename(columns={'flow_type': 'type'})
 
 def get_monthly_category_trend(user_id: int, trans_type: str, start_date: str = None, end_date: str = None) -> pd.DataFrame:
     """Get monthly trend data broken down by category for a user"""
-    conn = get_connection()
-    
-    query = '''
-        SELECT 
-            strftime('%Y-%m', date) as month,
-            category,
-            SUM(amount) as total
-        FROM transactions
-        WHERE user_id = ? AND type = ?
-    '''
-    params = [user_id, trans_type]
-    
-    if start_date:
-        query += ' AND date >= ?'
-        params.append(start_date)
-    
-    if end_date:
-        query += ' AND date <= ?'
-        params.append(end_date)
-    
-    query += ' GROUP BY month, category ORDER BY month'
-    
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    
-    return df
+    return aggregate(user_id, ['total'], ['month', 'category'],
+                     {'type': trans_type, 'start_date': start_date, 'end_date': end_date},
+                     order_by='month')
 
 def repay_debt(user_id: int, debt_id: int, repay_amount: float, account_name: str, date_str: str) -> bool:
     """Process a partial or full repayment of a debt"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     
     # 1. Get Debt Details
     cursor.execute("SELECT amount, paid_amount, description FROM transactions WHERE id = ? AND user_id = ?", (debt_id, user_id))
     row = cursor.fetchone()
     
-    if not row:
+    if not row or _account_currency_conflict(conn, user_id, account_name):
         conn.close()
         return False
         
@@ -1046,9 +2473,10 @@ def repay_debt(user_id: int, debt_id: int, repay_amount: float, account_name: st
     expense_desc = f"Repayment to {desc} (Part)" if repay_amount < (remaining - 0.1) else f"Repayment to {desc} (Final)"
     
     cursor.execute('''
-        INSERT INTO transactions (user_id, date, type, category, subcategory, amount, description, account, linked_id)
-        VALUES (?, ?, 'Expense', 'Friends Payment', 'Repayment', ?, ?, ?, ?)
-    ''', (user_id, date_str, repay_amount, expense_desc, account_name, debt_id))
+        INSERT INTO transactions (user_id, date, type, category, subcategory, amount, description, account, linked_id, fingerprint)
+        VALUES (?, ?, 'Expense', 'Friends Payment', 'Repayment', ?, ?, ?, ?, ?)
+    ''', (user_id, date_str, repay_amount, expense_desc, account_name, debt_id,
+          transaction_fingerprint(user_id, 'Expense', repay_amount, expense_desc)))
     
     # 4. Update Debt Transaction
     new_paid_amount = paid_so_far + repay_amount
@@ -1056,14 +2484,66 @@ def repay_debt(user_id: int, debt_id: int, repay_amount: float, account_name: st
     
     cursor.execute("UPDATE transactions SET paid_amount = ?, is_repaid = ? WHERE id = ?", 
                   (new_paid_amount, is_fully_repaid, debt_id))
+    _record_debt_payment(cursor, debt_id, date_str, is_fully_repaid)
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def _record_debt_payment(cursor, debt_id: int, date_str: str, closed: int):
+    """Advance last_payment_at and set closed_at to the latest payment when the debt is settled"""
+    cursor.execute('''
+        UPDATE transactions SET
+            last_payment_at = CASE WHEN last_payment_at IS NULL OR last_payment_at < ? THEN ? ELSE last_payment_at END
+        WHERE id = ?
+    ''', (date_str, date_str, debt_id))
+    cursor.execute("UPDATE transactions SET closed_at = CASE WHEN ? = 1 THEN last_payment_at END WHERE id = ?",
+                   (closed, debt_id))
+
+def pay_emi(user_id: int, loan_id: int, amount: float, account_name: str, date_str: str) -> bool:
+    """Record an EMI payment for a loan; the loan is closed once the total payable is covered"""
+    conn = get_connection(user_id)
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT amount, paid_amount, category, loan_lender_bank, loan_emi, loan_tenure_months
+        FROM transactions WHERE id = ? AND user_id = ? AND type = 'Debt'
+    ''', (loan_id, user_id))
+    loan = cursor.fetchone()
+    if not loan or amount <= 0 or _account_currency_conflict(conn, user_id, account_name):
+        conn.close()
+        return False
     
+    description = f"EMI for {loan['category']} ({loan['loan_lender_bank']})"
+    cursor.execute('''
+        INSERT INTO transactions (user_id, date, type, category, subcategory, amount, description, account, linked_id, fingerprint)
+        VALUES (?, ?, 'Expense', 'EMI', 'Loan Repayment', ?, ?, ?, ?, ?)
+    ''', (user_id, date_str, amount, description, account_name, loan_id,
+          transaction_fingerprint(user_id, 'Expense', amount, description)))
+    payment_id = cursor.lastrowid
+    
+    # Loans with an EMI schedule are settled by EMI x tenure (small tolerance for rounding)
+    if loan['loan_emi']:
+        total_payable = loan['loan_emi'] * (loan['loan_tenure_months'] or 1)
+    else:
+        total_payable = loan['amount']
+    new_paid = (loan['paid_amount'] or 0) + amount
+    is_done = 1 if new_paid >= (total_payable - 10) else 0
+    
+    cursor.execute("UPDATE transactions SET paid_amount = ?, is_repaid = ? WHERE id = ?", (new_paid, is_done, loan_id))
+    _record_debt_payment(cursor, loan_id, date_str, is_done)
     conn.commit()
     conn.close()
+    
+    _notify_transaction_listeners(user_id, [{
+        'id': payment_id, 'date': date_str, 'type': 'Expense', 'category': 'EMI', 'amount': amount,
+        'description': description, 'account': account_name
+    }])
     return True
 
 def toggle_transaction_repaid(user_id: int, trans_id: int):
     """Toggle the repaid status of a transaction"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     
     cursor.execute("SELECT is_repaid FROM transactions WHERE id = ? AND user_id = ?", (trans_id, user_id))
@@ -1072,6 +2552,12 @@ def toggle_transaction_repaid(user_id: int, trans_id: int):
     if result:
         new_status = 1 if result['is_repaid'] == 0 else 0
         cursor.execute("UPDATE transactions SET is_repaid = ? WHERE id = ?", (new_status, trans_id))
+        _refresh_last_payment(cursor, trans_id)
+        # Closed on the last repayment, or today when settled without one
+        cursor.execute('''
+            UPDATE transactions SET closed_at = CASE WHEN ? = 1 THEN COALESCE(last_payment_at, ?) END
+            WHERE id = ?
+        ''', (new_status, str(date.today()), trans_id))
         conn.commit()
         conn.close()
         return True
@@ -1079,29 +2565,571 @@ def toggle_transaction_repaid(user_id: int, trans_id: int):
     conn.close()
     return False
 
-def get_friends_debts(user_id: int) -> pd.DataFrame:
-    """Get all Friends Debt transactions"""
-    conn = get_connection()
-    query = "SELECT * FROM transactions WHERE user_id = ? AND type = 'Debt' AND category = 'Friends' ORDER BY date DESC"
-    df = pd.read_sql_query(query, conn, params=[user_id])
+def get_closed_loans(user_id: int, year: int) -> pd.DataFrame:
+    """Loans (debts in loan categories) closed during a year, latest first"""
+    conn = get_connection(user_id)
+    df = read_frame('''
+        SELECT * FROM transactions
+        WHERE user_id = ? AND closed_at >= ? AND closed_at <= ? AND type = 'Debt'
+        AND category IN (SELECT name FROM categories WHERE user_id = ? AND is_loan = 1)
+        ORDER BY closed_at DESC
+    ''', conn, params=[user_id, f"{int(year)}-01-01", f"{int(year)}-12-31", user_id])
     conn.close()
     return df
 
-def check_integrity() -> bool:
-    """Check database integrity"""
-    conn = get_connection()
+def get_recent_repayments(user_id: int, since: str, category: str = None) -> pd.DataFrame:
+    """Debts with a repayment on or after since (optionally one category), latest payment first"""
+    conn = get_connection(user_id)
+    query = "SELECT * FROM transactions WHERE user_id = ? AND last_payment_at >= ? AND type = 'Debt'"
+    params = [user_id, since]
+    if category:
+        query += " AND category = ?"
+        params.append(category)
+    df = read_frame(query + " ORDER BY last_payment_at DESC", conn, params=params)
+    conn.close()
+    return df
+
+def get_friends_debts(user_id: int, counterparty: str = None) -> pd.DataFrame:
+    """Get all Friends Debt transactions (only one person's when counterparty is given)"""
+    conn = get_connection(user_id)
+    query = "SELECT * FROM transactions WHERE user_id = ? AND type = 'Debt' AND category = 'Friends'"
+    params = [user_id]
+    if counterparty:
+        query += " AND counterparty = ?"
+        params.append(counterparty)
+    df = read_frame(query + " ORDER BY date DESC", conn, params=params)
+    conn.close()
+    return df
+
+def get_counterparty_ledger(user_id: int) -> pd.DataFrame:
+    """Friends debt totals per person (outstanding, borrowed, repaid, last activity), largest outstanding first"""
+    conn = get_connection(user_id)
+    df = pd.read_sql_query('''
+        SELECT counterparty, debt_count, open_count, total_borrowed, total_repaid, outstanding, first_date, last_activity
+        FROM counterparty_ledger WHERE user_id = ?
+        ORDER BY outstanding DESC, last_activity DESC
+    ''', conn, params=[user_id])
+    conn.close()
+    return df
+
+# ========== ACCOUNTS ==========
+
+def get_accounts(user_id: int) -> pd.DataFrame:
+    """User's accounts with their current balances (maintained on every write)"""
+    conn = get_connection(user_id)
+    df = read_frame('''
+        SELECT id, name, type, currency, opening_balance, balance, last_activity, created_at
+        FROM accounts WHERE user_id = ? ORDER BY type, name
+    ''', conn, params=[user_id])
+    conn.close()
+    return df
+
+def get_account_balance(user_id: int, name: str) -> Optional[float]:
+    """Balance of one account by name (None if the account does not exist)"""
+    conn = get_connection(user_id)
+    row = conn.execute("SELECT balance FROM accounts WHERE user_id = ? AND name = ? COLLATE NOCASE",
+                       (user_id, (name or '').strip())).fetchone()
+    conn.close()
+    return row['balance'] if row else None
+
+def add_account(user_id: int, name: str, account_type: str = 'Bank', opening_balance: float = 0.0,
+                currency: str = None) -> bool:
+    """Create an account kept in currency (None = the user's base currency); False if the name is empty or already taken"""
+    name = (name or '').strip()
+    if not name:
+        return False
+    conn = get_connection(user_id)
+    try:
+        conn.execute("INSERT INTO accounts (user_id, name, type, currency, opening_balance, balance) VALUES (?, ?, ?, ?, ?, ?)",
+                     (user_id, name, account_type, currency, opening_balance, opening_balance))
+        conn.commit()
+        return True
+    except sqlite3.IntegrityError:
+        return False
+    finally:
+        conn.close()
+
+def update_account(user_id: int, account_id: int, name: str = None, account_type: str = None,
+                   opening_balance: float = None) -> bool:
+    """Rename an account (its transactions follow), change its type or opening balance"""
+    conn = get_connection(user_id)
     cursor = conn.cursor()
+    cursor.execute("SELECT name, opening_balance FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
+    current = cursor.fetchone()
+    if not current:
+        conn.close()
+        return False
     try:
-        cursor.execute("PRAGMA integrity_check")
-        result = cursor.fetchone()
+        if name is not None and name.strip() and name.strip() != current['name']:
+            cursor.execute("UPDATE accounts SET name = ? WHERE id = ?", (name.strip(), account_id))
+            # The link trigger resolves the new name back to this same account
+            cursor.execute("UPDATE transactions SET account = ? WHERE account_id = ?", (name.strip(), account_id))
+        if account_type is not None:
+            cursor.execute("UPDATE accounts SET type = ? WHERE id = ?", (account_type, account_id))
+        if opening_balance is not None:
+            cursor.execute("UPDATE accounts SET opening_balance = ?, balance = balance + ? WHERE id = ?",
+                           (opening_balance, opening_balance - (current['opening_balance'] or 0), account_id))
+        conn.commit()
+        return True
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return False
+    finally:
         conn.close()
-        return result[0] == "ok"
-    except:
+
+def delete_account(user_id: int, account_id: int) -> bool:
+    """Delete an account that no transaction uses"""
+    conn = get_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM transactions WHERE account_id = ? LIMIT 1", (account_id,))
+    if cursor.fetchone():
+        conn.close()
+        return False
+    cursor.execute("DELETE FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
+    conn.commit()
+    conn.close()
+    return True
+
+def reconcile_accounts(user_id: int) -> pd.DataFrame:
+    """Recompute balances from the full history (archives included) and fix any drift.
+
+    Returns the accounts whose stored balance was off: name, stored, recomputed, drift.
+    """
+    conn = get_lifetime_connection(user_id)
+    cursor = conn.cursor()
+    stored = pd.read_sql_query("SELECT id, name, balance AS stored FROM accounts WHERE user_id = ?", conn, params=[user_id])
+    _recompute_account_balances(cursor, 'all_transactions', user_id)
+    conn.commit()
+    recomputed = pd.read_sql_query("SELECT id, balance AS recomputed FROM accounts WHERE user_id = ?", conn, params=[user_id])
+    conn.close()
+    
+    result = stored.merge(recomputed, on='id')
+    result['drift'] = result['recomputed'] - result['stored']
+    return result[result['drift'].abs() > 0.005][['name', 'stored', 'recomputed', 'drift']].reset_index(drop=True)
+
+# ========== BUDGETS ==========
+
+def get_budgets(user_id: int) -> pd.DataFrame:
+    conn = get_connection(user_id)
+    df = pd.read_sql_query("SELECT id, type, category, monthly_limit FROM budgets WHERE user_id = ? ORDER BY type, category",
+                           conn, params=[user_id])
+    conn.close()
+    return df
+
+def set_budget(user_id: int, trans_type: str, category: str, monthly_limit: float) -> bool:
+    """Add or change a category's monthly budget (a limit of 0 removes it)"""
+    conn = get_connection(user_id)
+    if not monthly_limit or monthly_limit <= 0:
+        conn.execute("DELETE FROM budgets WHERE user_id = ? AND type = ? AND category = ?", (user_id, trans_type, category))
+    else:
+        conn.execute('''
+            INSERT INTO budgets (user_id, type, category, monthly_limit) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, type, category) DO UPDATE SET monthly_limit = excluded.monthly_limit
+        ''', (user_id, trans_type, category, float(monthly_limit)))
+    conn.commit()
+    conn.close()
+    return True
+
+def delete_budget(user_id: int, budget_id: int):
+    conn = get_connection(user_id)
+    conn.execute("DELETE FROM budgets WHERE id = ? AND user_id = ?", (budget_id, user_id))
+    conn.commit()
+    conn.close()
+
+def get_budget_status(user_id: int, month: str = None, today: date = None) -> pd.DataFrame:
+    """Spent vs budget for every budgeted category in a month (default: the current one).
+
+    Reads the budget_usage counters by primary key, no transaction scan. Adds
+    burn_rate (spend per elapsed day), projected month-end spend and a status:
+    Over (limit passed), At Risk (projected to pass it) or OK.
+    """
+    today = today or date.today()
+    month = month or today.strftime('%Y-%m')
+    conn = get_connection(user_id)
+    df = pd.read_sql_query('''
+        SELECT b.id, b.type, b.category, b.monthly_limit, u.currency, COALESCE(u.spent, 0) AS spent, COALESCE(u.txn_count, 0) AS txn_count
+        FROM budgets b
+        LEFT JOIN budget_usage u ON u.user_id = b.user_id AND u.month = ? AND u.type = b.type AND u.category = b.category
+        WHERE b.user_id = ?
+    ''', conn, params=[month, user_id])
+    conn.close()
+    columns = ['id', 'type', 'category', 'monthly_limit', 'spent', 'txn_count', 'remaining', 'pct_used',
+               'burn_rate', 'projected', 'status']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    # Counters are kept per entry currency; convert foreign ones at the month's rate
+    foreign = df['currency'].fillna('') != ''
+    if foreign.any():
+        base = get_user_currency(user_id)
+        df.loc[foreign, 'spent'] = convert_amounts(df.loc[foreign, 'spent'], df.loc[foreign, 'currency'],
+                                                   [f"{month}-01"] * int(foreign.sum()), base, base)
+    df = df.groupby(['id', 'type', 'category', 'monthly_limit'], as_index=False)[['spent', 'txn_count']].sum()
+
+    first = datetime.strptime(f"{month}-01", '%Y-%m-%d').date()
+    days_in_month = calendar.monthrange(first.year, first.month)[1]
+    if month == today.strftime('%Y-%m'):
+        elapsed = today.day
+    else:
+        elapsed = days_in_month if first < today else 0
+    df['remaining'] = df['monthly_limit'] - df['spent']
+    df['pct_used'] = df['spent'] / df['monthly_limit'] * 100
+    df['burn_rate'] = df['spent'] / elapsed if elapsed else 0.0
+    df['projected'] = df['burn_rate'] * days_in_month
+    df['status'] = np.select([df['spent'] > df['monthly_limit'], df['projected'] > df['monthly_limit']],
+                             ['Over', 'At Risk'], 'OK')
+    return df.sort_values('pct_used', ascending=False)[columns].reset_index(drop=True)
+
+# ========== CREDIT CARD STATEMENTS ==========
+# Each card has a statement day and a due day (1-28, so every month has them).
+# A cycle ends on the statement day: spend after it goes to next month's
+# statement. Card spend is matched to a card by its account name, falling back
+# to the default card; bill payments (type 'Credit Card', category = card) pay
+# the statement closed before them. Statements are stored in card_statements
+# and rebuilt for a user in one INSERT ... SELECT when a write marked them dirty.
+
+def _cycle_end_sql(day_col: str, stmt_day: str) -> str:
+    """Statement date of the cycle containing day_col"""
+    return f"""(CASE WHEN CAST(strftime('%d', {day_col}) AS INTEGER) <= {stmt_day}
+        THEN date({day_col}, 'start of month', '+' || ({stmt_day} - 1) || ' days')
+        ELSE date({day_col}, 'start of month', '+1 month', '+' || ({stmt_day} - 1) || ' days') END)"""
+
+def get_card_cycles(user_id: int) -> pd.DataFrame:
+    """Configured cards with their statement and due days"""
+    conn = get_connection(user_id)
+    df = pd.read_sql_query("SELECT id, card, statement_day, due_day, is_default FROM card_cycles WHERE user_id = ? ORDER BY card",
+                           conn, params=[user_id])
+    conn.close()
+    return df
+
+def save_card_cycle(user_id: int, card: str, statement_day: int, due_day: int, is_default: bool = False) -> bool:
+    """Add or update a card's cycle; is_default makes it the card for unmatched card spend"""
+    card = (card or '').strip()
+    if not card or not (1 <= int(statement_day) <= 28 and 1 <= int(due_day) <= 28):
         return False
+    conn = get_connection(user_id)
+    cursor = conn.cursor()
+    if is_default:
+        cursor.execute("UPDATE card_cycles SET is_default = 0 WHERE user_id = ?", (user_id,))
+    cursor.execute('''
+        INSERT INTO card_cycles (user_id, card, statement_day, due_day, is_default, dirty) VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT (user_id, card) DO UPDATE SET
+            statement_day = excluded.statement_day, due_day = excluded.due_day, is_default = excluded.is_default
+    ''', (user_id, card, int(statement_day), int(due_day), 1 if is_default else 0))
+    cursor.execute("UPDATE card_cycles SET dirty = 1 WHERE user_id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+    return True
+
+def delete_card_cycle(user_id: int, card_id: int):
+    conn = get_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM card_cycles WHERE id = ? AND user_id = ?", (card_id, user_id))
+    cursor.execute("UPDATE card_cycles SET dirty = 1 WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM card_statements WHERE user_id = ? AND card NOT IN (SELECT card FROM card_cycles WHERE user_id = ?)",
+                   (user_id, user_id))
+    conn.commit()
+    conn.close()
+
+def mark_card_statements_dirty(user_id: int):
+    conn = get_connection(user_id)
+    conn.execute("UPDATE card_cycles SET dirty = 1 WHERE user_id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+
+def refresh_card_statements(user_id: int, force: bool = False) -> bool:
+    """Rebuild the user's statements if a write marked them dirty. Returns True if rebuilt."""
+    conn = get_connection(user_id)
+    dirty = conn.execute("SELECT MAX(dirty) FROM card_cycles WHERE user_id = ?", (user_id,)).fetchone()[0]
+    conn.close()
+    if dirty is None or (not dirty and not force):
+        return False
+    
+    base = get_user_currency(user_id)
+    cycle_end = _cycle_end_sql('transactions.date', 'cards.statement_day')
+    spend_types = ', '.join(f"'{t}'" for t in CARD_SPEND_TYPES)
+    # Archived years keep their statements: read the lifetime view
+    conn = get_lifetime_connection(user_id)
+    _ensure_fx_rates(conn)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM main.card_statements WHERE user_id = ?", (user_id,))
+    cursor.execute(f'''
+        INSERT INTO main.card_statements (user_id, card, cycle_start, cycle_end, due_date, amount, paid, txn_count)
+        WITH cards AS (
+            SELECT card, statement_day, due_day, is_default FROM main.card_cycles WHERE user_id = :uid
+        ),
+        spend AS (
+            -- one pass over card spend: match the card by account, else the default card
+            SELECT COALESCE(matched.card, fallback.card) AS card, transactions.date AS day,
+                   transactions.amount * {fx_factor_sql(base)} AS amount
+            FROM all_transactions AS transactions
+            LEFT JOIN cards matched ON matched.card = TRIM(transactions.account) COLLATE NOCASE
+            LEFT JOIN cards fallback ON fallback.is_default = 1
+            WHERE transactions.user_id = :uid AND transactions.is_credit_card_payment = 1
+              AND transactions.type IN ({spend_types})
+        ),
+        lines AS (
+            SELECT cards.card, {cycle_end.replace('transactions.date', 'spend.day')} AS cycle_end, spend.amount, 0.0 AS paid, 1 AS n
+            FROM spend JOIN cards ON cards.card = spend.card
+            UNION ALL
+            -- a bill payment settles the statement closed before it
+            SELECT cards.card, date({cycle_end}, '-1 month'), 0.0, transactions.amount * {fx_factor_sql(base)}, 0
+            FROM all_transactions AS transactions JOIN cards ON cards.card = transactions.category COLLATE NOCASE
+            WHERE transactions.user_id = :uid AND transactions.type = 'Credit Card'
+        )
+        SELECT :uid, lines.card, date(lines.cycle_end, '-1 month', '+1 day'), lines.cycle_end,
+               CASE WHEN cards.due_day > cards.statement_day
+                    THEN date(lines.cycle_end, 'start of month', '+' || (cards.due_day - 1) || ' days')
+                    ELSE date(lines.cycle_end, 'start of month', '+1 month', '+' || (cards.due_day - 1) || ' days') END,
+               COALESCE(SUM(lines.amount), 0), COALESCE(SUM(lines.paid), 0), SUM(lines.n)
+        FROM lines JOIN cards ON cards.card = lines.card
+        GROUP BY lines.card, lines.cycle_end
+    ''', {'uid': user_id})
+    cursor.execute("UPDATE main.card_cycles SET dirty = 0 WHERE user_id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+    return True
+
+def get_card_statements(user_id: int, card: str = None, start_date: str = None, end_date: str = None) -> pd.DataFrame:
+    """Statements per card and cycle with change vs the previous cycle and a status.
+
+    status: Open (cycle not closed yet = unbilled), Due (closed, unpaid, due date ahead),
+    Paid, or Overdue.
+    """
+    refresh_card_statements(user_id)
+    today = str(date.today())
+    conn = get_connection(user_id)
+    df = pd.read_sql_query('''
+        SELECT * FROM (
+            SELECT card, cycle_start, cycle_end, due_date, amount, paid, txn_count,
+                   amount - LAG(amount) OVER (PARTITION BY card ORDER BY cycle_end) AS change,
+                   SUM(amount - paid) OVER (PARTITION BY card ORDER BY cycle_end) AS running_balance,
+                   CASE WHEN cycle_end >= :today THEN 'Open'
+                        WHEN paid >= amount - 0.5 THEN 'Paid'
+                        WHEN due_date >= :today THEN 'Due'
+                        ELSE 'Overdue' END AS status
+            FROM card_statements WHERE user_id = :uid AND (:card IS NULL OR card = :card)
+        )
+        WHERE (:start IS NULL OR cycle_end >= :start) AND (:end IS NULL OR cycle_end <= :end)
+        ORDER BY card, cycle_end
+    ''', conn, params={'uid': user_id, 'today': today, 'card': card, 'start': start_date, 'end': end_date})
+    conn.close()
+    return df
+
+def get_card_outlook(user_id: int) -> pd.DataFrame:
+    """Per card: unbilled spend in the open cycle, next statement date and what the latest statement still needs"""
+    statements = get_card_statements(user_id)
+    cards = get_card_cycles(user_id)
+    today = date.today()
+    rows = []
+    for card in cards.itertuples():
+        own = statements[statements['card'].str.lower() == card.card.lower()]
+        closed = own[own['status'] != 'Open']
+        latest = closed.iloc[-1] if not closed.empty else None
+        next_statement = today.replace(day=card.statement_day)
+        if today.day > card.statement_day:
+            next_statement = (next_statement.replace(day=1) + timedelta(days=32)).replace(day=card.statement_day)
+        rows.append({
+            'card': card.card,
+            'unbilled': float(own.loc[own['status'] == 'Open', 'amount'].sum()),
+            'next_statement': str(next_statement),
+            'due_amount': max(float(latest['amount'] - latest['paid']), 0.0) if latest is not None else 0.0,
+            'due_date': latest['due_date'] if latest is not None else None,
+            'status': latest['status'] if latest is not None else None,
+        })
+    return pd.DataFrame(rows, columns=['card', 'unbilled', 'next_statement', 'due_amount', 'due_date', 'status'])
+
+# ========== CONCURRENT PAGE LOADERS ==========
+
+_read_pool = ThreadPoolExecutor(max_workers=READ_POOL_WORKERS, thread_name_prefix='inexo-read')
+
+def _load_concurrently(calls: Dict[str, tuple]) -> Dict:
+    """Run independent read functions on the thread pool.
+
+    calls maps a result name to (function, *args). Every function opens its own
+    connection, so each worker thread reads through its own SQLite connection.
+    """
+    futures = {name: _read_pool.submit(call[0], *call[1:]) for name, call in calls.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+@dataclass
+class DashboardData:
+    """Everything the Dashboard page reads"""
+    summary: Dict
+    income_breakdown: pd.DataFrame
+    expense_breakdown: pd.DataFrame
+    recurring_items: pd.DataFrame
+    budgets: pd.DataFrame
+
+def get_dashboard_data(user_id: int, start_date: str = None, end_date: str = None) -> DashboardData:
+    """Load the Dashboard queries concurrently"""
+    results = _load_concurrently({
+        'summary': (get_summary, user_id, start_date, end_date),
+        'income_breakdown': (get_category_breakdown, user_id, 'Income', start_date, end_date),
+        'expense_breakdown': (get_category_breakdown, user_id, 'Expense', start_date, end_date),
+        'recurring_items': (get_recurring_items, user_id),
+        'budgets': (get_budget_status, user_id),
+    })
+    return DashboardData(**results)
+
+@dataclass
+class AnalyticsData:
+    """Period-dependent data shared by the Analytics tabs"""
+    summary: Dict
+    monthly_trend: pd.DataFrame
+    expense_breakdown: pd.DataFrame
+    income_breakdown: pd.DataFrame
+    investment_breakdown: pd.DataFrame
+    vehicle_breakdown: pd.DataFrame
+    debts: pd.DataFrame
+    debt_categories: pd.DataFrame
+    lifetime_trend: pd.DataFrame
+    subscriptions_trend: pd.DataFrame
+    rent_trend: pd.DataFrame
+    self_by_category: pd.DataFrame
+    self_by_month: pd.DataFrame
+
+def get_analytics_data(user_id: int, start_date: str, end_date: str) -> AnalyticsData:
+    """Load the Analytics page queries concurrently"""
+    period = {'start_date': start_date, 'end_date': end_date}
+    results = _load_concurrently({
+        'summary': (get_summary, user_id, start_date, end_date),
+        'monthly_trend': (get_monthly_trend, user_id, start_date, end_date),
+        'expense_breakdown': (get_category_breakdown, user_id, 'Expense', start_date, end_date),
+        'income_breakdown': (get_category_breakdown, user_id, 'Income', start_date, end_date),
+        'investment_breakdown': (get_category_breakdown, user_id, 'Investment', start_date, end_date),
+        'vehicle_breakdown': (get_category_breakdown, user_id, 'Vehicle', start_date, end_date),
+        'debts': (get_transactions, user_id, None, None, 'Debt'),
+        'debt_categories': (get_categories, user_id, 'Debt'),
+        'lifetime_trend': (get_monthly_trend, user_id),
+        'subscriptions_trend': (get_monthly_category_trend, user_id, 'Subscriptions', start_date, end_date),
+        'rent_trend': (aggregate, user_id, ['total'], ['month', 'category'],
+                       {**period, 'type': 'Expense', 'category_prefix': 'Rent'}),
+        'self_by_category': (aggregate, user_id, ['total'], ['category'],
+                             {**period, 'type': 'Expense', 'is_self': 1}, '-total'),
+        'self_by_month': (aggregate, user_id, ['total'], ['month'],
+                          {**period, 'type': 'Expense', 'is_self': 1}),
+    })
+    return AnalyticsData(**results)
+
+# ========== INTEGRITY ==========
+
+_integrity_lock = threading.Lock()
+_integrity_thread = None
+_integrity_cache = {}  # check_type -> latest result dict
+
+def _record_integrity_result(check_type: str, is_ok: bool, result: str, duration_ms: int):
+    """Persist an integrity check result and update the in-memory verdict"""
+    entry = {
+        'check_type': check_type,
+        'is_ok': is_ok,
+        'result': result,
+        'duration_ms': duration_ms,
+        'checked_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    with _integrity_lock:
+        _integrity_cache[check_type] = entry
+    
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO integrity_checks (check_type, is_ok, result, duration_ms, checked_at) VALUES (?, ?, ?, ?, ?)",
+                      (check_type, 1 if is_ok else 0, result, duration_ms, entry['checked_at']))
+        # Keep a short history only
+        cursor.execute("DELETE FROM integrity_checks WHERE id NOT IN (SELECT id FROM integrity_checks ORDER BY id DESC LIMIT 50)")
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        # A damaged file may refuse writes; the in-memory verdict still holds
+        print(f"Error saving integrity result: {e}")
+
+def run_integrity_check(full: bool = False) -> bool:
+    """Run PRAGMA quick_check (default) or the full integrity_check and persist the result"""
+    check_type = 'full' if full else 'quick'
+    pragma = 'integrity_check' if full else 'quick_check'
+    started = time.perf_counter()
+    # Catalog first, then every shard in sharded mode
+    targets = [(None, DATABASE_NAME)]
+    if SHARDED_MODE:
+        targets += [(uid, get_shard_path(uid)) for uid in get_shard_user_ids()]
+    
+    is_ok = True
+    problems = []
+    for uid, path in targets:
+        try:
+            conn = get_connection(uid)
+            rows = conn.execute(f"PRAGMA {pragma}").fetchall()
+            conn.close()
+            messages = [r[0] for r in rows]
+        except Exception as e:
+            messages = [str(e)]
+        if messages != ['ok']:
+            is_ok = False
+            problems += [f"{path}: {m}" for m in messages[:20]]
+    result = 'ok' if is_ok else '\n'.join(problems[:20])
+    
+    _record_integrity_result(check_type, is_ok, result, int((time.perf_counter() - started) * 1000))
+    return is_ok
+
+def check_integrity() -> bool:
+    """Check database integrity (full check, result is persisted)"""
+    return run_integrity_check(full=True)
+
+def _get_last_integrity_result(check_type: str) -> Optional[Dict]:
+    """Latest result for a check type, from memory or the integrity_checks table"""
+    with _integrity_lock:
+        if check_type in _integrity_cache:
+            return _integrity_cache[check_type]
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT check_type, is_ok, result, duration_ms, checked_at FROM integrity_checks WHERE check_type = ? ORDER BY id DESC LIMIT 1", (check_type,))
+        row = cursor.fetchone()
+        conn.close()
+    except Exception:
+        return None
+    if not row:
+        return None
+    entry = dict(row)
+    entry['is_ok'] = bool(entry['is_ok'])
+    with _integrity_lock:
+        _integrity_cache.setdefault(check_type, entry)
+    return entry
+
+def get_integrity_status() -> Dict:
+    """Cached integrity verdict: ok unless the latest quick or full check failed"""
+    quick = _get_last_integrity_result('quick')
+    full = _get_last_integrity_result('full')
+    ok = all(r['is_ok'] for r in (quick, full) if r is not None)
+    return {'ok': ok, 'quick': quick, 'full': full}
+
+def schedule_full_integrity_check(interval_hours: float = None) -> bool:
+    """Start a background full check if the last one is older than the interval. Returns True if started."""
+    global _integrity_thread
+    interval_hours = INTEGRITY_CHECK_INTERVAL_HOURS if interval_hours is None else interval_hours
+    
+    last = _get_last_integrity_result('full')
+    if last:
+        age = datetime.now() - datetime.strptime(last['checked_at'], "%Y-%m-%d %H:%M:%S")
+        if age.total_seconds() < interval_hours * 3600:
+            return False
+    
+    with _integrity_lock:
+        if _integrity_thread is not None and _integrity_thread.is_alive():
+            return False
+        _integrity_thread = threading.Thread(target=run_integrity_check, kwargs={'full': True},
+                                             name='inexo-integrity-check', daemon=True)
+        _integrity_thread.start()
+    return True
 
 def perform_backup() -> str:
     """Perform a safe backup of the database"""
-    if not check_integrity():
+    # Use the cached verdict; only run a (quick) check if none has been recorded yet
+    status = get_integrity_status()
+    if status['quick'] is None and status['full'] is None:
+        run_integrity_check()
+        status = get_integrity_status()
+    if not status['ok']:
         return "CRITICAL: Database integrity check failed. Backup aborted."
     
     backup_dir = "backups"
@@ -1120,7 +3148,232 @@ def perform_backup() -> str:
         while len(backups) > 5:
             os.remove(backups[0])
             backups.pop(0)
+        
+        if SHARDED_MODE:
+            for uid in get_shard_user_ids():
+                backup_user_shard(uid)
             
         return "Backup successful"
     except Exception as e:
         return f"Backup failed: {str(e)}"
+
+# ========== SHARD MAINTENANCE ==========
+
+def backup_user_shard(user_id: int, keep: int = 5) -> str:
+    """Back up one user's shard with the SQLite online backup API. Returns the backup path."""
+    backup_dir = os.path.join("backups", "shards", f"user_{int(user_id)}")
+    os.makedirs(backup_dir, exist_ok=True)
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_file = os.path.join(backup_dir, f"user_{int(user_id)}_{timestamp}.db")
+    
+    src = get_connection(user_id)
+    dst = sqlite3.connect(backup_file)
+    src.backup(dst)
+    dst.close()
+    src.close()
+    
+    backups = sorted([os.path.join(backup_dir, f) for f in os.listdir(backup_dir) if f.endswith('.db')], key=os.path.getmtime)
+    while len(backups) > keep:
+        os.remove(backups.pop(0))
+    return backup_file
+
+def vacuum_user_shard(user_id: int) -> bool:
+    """VACUUM a single user's shard (only that user's file is locked)"""
+    if not SHARDED_MODE:
+        return False
+    conn = get_connection(user_id)
+    conn.execute("VACUUM")
+    conn.close()
+    return True
+
+def restore_user_shard(user_id: int, backup_file: str) -> bool:
+    """Replace a user's shard with a backup file"""
+    if not SHARDED_MODE or not os.path.exists(backup_file):
+        return False
+    src = sqlite3.connect(backup_file)
+    dst = get_connection(user_id)
+    src.backup(dst)
+    dst.close()
+    src.close()
+    # Re-run schema migrations on next use in case the backup predates them
+    with _shard_lock:
+        _initialized_shards.discard(get_shard_path(user_id))
+    return True
+
+# ========== YEAR ARCHIVES ==========
+# Closed years can be moved out of the hot transactions table into one SQLite
+# file per user and year (ARCHIVE_DIR/user_<id>/<year>.db). Archives are
+# attached read-only on demand and combined with the hot rows in the temp view
+# all_transactions, which reports read whenever a date range reaches an
+# archived year. Debt rows and rows linked to other rows stay hot because
+# repayments keep updating them.
+
+ARCHIVE_DIR = os.environ.get('INEXO_ARCHIVE_DIR', 'archive')
+
+# SQLite attaches at most 10 databases by default (SQLITE_MAX_ATTACHED)
+MAX_ARCHIVED_YEARS = 9
+
+# Rows of a year that may be archived
+_ARCHIVABLE_SQL = """user_id = ? AND date >= ? AND date <= ?
+    AND type != 'Debt' AND linked_id IS NULL
+    AND id NOT IN (SELECT linked_id FROM main.transactions WHERE linked_id IS NOT NULL)"""
+
+def get_archive_path(user_id: int, year: int) -> str:
+    return os.path.join(ARCHIVE_DIR, f"user_{int(user_id)}", f"{int(year)}.db")
+
+def get_archived_years(user_id: int) -> List[int]:
+    """Years of the user's transactions that live in archive files"""
+    folder = os.path.join(ARCHIVE_DIR, f"user_{int(user_id)}")
+    if not os.path.isdir(folder):
+        return []
+    return sorted(int(f[:-3]) for f in os.listdir(folder) if f.endswith('.db') and f[:-3].isdigit())
+
+def _hot_database_path(user_id: int) -> str:
+    if SHARDED_MODE:
+        path = get_shard_path(user_id)
+        if path not in _initialized_shards:
+            _init_shard(path)
+        return path
+    return DATABASE_NAME
+
+def _sqlite_uri(path: str, read_only: bool = False) -> str:
+    from urllib.parse import quote
+    return f"file:{quote(os.path.abspath(path))}" + ("?mode=ro" if read_only else "")
+
+def _touches_archive(user_id: int, start_date=None, end_date=None) -> bool:
+    """True if a date range (open ends allowed) includes an archived year"""
+    years = get_archived_years(user_id)
+    if not years:
+        return False
+    first = int(str(start_date)[:4]) if start_date else None
+    last = int(str(end_date)[:4]) if end_date else None
+    return any((first is None or y >= first) and (last is None or y <= last) for y in years)
+
+def get_lifetime_connection(user_id: int):
+    """Connection with the temp view all_transactions (hot rows UNION ALL the user's archived years)"""
+    conn = _connect(_sqlite_uri(_hot_database_path(user_id)), uri=True)
+    conn.row_factory = sqlite3.Row
+    columns = [row[1] for row in conn.execute("PRAGMA main.table_info(transactions)")]
+    # archived: 1 for rows read from an archive file (read-only, edits apply to main only)
+    selects = [f"SELECT {', '.join(columns)}, 0 AS archived FROM main.transactions"]
+    for year in get_archived_years(user_id)[:MAX_ARCHIVED_YEARS]:
+        alias = f"archive_{year}"
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (_sqlite_uri(get_archive_path(user_id, year), read_only=True),))
+        # Archives keep the schema of the day they were written: missing newer columns read as NULL
+        present = {row[1] for row in conn.execute(f"PRAGMA {alias}.table_info(transactions)")}
+        cols = [c if c in present else f"NULL AS {c}" for c in columns]
+        selects.append(f"SELECT {', '.join(cols)}, 1 AS archived FROM {alias}.transactions")
+    conn.execute(f"CREATE TEMP VIEW all_transactions AS {' UNION ALL '.join(selects)}")
+    return conn
+
+def get_archive_candidates(user_id: int) -> pd.DataFrame:
+    """Closed years still in the hot table with the number of rows that can be archived"""
+    conn = get_connection(user_id)
+    df = pd.read_sql_query(f'''
+        SELECT CAST(strftime('%Y', date) AS INTEGER) AS year, COUNT(*) AS rows
+        FROM main.transactions
+        WHERE {_ARCHIVABLE_SQL}
+        GROUP BY year ORDER BY year
+    ''', conn, params=[user_id, '0000-01-01', f"{date.today().year - 1}-12-31"])
+    conn.close()
+    return df
+
+def _snapshot_budget_usage(conn, user_id: int, year: int) -> list:
+    """A year's budget_usage rows; archived rows keep counting, so moves restore them afterwards"""
+    return conn.execute("SELECT * FROM main.budget_usage WHERE user_id = ? AND month BETWEEN ? AND ?",
+                        (user_id, f"{int(year)}-01", f"{int(year)}-12")).fetchall()
+
+def _restore_budget_usage(conn, user_id: int, year: int, rows: list):
+    conn.execute("DELETE FROM main.budget_usage WHERE user_id = ? AND month BETWEEN ? AND ?",
+                 (user_id, f"{int(year)}-01", f"{int(year)}-12"))
+    conn.executemany("INSERT INTO main.budget_usage (user_id, month, type, category, currency, spent, txn_count) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)", [tuple(row) for row in rows])
+
+def archive_year(user_id: int, year: int) -> int:
+    """Move a closed year's archivable rows into its read-only archive file. Returns rows moved."""
+    year = int(year)
+    if year >= date.today().year:
+        raise ValueError(f"{year} is not closed yet")
+    path = get_archive_path(user_id, year)
+    if not os.path.exists(path) and len(get_archived_years(user_id)) >= MAX_ARCHIVED_YEARS:
+        raise ValueError(f"At most {MAX_ARCHIVED_YEARS} years can be archived")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.chmod(path, 0o644)  # adding late rows to an existing archive
+
+    bounds = (user_id, f"{year}-01-01", f"{year}-12-31")
+    conn = get_connection(user_id)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        schema = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'transactions'").fetchone()[0]
+        conn.execute(schema.replace("CREATE TABLE transactions", "CREATE TABLE IF NOT EXISTS archive.transactions", 1))
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_user_date ON transactions (user_id, date)")
+        try:
+            # Search covers archived years through the archive's own index (rebuilt after the rows are in)
+            _create_fts_table(conn, 'archive')
+            archive_fts = True
+        except sqlite3.OperationalError:
+            archive_fts = False
+        columns = [row[1] for row in conn.execute("PRAGMA archive.table_info(transactions)")]
+        # Archived rows still count towards account balances: give back what the delete trigger takes
+        account_currency = "(SELECT currency FROM main.accounts WHERE id = transactions.account_id)"
+        kept = conn.execute(f"SELECT account_id, SUM({_account_delta_sql('transactions', account_currency)}) FROM main.transactions "
+                            f"WHERE account_id IS NOT NULL AND {_ARCHIVABLE_SQL} GROUP BY account_id", bounds).fetchall()
+        # One transaction across both files: rows are either moved completely or not at all
+        cursor = conn.execute(f"INSERT INTO archive.transactions ({', '.join(columns)}) "
+                              f"SELECT {', '.join(columns)} FROM main.transactions WHERE {_ARCHIVABLE_SQL}", bounds)
+        moved = cursor.rowcount
+        if archive_fts:
+            conn.execute("INSERT INTO archive.transactions_fts (transactions_fts) VALUES ('rebuild')")
+        usage = _snapshot_budget_usage(conn, user_id, year)
+        conn.execute(f"DELETE FROM main.transactions WHERE {_ARCHIVABLE_SQL}", bounds)
+        conn.executemany("UPDATE main.accounts SET balance = balance + ? WHERE id = ?",
+                         [(total, account_id) for account_id, total in kept])
+        _restore_budget_usage(conn, user_id, year, usage)
+        conn.commit()
+        conn.execute("DETACH DATABASE archive")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    os.chmod(path, 0o444)
+    # Archives no longer change, so one backup copy is enough
+    backup_dir = os.path.join("backups", "archive", f"user_{int(user_id)}")
+    os.makedirs(backup_dir, exist_ok=True)
+    backup_file = os.path.join(backup_dir, f"{year}.db")
+    if os.path.exists(backup_file):
+        os.chmod(backup_file, 0o644)
+    shutil.copy2(path, backup_file)
+    return moved
+
+def unarchive_year(user_id: int, year: int) -> int:
+    """Move an archived year back into the hot table and delete its archive file. Returns rows moved."""
+    path = get_archive_path(user_id, year)
+    if not os.path.exists(path):
+        return 0
+    conn = get_connection(user_id)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        present = {row[1] for row in conn.execute("PRAGMA archive.table_info(transactions)")}
+        columns = [row[1] for row in conn.execute("PRAGMA main.table_info(transactions)") if row[1] in present]
+        # Balances already include archived rows; undo what the insert triggers add back
+        balances = conn.execute("SELECT balance, id FROM main.accounts WHERE user_id = ?", (user_id,)).fetchall()
+        usage = _snapshot_budget_usage(conn, user_id, year)
+        cursor = conn.execute(f"INSERT INTO main.transactions ({', '.join(columns)}) "
+                              f"SELECT {', '.join(columns)} FROM archive.transactions WHERE user_id = ?", (user_id,))
+        moved = cursor.rowcount
+        conn.executemany("UPDATE main.accounts SET balance = ? WHERE id = ?", [tuple(row) for row in balances])
+        _restore_budget_usage(conn, user_id, year, usage)
+        conn.commit()
+        conn.execute("DETACH DATABASE archive")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    os.chmod(path, 0o644)
+    os.remove(path)
+    return moved
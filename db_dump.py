@@ -0,0 +1,255 @@
+"""
+Deterministic text dump / fast restore for finance.db.
+
+The dump is a directory with one file per table plus the schema:
+
+    db_dump/
+        schema.sql            CREATE statements, sorted by kind and name
+        <table>.jsonl         line 1: column names, then one JSON row per line,
+                              ordered by primary key
+
+Because every row lives on its own line in a stable order, committing the
+dump to git stores only the rows that changed instead of a new copy of the
+whole binary database.
+
+Usage:
+    python db_dump.py dump [finance.db] [db_dump]
+    python db_dump.py load [db_dump] [finance.db] [--force]
+"""
+import base64
+import json
+import os
+import sqlite3
+import sys
+
+DEFAULT_DB = 'finance.db'
+DEFAULT_DUMP_DIR = 'db_dump'
+SCHEMA_FILE = 'schema.sql'
+
+# Tables the app regenerates on demand: schema is dumped, rows are not
+DERIVED_TABLES = ('calendar', 'fx_rates')
+
+# Tables are created first, data is loaded, then indexes/triggers/views.
+# Creating triggers last keeps them from firing during the bulk load.
+_SCHEMA_ORDER = {'table': 0, 'index': 1, 'view': 2, 'trigger': 3}
+
+def _encode(value):
+    """Make a SQLite value JSON serialisable"""
+    if isinstance(value, bytes):
+        return {'$b64': base64.b64encode(value).decode('ascii')}
+    return value
+
+def _decode(value):
+    """Reverse of _encode"""
+    if isinstance(value, dict) and '$b64' in value:
+        return base64.b64decode(value['$b64'])
+    return value
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _dumpable_tables(conn) -> list:
+    """Regular tables to dump, sorted by name (virtual tables and their shadow tables are skipped)"""
+    rows = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'table' ORDER BY name"
+    ).fetchall()
+    virtual = [name for name, sql in rows if sql and sql.upper().startswith('CREATE VIRTUAL TABLE')]
+    tables = []
+    for name, sql in rows:
+        if name in virtual or any(name.startswith(v + '_') for v in virtual):
+            continue
+        if name.startswith('sqlite_') and name != 'sqlite_sequence':
+            continue
+        if name in DERIVED_TABLES:
+            continue
+        tables.append(name)
+    return tables
+
+def _order_by(conn, table: str, columns: list) -> str:
+    """ORDER BY clause giving a stable row order for a table"""
+    pk = [row[1] for row in sorted(conn.execute(f"PRAGMA table_info({_quote(table)})"), key=lambda r: r[5]) if row[5]]
+    if pk:
+        return ', '.join(_quote(c) for c in pk)
+    if table == 'sqlite_sequence':
+        return 'name'
+    # No declared primary key: sort by every column so the order is still deterministic
+    return ', '.join(_quote(c) for c in columns)
+
+def _write_atomic(path: str, lines):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+        for line in lines:
+            f.write(line)
+            f.write('\n')
+    os.replace(tmp_path, path)
+
+def dump_database(db_path: str = DEFAULT_DB, dump_dir: str = DEFAULT_DUMP_DIR) -> dict:
+    """Write a sorted, per-table text dump of db_path into dump_dir. Returns row counts per table."""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    os.makedirs(dump_dir, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    counts = {}
+    try:
+        # Single read transaction so all tables come from the same snapshot
+        conn.execute('BEGIN')
+
+        schema = conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        tables = _dumpable_tables(conn)
+        # Shadow tables are recreated by their virtual table's CREATE statement
+        virtual = [name for t, name, sql in schema if t == 'table' and sql.upper().startswith('CREATE VIRTUAL TABLE')]
+        shadow = set(name for t, name, _ in schema
+                     if t == 'table' and any(name.startswith(v + '_') for v in virtual))
+        statements = sorted(
+            [(t, name, sql) for t, name, sql in schema if name not in shadow],
+            key=lambda s: (_SCHEMA_ORDER.get(s[0], 9), s[1])
+        )
+        _write_atomic(os.path.join(dump_dir, SCHEMA_FILE), [f"{sql.strip()};" for _, _, sql in statements])
+
+        for table in tables:
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+            col_sql = ', '.join(_quote(c) for c in columns)
+            cursor = conn.execute(f"SELECT {col_sql} FROM {_quote(table)} ORDER BY {_order_by(conn, table, columns)}")
+
+            def lines(cursor=cursor, columns=columns, table=table):
+                yield json.dumps(columns, ensure_ascii=False)
+                n = 0
+                for row in cursor:
+                    n += 1
+                    yield json.dumps([_encode(v) for v in row], ensure_ascii=False, separators=(',', ':'))
+                counts[table] = n
+
+            _write_atomic(os.path.join(dump_dir, f"{table}.jsonl"), lines())
+
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+    # Remove files of tables that no longer exist so the dump mirrors the database
+    for f in os.listdir(dump_dir):
+        if f.endswith('.jsonl') and f[:-len('.jsonl')] not in counts:
+            os.remove(os.path.join(dump_dir, f))
+
+    return counts
+
+def _read_rows(path: str):
+    with open(path, encoding='utf-8') as f:
+        columns = json.loads(f.readline())
+        yield columns
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            # Only rows holding encoded blobs need a second pass
+            yield [_decode(v) for v in row] if '{' in line else row
+
+def load_database(dump_dir: str = DEFAULT_DUMP_DIR, db_path: str = DEFAULT_DB, force: bool = False) -> dict:
+    """Rebuild db_path from a dump directory. Returns row counts per table."""
+    schema_path = os.path.join(dump_dir, SCHEMA_FILE)
+    if not os.path.exists(schema_path):
+        raise FileNotFoundError(schema_path)
+    if os.path.exists(db_path) and not force:
+        raise FileExistsError(f"{db_path} already exists (use --force to overwrite)")
+
+    with open(schema_path, encoding='utf-8') as f:
+        schema_sql = f.read()
+    statements = [s.strip() for s in _split_statements(schema_sql) if s.strip()]
+    create_tables = [s for s in statements if s.upper().startswith(('CREATE TABLE', 'CREATE VIRTUAL TABLE'))]
+    create_rest = [s for s in statements if s not in create_tables]
+
+    # Build into a temporary file and swap it in, so a failed load never leaves a half-written database
+    tmp_path = db_path + '.loading'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    counts = {}
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('BEGIN')
+        for stmt in create_tables:
+            conn.execute(stmt)
+
+        # sqlite_sequence goes last so AUTOINCREMENT counters end up exactly as dumped
+        data_files = sorted((f for f in os.listdir(dump_dir) if f.endswith('.jsonl')),
+                            key=lambda f: (f == 'sqlite_sequence.jsonl', f))
+        for f in data_files:
+            table = f[:-len('.jsonl')]
+            rows = _read_rows(os.path.join(dump_dir, f))
+            columns = next(rows)
+            if table == 'sqlite_sequence':
+                conn.execute('DELETE FROM sqlite_sequence')
+            placeholders = ', '.join('?' for _ in columns)
+            cursor = conn.executemany(
+                f"INSERT INTO {_quote(table)} ({', '.join(_quote(c) for c in columns)}) VALUES ({placeholders})",
+                rows
+            )
+            counts[table] = cursor.rowcount
+
+        for stmt in create_rest:
+            conn.execute(stmt)
+
+        # Full-text indexes are not dumped; rebuild them from their content tables
+        for stmt in create_tables:
+            name = _external_content_fts(stmt)
+            if name:
+                conn.execute(f"INSERT INTO {_quote(name)} ({_quote(name)}) VALUES ('rebuild')")
+        conn.execute('COMMIT')
+    except Exception:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+    return counts
+
+def _external_content_fts(create_sql: str):
+    """Name of an FTS5 table with content=..., from its CREATE VIRTUAL TABLE statement (else None)"""
+    normalized = ' '.join(create_sql.split())
+    upper = normalized.upper()
+    if not upper.startswith('CREATE VIRTUAL TABLE') or 'USING FTS5' not in upper or 'CONTENT=' not in upper.replace(' ', ''):
+        return None
+    name = normalized.split()[3]
+    if name.upper() == 'IF':  # CREATE VIRTUAL TABLE IF NOT EXISTS <name>
+        name = normalized.split()[6]
+    return name.strip('"`[]')
+
+def _split_statements(sql: str) -> list:
+    """Split a schema script into complete statements (trigger bodies contain ';')"""
+    statements = []
+    current = ''
+    for line in sql.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip().rstrip(';'))
+            current = ''
+    if current.strip():
+        statements.append(current.strip().rstrip(';'))
+    return statements
+
+def main(argv: list) -> int:
+    args = [a for a in argv if not a.startswith('--')]
+    force = '--force' in argv
+    if not args or args[0] not in ('dump', 'load'):
+        print(__doc__.strip())
+        return 2
+
+    if args[0] == 'dump':
+        db_path = args[1] if len(args) > 1 else DEFAULT_DB
+        dump_dir = args[2] if len(args) > 2 else DEFAULT_DUMP_DIR
+        counts = dump_database(db_path, dump_dir)
+        print(f"Dumped {sum(counts.values())} rows from {len(counts)} tables into {dump_dir}")
+    else:
+        dump_dir = args[1] if len(args) > 1 else DEFAULT_DUMP_DIR
+        db_path = args[2] if len(args) > 2 else DEFAULT_DB
+        counts = load_database(dump_dir, db_path, force=force)
+        print(f"Loaded {sum(counts.values())} rows into {len(counts)} tables of {db_path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
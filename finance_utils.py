@@ -1,35 +1,87 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
 CURRENCIES = {
-    'INR': {'symbol': '₹', 'locale': 'en_IN', 'format': 'lakhs'},
-    'USD': {'symbol': '$', 'locale': 'en_US', 'format': 'millions'},
-    'EUR': {'symbol': '€', 'locale': 'en_IE', 'format': 'millions'},
-    'GBP': {'symbol': '£', 'locale': 'en_GB', 'format': 'millions'},
-    'JPY': {'symbol': '¥', 'locale': 'ja_JP', 'format': 'millions'},
-    'AUD': {'symbol': 'A$', 'locale': 'en_AU', 'format': 'millions'},
-    'CAD': {'symbol': 'C$', 'locale': 'en_CA', 'format': 'millions'},
-    'CHF': {'symbol': 'CHF', 'locale': 'de_CH', 'format': 'millions'},
-    'CNY': {'symbol': '¥', 'locale': 'zh_CN', 'format': 'millions'},
-    'AED': {'symbol': 'د.إ', 'locale': 'ar_AE', 'format': 'millions'}
+    'INR': {'symbol': '₹', 'locale': 'en_IN', 'format': 'lakhs', 'fiscal_year_start': 4},
+    'USD': {'symbol': '$', 'locale': 'en_US', 'format': 'millions', 'fiscal_year_start': 1},
+    'EUR': {'symbol': '€', 'locale': 'en_IE', 'format': 'millions', 'fiscal_year_start': 1},
+    'GBP': {'symbol': '£', 'locale': 'en_GB', 'format': 'millions', 'fiscal_year_start': 4},
+    'JPY': {'symbol': '¥', 'locale': 'ja_JP', 'format': 'millions', 'fiscal_year_start': 4},
+    'AUD': {'symbol': 'A$', 'locale': 'en_AU', 'format': 'millions', 'fiscal_year_start': 7},
+    'CAD': {'symbol': 'C$', 'locale': 'en_CA', 'format': 'millions', 'fiscal_year_start': 1},
+    'CHF': {'symbol': 'CHF', 'locale': 'de_CH', 'format': 'millions', 'fiscal_year_start': 1},
+    'CNY': {'symbol': '¥', 'locale': 'zh_CN', 'format': 'millions', 'fiscal_year_start': 1},
+    'AED': {'symbol': 'د.إ', 'locale': 'ar_AE', 'format': 'millions', 'fiscal_year_start': 1}
 }
 
+def fiscal_year_start(currency_code='INR'):
+    """First month (1-12) of the fiscal year for a currency's country"""
+    return CURRENCIES.get(currency_code, CURRENCIES['INR']).get('fiscal_year_start', 1)
+
+def fiscal_year_label(fy_year, fy_start_month):
+    """'FY 2025-26' for split fiscal years, 'FY 2025' when it matches the calendar year"""
+    if fy_start_month == 1:
+        return f"FY {fy_year}"
+    return f"FY {fy_year}-{(fy_year + 1) % 100:02d}"
+
+def _group_digits(digits: str, use_indian_system: bool) -> str:
+    """'1234567' -> '12,34,567' (lakhs) or '1,234,567' (millions)"""
+    if not use_indian_system:
+        return f"{int(digits):,}"
+    if len(digits) <= 3:
+        return digits
+    head, tail = digits[:-3], digits[-3:]
+    groups = [head[max(i - 2, 0):i] for i in range(len(head), 0, -2)][::-1]
+    return ",".join(groups + [tail])
+
+@lru_cache(maxsize=8192)
+def _format_whole(val: int, currency_code: str) -> str:
+    currency = CURRENCIES.get(currency_code, CURRENCIES['INR'])
+    sign = "-" if val < 0 else ""
+    return f"{sign}{currency['symbol']}{_group_digits(str(abs(val)), currency['format'] == 'lakhs')}"
+
 def format_currency(amount, currency_code='INR'):
     """Format currency with symbol and commas (Rounded to nearest Integer)"""
-    currency = CURRENCIES.get(currency_code, CURRENCIES['INR'])
-    symbol = currency['symbol']
-    
     try:
         # Round to nearest integer
         val = int(round(float(amount)))
-        
-        if currency_code == 'INR':
-            # Indian formatting for integers
-            s = str(val)
-            r = ",".join([s[x-2:x] for x in range(-3, -len(s), -2)][::-1] + [s[-3:]])
-            return f"{symbol}{r}"
-        else:
-            # Standard formatting (no decimals)
-            return f"{symbol}{val:,.0f}"
-    except:
-        return f"{symbol}{amount}"
+    except (TypeError, ValueError, OverflowError):
+        currency = CURRENCIES.get(currency_code, CURRENCIES['INR'])
+        return f"{currency['symbol']}{amount}"
+    return _format_whole(val, currency_code)
+
+def format_currency_series(values, currency_code='INR'):
+    """format_currency for a whole Series / array at once (same output for every value)"""
+    currency = CURRENCIES.get(currency_code, CURRENCIES['INR'])
+    index = values.index if isinstance(values, pd.Series) else None
+    raw = values.to_numpy(dtype=object) if isinstance(values, pd.Series) else np.asarray(values, dtype=object)
+    numbers = pd.Series(pd.to_numeric(np.asarray(values), errors='coerce'), index=index, dtype='float64')
+    # Missing, non-finite and beyond-int64 values go through the scalar formatter
+    valid = numbers.notna() & np.isfinite(numbers) & (numbers.round().abs() < 2.0 ** 63)
+
+    rounded = numbers[valid].round()
+    digits = rounded.abs().astype('int64').astype(str)
+    if currency['format'] == 'lakhs':
+        # Last three digits, then groups of two: one pass per group, not per value
+        grouped = digits.str[-3:]
+        head = digits.str[:-3]
+        while (head != '').any():
+            grouped = (head.str[-2:] + ',').where(head != '', '') + grouped
+            head = head.str[:-2]
+    else:
+        grouped = digits.str[-3:]
+        head = digits.str[:-3]
+        while (head != '').any():
+            grouped = (head.str[-3:] + ',').where(head != '', '') + grouped
+            head = head.str[:-3]
+
+    result = pd.Series('', index=numbers.index, dtype=object)
+    result[valid] = np.where(rounded < 0, '-', '') + currency['symbol'] + grouped
+    if not valid.all():
+        result[~valid] = [format_currency(v, currency_code) for v in raw[~valid.to_numpy()]]
+    return result
 
 def number_to_words(num, currency_code='INR'):
     """
@@ -37,10 +89,15 @@ def number_to_words(num, currency_code='INR'):
     INR -> Lakhs/Crores
     Others -> Millions/Billions
     """
+    return _number_to_words(int(num), currency_code)
+
+@lru_cache(maxsize=4096)
+def _number_to_words(num, currency_code):
     if num == 0:
         return "Zero"
+    if num < 0:
+        return "Minus " + _number_to_words(-num, currency_code)
     
-    num = int(num)
     currency = CURRENCIES.get(currency_code, CURRENCIES['INR'])
     use_indian_system = currency['format'] == 'lakhs'
     
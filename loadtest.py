@@ -0,0 +1,338 @@
+"""
+Load-test app.py with concurrent headless sessions (streamlit.testing.AppTest).
+
+A synthetic database is generated in a temporary directory (finance.db,
+backups/ and archive/ are not touched). N sessions then run concurrently
+against it, each logging in through the login form and performing a random
+mix of actions: navigate pages, change the Analytics tabs, add a
+transaction, pay an EMI.
+
+Every session runs in its own process. AppTest is not thread-safe (parallel
+runs in one interpreter collide on element ids), and separate processes
+writing the same SQLite files exercise the locking a busy server sees.
+In-process caches are per session, so latencies are on the cautious side.
+
+Streamlit switches tabs in the browser without a rerun and runs every tab
+body on each Analytics rerun, so tab use is simulated with the widgets
+inside the tabs (date range, comparison mode, anomaly sensitivity).
+
+Reports rerun latency percentiles per action, throughput, lock errors
+('database is locked' / busy), other exceptions and the resident memory a
+session adds to its process. Everything runs offline: no server, browser or network.
+
+Usage:
+    python loadtest.py [--sessions 8] [--steps 30] [--users 4] [--months 24] [--rows-per-month 60]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import database as db
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+
+PASSWORD = 'load123'
+
+# Seconds a single rerun may take before AppTest gives up
+RERUN_TIMEOUT = 120
+
+# action -> weight in the random mix
+ACTIONS = {'navigate': 5, 'analytics': 3, 'add_transaction': 1, 'pay_emi': 1}
+
+_LOCK_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+# ========== Synthetic data ==========
+
+def generate_database(path: str, users: int = 4, months: int = 24, rows_per_month: int = 60, seed: int = 7,
+                      prefix: str = 'load') -> list:
+    """Create a database at path with users <prefix>1..<prefix>N (password PASSWORD). Returns the usernames.
+
+    Every user gets months of income / expense / investment / card / vehicle
+    rows, a few Friends debts, two loans with EMI details, recurring items,
+    budgets and a card cycle.
+    """
+    db.DATABASE_NAME = path
+    db.init_db()
+    rnd = random.Random(seed)
+    start = date.today().replace(day=1) - timedelta(days=30 * months)
+    days = (date.today() - start).days + 1
+    mix = [('Expense', 'Groceries'), ('Expense', 'Rent'), ('Expense', 'Utilities'), ('Expense', 'Shopping'),
+           ('Expense', 'Entertainment'), ('Expense', 'Healthcare'), ('Income', 'Salary'), ('Income', 'Interest'),
+           ('Investment', 'SIP'), ('Investment', 'Stocks'), ('Vehicle', 'Car Fuel'), ('Subscriptions', 'Netflix'),
+           ('Credit Card', 'HDFC Credit Card'), ('Banking', 'Bank Transfer')]
+    payees = ['Amazon', 'Swiggy', 'BigBasket', 'Uber', 'Apollo', 'Landlord', 'Employer', 'Zerodha', 'Shell']
+    accounts = ['HDFC', 'ICICI', 'Cash', 'HDFC Credit Card']
+    friends = ['Rahul', 'Anita', 'Vikram', 'Meera']
+
+    usernames = []
+    for i in range(1, users + 1):
+        username = f'{prefix}{i}'
+        user_id = db.create_user(username, PASSWORD)
+        if user_id is None:
+            user_id = int(db.get_all_users().set_index('username').loc[username, 'id'])
+        usernames.append(username)
+
+        n = months * rows_per_month
+        picks = [rnd.choice(mix) for _ in range(n)]
+        frame = pd.DataFrame({
+            'date': [str(start + timedelta(days=rnd.randrange(days))) for _ in range(n)],
+            'type': [t for t, _ in picks],
+            'category': [c for _, c in picks],
+            'amount': [round(rnd.uniform(100, 60000), 2) for _ in range(n)],
+            'description': [f"{rnd.choice(payees)} {rnd.randrange(100)}" for _ in range(n)],
+            'account': [rnd.choice(accounts) for _ in range(n)],
+            'is_credit_card_payment': [int(t in ('Expense', 'Vehicle', 'Subscriptions') and rnd.random() < 0.3) for t, _ in picks],
+            'is_self': [int(t == 'Expense' and rnd.random() < 0.1) for t, _ in picks],
+        })
+        debts = pd.DataFrame({
+            'date': [str(start + timedelta(days=rnd.randrange(days))) for _ in range(8)],
+            'type': 'Debt',
+            'category': 'Friends',
+            'amount': [float(rnd.randint(1000, 50000)) for _ in range(8)],
+            'counterparty': [rnd.choice(friends) for _ in range(8)],
+            'account': 'Cash',
+        })
+        db.add_transactions_bulk(user_id, pd.concat([frame, debts], ignore_index=True), skip_duplicates=False)
+
+        for loan, principal, emi, tenure in [('SBI Home Loan', 2500000.0, 24000.0, 180), ('HDFC Car Loan', 600000.0, 12500.0, 60)]:
+            # The default Home Loan / Car Loan categories are not flagged as loans
+            db.add_category(user_id, loan, 'Debt', is_loan=1)
+            db.add_transaction(user_id, str(start), 'Debt', loan, principal, description=f"{loan} disbursal",
+                               loan_interest_rate=8.5, loan_tenure_months=tenure, loan_emi=emi,
+                               loan_start_date=str(start), loan_lender_bank='SBI')
+        db.add_recurring_item(user_id, 'Salary', 'Income', 'Salary', 150000)
+        db.add_recurring_item(user_id, 'Rent', 'Expense', 'Rent', 30000)
+        db.set_budget(user_id, 'Expense', 'Groceries', 15000)
+        db.set_budget(user_id, 'Expense', 'Shopping', 10000)
+        db.save_card_cycle(user_id, 'HDFC Credit Card', 15, 5, is_default=True)
+    return usernames
+
+# ========== Sessions ==========
+
+def _rss_mb() -> float:
+    """Current resident memory of this process in MB (Linux)"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def _is_lock_error(message: str) -> bool:
+    message = message.lower()
+    return any(m in message for m in _LOCK_MESSAGES)
+
+class Session:
+    """One simulated browser tab: an AppTest instance and its timings"""
+
+    def __init__(self, username: str, seed: int):
+        from streamlit.testing.v1 import AppTest
+        self.username = username
+        self.rnd = random.Random(seed)
+        self.at = AppTest.from_file(APP_PATH, default_timeout=RERUN_TIMEOUT)
+        self.timings = []   # (action, seconds)
+        self.errors = []    # (action, message)
+
+    def _rerun(self, action: str, prepare=None):
+        """Apply prepare() to the widgets and rerun; records time and any exception"""
+        started = time.perf_counter()
+        try:
+            if prepare is not None:
+                prepare()
+            self.at.run()
+            failed = [e.message + "\n" + "\n".join(e.stack_trace) for e in self.at.exception]
+        except Exception as e:
+            failed = [f"{type(e).__name__}: {e}"]
+        self.timings.append((action, time.perf_counter() - started))
+        self.errors.extend((action, message) for message in failed)
+
+    def _page(self) -> str:
+        return self.at.sidebar.radio[0].value
+
+    def _goto(self, page: str):
+        if self._page() != page:
+            self._rerun('navigate', lambda: self.at.sidebar.radio[0].set_value(page))
+
+    def login(self):
+        self._rerun('open')
+        self._rerun('login', lambda: (self.at.text_input[0].input(self.username),
+                                      self.at.text_input[1].input(PASSWORD),
+                                      self.at.button[0].click()))
+        if not len(self.at.sidebar.radio):
+            raise RuntimeError(f"{self.username} could not log in: {self.errors[-1:] or 'no sidebar'}")
+
+    def navigate(self):
+        radio = self.at.sidebar.radio[0]
+        self._rerun('navigate', lambda: radio.set_value(self.rnd.choice([p for p in radio.options if p != radio.value])))
+
+    def analytics(self):
+        self._goto("📈 Analytics")
+        changes = []
+        starts = [w for w in self.at.date_input if w.label == "Start Date"]
+        if starts:
+            changes.append(lambda: starts[0].set_value(date.today() - timedelta(days=self.rnd.choice([30, 90, 180, 365]))))
+        compare = [w for w in self.at.radio if w.label == "Compare By"]
+        if compare:
+            changes.append(lambda: compare[0].set_value(self.rnd.choice(compare[0].options)))
+        sensitivity = [w for w in self.at.slider if w.label.startswith("Sensitivity")]
+        if sensitivity:
+            changes.append(lambda: sensitivity[0].set_value(self.rnd.choice([2.5, 3.0, 3.5, 4.0])))
+        self._rerun('analytics', self.rnd.choice(changes) if changes else None)
+
+    def add_transaction(self):
+        self._goto("➕ Add Transaction")
+
+        def fill():
+            [w for w in self.at.number_input if w.label.startswith("Amount")][0].set_value(round(self.rnd.uniform(50, 5000), 2))
+            self.at.text_area(key="add_description").input(f"load test {self.rnd.randrange(10 ** 6)}")
+            [b for b in self.at.button if b.label == "➕ Add Transaction"][0].click()
+        self._rerun('add_transaction', fill)
+
+    def pay_emi(self):
+        self._goto("💸 Debt Views")
+        pay = [b for b in self.at.button if b.label == "Confirm Payment" and b.proto.form_id.startswith('pay_emi_')]
+        if pay:
+            self._rerun('pay_emi', self.rnd.choice(pay).click)
+        else:
+            self.navigate()
+
+    def run(self, steps: int, start=None):
+        """Log in, wait for the other sessions (start barrier), then perform steps random actions"""
+        try:
+            self.login()
+            if start is not None:
+                start.wait()
+            actions, weights = zip(*ACTIONS.items())
+            for _ in range(steps):
+                getattr(self, self.rnd.choices(actions, weights)[0])()
+        except threading.BrokenBarrierError:
+            pass
+        except Exception as e:
+            self.errors.append(('session', f"{type(e).__name__}: {e}"))
+            if start is not None:
+                start.abort()
+
+def _session_process(username: str, steps: int, seed: int, workdir: str, database: str, start, results):
+    """Body of one session process; puts its timings, errors and memory figures on results"""
+    os.chdir(workdir)
+    db.DATABASE_NAME = database
+    import streamlit.testing.v1  # noqa: F401 - part of the server, not of the session
+    baseline = _rss_mb()
+    timings, errors = [], []
+    try:
+        session = Session(username, seed)
+        timings, errors = session.timings, session.errors
+        session.run(steps, start)
+    except Exception as e:
+        errors.append(('session', f"{type(e).__name__}: {e}"))
+        start.abort()
+    finally:
+        results.put({
+            'timings': timings,
+            'errors': errors,
+            'rss_session': _rss_mb() - baseline,
+            # ru_maxrss is in KB on Linux
+            'rss_peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        })
+
+def run_load(usernames: list, sessions: int, steps: int, seed: int = 1) -> dict:
+    """Run sessions concurrently in the working directory holding db.DATABASE_NAME.
+
+    Returns timings, errors, wall time after login and memory figures.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    logged_in = ctx.Barrier(sessions + 1)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_session_process, name=f'load-session-{i}',
+                             args=(usernames[i % len(usernames)], steps, seed + i, os.getcwd(),
+                                   os.path.abspath(db.DATABASE_NAME), logged_in, results))
+                 for i in range(sessions)]
+    for p in processes:
+        p.start()
+    try:
+        logged_in.wait()
+    except threading.BrokenBarrierError:
+        pass
+    started = time.perf_counter()
+    # Drain the queue before joining: a child exits only once its result is consumed
+    finished = [results.get() for _ in processes]
+    wall = time.perf_counter() - started
+    for p in processes:
+        p.join()
+
+    timings = pd.DataFrame([t for r in finished for t in r['timings']], columns=['action', 'seconds'])
+    return {
+        'timings': timings,
+        'errors': [e for r in finished for e in r['errors']],
+        'wall': wall,
+        'steady_reruns': int(timings['action'].isin(list(ACTIONS)).sum()),
+        'rss_session': float(np.mean([r['rss_session'] for r in finished])),
+        'rss_peak': max(r['rss_peak'] for r in finished),
+        'sessions': sessions,
+    }
+
+# ========== Report ==========
+
+def report(result: dict) -> str:
+    timings = result['timings']
+    lines = [f"{'action':<16}{'count':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for action, group in list(timings.groupby('action', sort=False)) + [('all', timings)]:
+        ms = group['seconds'].to_numpy() * 1000
+        p50, p90, p99 = np.percentile(ms, [50, 90, 99]) if len(ms) else (0, 0, 0)
+        lines.append(f"{action:<16}{len(ms):>7}{p50:>10.0f}{p90:>10.0f}{p99:>10.0f}{(ms.max() if len(ms) else 0):>10.0f}")
+
+    errors = result['errors']
+    locks = [e for e in errors if _is_lock_error(e[1])]
+    sessions = result['sessions']
+    lines += [
+        "",
+        f"Throughput:   {result['steady_reruns'] / result['wall']:.2f} reruns/s "
+        f"({result['steady_reruns']} reruns by {sessions} sessions in {result['wall']:.1f} s after login)",
+        f"Lock errors:  {len(locks)}",
+        f"Other errors: {len(errors) - len(locks)}",
+        f"Memory:       {result['rss_session']:.1f} MB per session on average (largest process peaked at {result['rss_peak']:.0f} MB)",
+    ]
+    for action, message in (locks + [e for e in errors if e not in locks])[:10]:
+        lines.append(f"  [{action}] {message.splitlines()[0][:160]}")
+    return '\n'.join(lines)
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Load-test app.py with concurrent AppTest sessions")
+    parser.add_argument('--sessions', type=int, default=8, help="Concurrent sessions")
+    parser.add_argument('--steps', type=int, default=30, help="Actions per session after login")
+    parser.add_argument('--users', type=int, default=4, help="Generated users (sessions share them round-robin)")
+    parser.add_argument('--months', type=int, default=24, help="Months of history per user")
+    parser.add_argument('--rows-per-month', type=int, default=60, help="Transactions per user and month")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # backups/, archive/, shards/ and assets/ are resolved against the working directory
+        os.chdir(tmp)
+        try:
+            if os.path.isdir(ASSETS_DIR):
+                os.symlink(ASSETS_DIR, os.path.join(tmp, 'assets'))
+            print(f"Generating {args.users} users x {args.months} months x {args.rows_per_month} rows...")
+            usernames = generate_database(os.path.join(tmp, 'finance.db'), args.users, args.months, args.rows_per_month)
+            print(f"Running {args.sessions} sessions x {args.steps} steps...")
+            result = run_load(usernames, args.sessions, args.steps, args.seed)
+        finally:
+            os.chdir(previous)
+
+    print()
+    print(report(result))
+    return 1 if result['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,13 @@
 $dbFile = "finance.db"
+$dumpDir = "db_dump"
 $intervalSeconds = 1800  # 30 minutes
 
+# Prefer the project venv, fall back to python on PATH
+$python = "venv\Scripts\python.exe"
+if (-not (Test-Path $python)) {
+    $python = "python"
+}
+
 # Check if this is a git repository
 if (-not (Test-Path ".git")) {
     Write-Host "Not a git repository. Auto-backup job will exit."
@@ -26,12 +33,25 @@ Write-Host "Checking for changes every 30 minutes."
 
 while ($true) {
     try {
-        $status = git status --porcelain $dbFile
+        # Commit a sorted text dump instead of the binary DB so git only stores changed rows
+        & $python db_dump.py dump $dbFile $dumpDir
+        if ($LASTEXITCODE -ne 0) {
+            throw "db_dump.py failed with exit code $LASTEXITCODE"
+        }
+
+        # Sharded mode: one dump folder per user shard
+        if (Test-Path "shards") {
+            Get-ChildItem "shards" -Filter "user_*.db" | ForEach-Object {
+                & $python db_dump.py dump $_.FullName (Join-Path $dumpDir (Join-Path "shards" $_.BaseName))
+            }
+        }
+
+        $status = git status --porcelain $dumpDir
         if ($status) {
             $timestamp = Get-Date -Format "yyyy-MM-dd HH:mm:ss"
             Write-Host "Changes detected at $timestamp. Committing..."
             
-            git add $dbFile
+            git add -A $dumpDir
             git commit -m "Auto-backup DB file: $timestamp"
             
             Write-Host "Pushing to remote..."
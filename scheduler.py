@@ -0,0 +1,149 @@
+"""
+Materialize scheduled recurring items as transactions.
+
+Recurring items with auto_post = 1 carry a schedule (frequency, day_of_month,
+start_date, end_date). Every due occurrence up to today becomes one
+transaction whose occurrence_key is 'rec:<item id>:<date>'; the unique index
+on that column makes runs idempotent, so the scheduler can be triggered at
+startup, from a background thread and from the CLI without double posting.
+Posted keys are also kept in recurring_postings, so an occurrence the user
+deletes (a skipped month) is not posted again.
+All due occurrences of a user are written with a single bulk insert.
+
+Usage:
+    python scheduler.py [--user ID] [--today YYYY-MM-DD] [--dry-run]
+"""
+import argparse
+import calendar
+import sys
+import threading
+import time
+from datetime import date, datetime
+
+import pandas as pd
+
+import database as db
+
+# Hours between runs of the background thread
+SCHEDULER_INTERVAL_HOURS = 6
+
+_scheduler_lock = threading.Lock()
+_scheduler_thread = None
+
+def occurrence_key(item_id: int, on: date) -> str:
+    return f"rec:{item_id}:{on:%Y-%m-%d}"
+
+def _parse_date(value) -> date:
+    if value is None or pd.isna(value) or str(value).strip() == '':
+        return None
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+def _month_day(year: int, month: int, day: int) -> date:
+    """day of the month, clamped to its length (31 -> 28/29/30)"""
+    return date(year, month, min(max(int(day), 1), calendar.monthrange(year, month)[1]))
+
+def occurrences(item, until: date) -> list:
+    """Due dates of a scheduled item from its start_date up to until (inclusive)"""
+    start = _parse_date(item.get('start_date'))
+    if start is None:
+        return []
+    end = _parse_date(item.get('end_date'))
+    if end is not None and end < until:
+        until = end
+    step = db.RECURRING_FREQUENCIES.get(item.get('frequency') or 'monthly', 1)
+    day = item.get('day_of_month')
+    day = start.day if day is None or pd.isna(day) else int(day)
+
+    dates = []
+    month_index = start.year * 12 + start.month - 1
+    while True:
+        on = _month_day(month_index // 12, month_index % 12 + 1, day)
+        if on > until:
+            break
+        if on >= start:
+            dates.append(on)
+        month_index += step
+    return dates
+
+def due_transactions(user_id: int, today: date = None) -> pd.DataFrame:
+    """Transactions for the user's due occurrences that have not been posted yet"""
+    today = today or date.today()
+    items = db.get_scheduled_recurring_items(user_id)
+    rows = []
+    for item in items.to_dict('records'):
+        for on in occurrences(item, today):
+            rows.append({
+                'date': on.strftime('%Y-%m-%d'),
+                'type': item['type'],
+                'category': item['category'],
+                'amount': item['amount'],
+                'description': item['name'],
+                'account': item.get('account'),
+                'occurrence_key': occurrence_key(item['id'], on),
+            })
+    if not rows:
+        return pd.DataFrame(columns=['date', 'type', 'category', 'amount', 'description', 'account', 'occurrence_key'])
+
+    due = pd.DataFrame(rows)
+    posted = db.get_existing_occurrence_keys(user_id, due['occurrence_key'].tolist())
+    return due[~due['occurrence_key'].isin(posted)].reset_index(drop=True)
+
+def run_scheduler(user_id: int = None, today: date = None, dry_run: bool = False) -> dict:
+    """Post due occurrences for one user (all users when None). Returns {user_id: rows posted}."""
+    if user_id is None:
+        user_ids = db.get_all_users()['id'].tolist()
+    else:
+        user_ids = [user_id]
+
+    posted = {}
+    for uid in user_ids:
+        due = due_transactions(uid, today)
+        if due.empty:
+            continue
+        if dry_run:
+            posted[uid] = len(due)
+        else:
+            # Duplicate detection stays off: a rent payment every month is expected to look alike
+            posted[uid] = db.add_transactions_bulk(uid, due, skip_duplicates=False, ignore_conflicts=True)
+    return posted
+
+def _scheduler_loop(interval_hours: float):
+    # Callers run the scheduler themselves at startup, so the first background run waits one interval
+    while True:
+        time.sleep(interval_hours * 3600)
+        try:
+            run_scheduler()
+        except Exception as e:
+            print(f"Recurring scheduler failed: {e}")
+
+def start_background_scheduler(interval_hours: float = None) -> bool:
+    """Run the scheduler every interval_hours in a daemon thread, starting one interval from now. Returns True if started."""
+    global _scheduler_thread
+    interval_hours = SCHEDULER_INTERVAL_HOURS if interval_hours is None else interval_hours
+
+    with _scheduler_lock:
+        if _scheduler_thread is not None and _scheduler_thread.is_alive():
+            return False
+        _scheduler_thread = threading.Thread(target=_scheduler_loop, args=(interval_hours,),
+                                             name='inexo-recurring-scheduler', daemon=True)
+        _scheduler_thread.start()
+    return True
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Post due recurring items as transactions")
+    parser.add_argument('--user', type=int, help="Only this user id (default: all users)")
+    parser.add_argument('--today', help="Post occurrences up to this date (YYYY-MM-DD)")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be posted")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    today = _parse_date(args.today) if args.today else None
+    posted = run_scheduler(args.user, today, args.dry_run)
+    verb = "Would post" if args.dry_run else "Posted"
+    for uid, count in posted.items():
+        print(f"{verb} {count} transactions for user {uid}")
+    print(f"Done: {sum(posted.values())} transactions.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
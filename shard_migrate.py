@@ -0,0 +1,103 @@
+"""
+Split a single finance.db into per-user shard files.
+
+After the split, finance.db keeps users and password_requests (the catalog)
+and each user's rows from database.USER_TABLES live in shards/user_<id>.db.
+Start the app with INEXO_SHARDED=1 to use the shards.
+
+Usage:
+    python shard_migrate.py [--source finance.db] [--shard-dir shards] [--keep-source-rows] [--force]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+from datetime import datetime
+
+import database as db
+
+def _columns(conn, schema: str, table: str) -> list:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+def migrate(source: str, shard_dir: str, keep_source_rows: bool = False, force: bool = False) -> dict:
+    """Copy every user's rows into their shard. Returns {user_id: rows copied}."""
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+
+    # Point the database module at the requested files and bring the source schema up to date
+    db.DATABASE_NAME = source
+    db.SHARD_DIR = shard_dir
+    db.init_db()
+
+    # Safety copy before anything is moved
+    # (own folder so perform_backup's rotation never deletes it)
+    backup_dir = os.path.join("backups", "pre_shard")
+    os.makedirs(backup_dir, exist_ok=True)
+    backup_file = os.path.join(backup_dir, f"finance_pre_shard_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    shutil.copy2(source, backup_file)
+    print(f"Source backed up to {backup_file}")
+
+    src = sqlite3.connect(source)
+    user_ids = [row[0] for row in src.execute("SELECT id FROM users ORDER BY id")]
+    src.close()
+
+    copied = {}
+    for uid in user_ids:
+        shard_path = db.get_shard_path(uid)
+        if os.path.exists(shard_path) and not force:
+            existing = sqlite3.connect(shard_path)
+            has_rows = existing.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] if \
+                existing.execute("SELECT name FROM sqlite_master WHERE name = 'transactions'").fetchone() else 0
+            existing.close()
+            if has_rows:
+                raise FileExistsError(f"{shard_path} already has data (use --force to overwrite)")
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+        db._initialized_shards.discard(shard_path)
+        db._init_shard(shard_path)
+
+        conn = sqlite3.connect(shard_path)
+        conn.execute("ATTACH DATABASE ? AS src", (source,))
+        total = 0
+        for table in db.USER_TABLES:
+            # Copy only columns both sides know, in the shard's column order
+            src_cols = set(_columns(conn, 'src', table))
+            cols = [c for c in _columns(conn, 'main', table) if c in src_cols]
+            col_sql = ', '.join(cols)
+            cur = conn.execute(f"INSERT INTO main.{table} ({col_sql}) SELECT {col_sql} FROM src.{table} WHERE user_id = ?", (uid,))
+            total += cur.rowcount
+        # Balances came over with the accounts; drop what the insert triggers added on top
+        conn.execute("UPDATE main.accounts SET balance = (SELECT balance FROM src.accounts s WHERE s.id = accounts.id) "
+                     "WHERE id IN (SELECT id FROM src.accounts WHERE user_id = ?)", (uid,))
+        conn.commit()
+        conn.execute("DETACH DATABASE src")
+        conn.close()
+        copied[uid] = total
+        print(f"User {uid}: {total} rows -> {shard_path}")
+
+    if not keep_source_rows:
+        src = sqlite3.connect(source)
+        for table in db.USER_TABLES:
+            src.executemany(f"DELETE FROM {table} WHERE user_id = ?", [(uid,) for uid in user_ids])
+        src.commit()
+        src.execute("VACUUM")
+        src.close()
+        print(f"Moved rows removed from {source}")
+
+    return copied
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Split finance.db into per-user shards")
+    parser.add_argument('--source', default=db.DATABASE_NAME)
+    parser.add_argument('--shard-dir', default=db.SHARD_DIR)
+    parser.add_argument('--keep-source-rows', action='store_true', help="Leave the copied rows in the source file")
+    parser.add_argument('--force', action='store_true', help="Overwrite shards that already contain data")
+    args = parser.parse_args(argv)
+
+    copied = migrate(args.source, args.shard_dir, args.keep_source_rows, args.force)
+    print(f"Done: {len(copied)} users, {sum(copied.values())} rows. Start the app with INEXO_SHARDED=1.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,125 @@
+"""
+Shared fixtures for the page budget tests.
+
+The app runs headlessly through streamlit.testing.AppTest against a
+synthetic database generated once per test session in a temporary
+directory (finance.db, backups/ and archive/ of the checkout are not
+touched). Two users of fixed size share that database: 'small1' and
+'large1', with about 4x the months and 6x the transactions per month.
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import database as db  # noqa: E402
+import loadtest  # noqa: E402
+
+APP_PATH = os.path.join(ROOT, 'app.py')
+
+# (months, transactions per month) of each generated user
+DATASETS = {'small': (6, 20), 'large': (24, 120)}
+
+# Seconds one rerun may take before AppTest gives up
+RERUN_TIMEOUT = 120
+
+class QueryLog:
+    """SQL statements seen by database._query_listeners (thread-safe: the read pool queries too)"""
+
+    def __init__(self):
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def __call__(self, statement: str):
+        # Statements run inside triggers are reported as '-- TRIGGER ...'; they are part of their statement
+        if not statement.lstrip().startswith('--'):
+            with self._lock:
+                self.statements.append(statement)
+
+    def __len__(self):
+        with self._lock:
+            return len(self.statements)
+
+    def clear(self):
+        with self._lock:
+            self.statements.clear()
+
+@pytest.fixture(scope='session')
+def app_env(tmp_path_factory):
+    """Working directory with the generated database; returns {dataset: (user_id, username)}"""
+    workdir = tmp_path_factory.mktemp('inexo')
+    previous = os.getcwd()
+    # backups/, archive/, shards/ and assets/ are resolved against the working directory
+    os.chdir(workdir)
+    if os.path.isdir(loadtest.ASSETS_DIR):
+        os.symlink(loadtest.ASSETS_DIR, workdir / 'assets')
+    path = str(workdir / 'finance.db')
+    users = {}
+    for name, (months, rows_per_month) in DATASETS.items():
+        username = loadtest.generate_database(path, 1, months, rows_per_month, prefix=name)[0]
+        users[name] = (int(db.get_all_users().set_index('username').loc[username, 'id']), username)
+    yield users
+    os.chdir(previous)
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """Empty database in its own working directory; returns the id of a new user"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, 'DATABASE_NAME', str(tmp_path / 'finance.db'))
+    monkeypatch.setattr(db, '_initialized_shards', set())
+    db.init_db()
+    return db.create_user('tester', 'secret')
+
+@pytest.fixture
+def query_log():
+    log = QueryLog()
+    db.add_query_listener(log)
+    yield log
+    db.remove_query_listener(log)
+
+class PageRun:
+    """A logged-in AppTest session; measure() reruns the current page and records time and queries"""
+
+    def __init__(self, user_id: int, username: str, query_log: QueryLog):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(APP_PATH, default_timeout=RERUN_TIMEOUT)
+        self.at.session_state['user_id'] = user_id
+        self.at.session_state['username'] = username
+        self.at.session_state['is_admin'] = 1
+        self.query_log = query_log
+        self.seconds = None
+        self.queries = None
+        self.run()
+
+    def run(self):
+        self.at.run()
+        assert not self.at.exception, [e.message for e in self.at.exception]
+        return self
+
+    def open(self, page: str):
+        """Navigate to page (cold: first render fills the per-user caches)"""
+        self.at.sidebar.radio[0].set_value(page)
+        return self.run()
+
+    def measure(self):
+        """Rerun the current page as on any widget interaction"""
+        self.query_log.clear()
+        started = time.perf_counter()
+        self.run()
+        self.seconds = time.perf_counter() - started
+        self.queries = len(self.query_log)
+        return self
+
+@pytest.fixture
+def page_run(app_env, query_log):
+    """Factory: page_run(page, dataset='large') -> measured PageRun"""
+    def render(page: str, dataset: str = 'large') -> PageRun:
+        user_id, username = app_env[dataset]
+        return PageRun(user_id, username, query_log).open(page).measure()
+    return render
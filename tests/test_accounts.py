@@ -0,0 +1,43 @@
+"""
+Account ledger: every account keeps its balance in one currency.
+"""
+import pandas as pd
+
+import database as db
+
+def _balance(user_id: int, name: str) -> float:
+    return db.get_account_balance(user_id, name)
+
+def test_account_takes_currency_of_its_first_row(fresh_db):
+    assert db.add_transaction(fresh_db, '2024-03-01', 'Income', 'Salary', 500, account='Revolut', currency='EUR')
+    accounts = db.get_accounts(fresh_db).set_index('name')
+    assert accounts.loc['Revolut', 'currency'] == 'EUR'
+    assert _balance(fresh_db, 'Revolut') == 500
+
+def test_row_in_another_currency_is_rejected(fresh_db):
+    db.add_account(fresh_db, 'Revolut', currency='EUR', opening_balance=100)
+    db.add_account(fresh_db, 'Cash')
+    assert db.add_transaction(fresh_db, '2024-03-01', 'Expense', 'Food', 30, account='Revolut') is None
+    trans_id = db.add_transaction(fresh_db, '2024-03-01', 'Expense', 'Food', 30, account='Revolut', currency='EUR')
+    assert trans_id
+    assert not db.update_transaction(fresh_db, trans_id, account='Cash')
+    assert db.update_transaction(fresh_db, trans_id, account='Wise')
+    assert _balance(fresh_db, 'Revolut') == 100
+    assert _balance(fresh_db, 'Wise') == -30
+    assert _balance(fresh_db, 'Cash') == 0
+
+def test_bulk_leaves_out_rows_in_another_currency(fresh_db):
+    db.add_account(fresh_db, 'Revolut', currency='EUR')
+    rows = pd.DataFrame({'date': ['2024-03-01', '2024-03-02'], 'type': 'Expense', 'category': 'Food',
+                         'amount': [10, 20], 'account': 'Revolut', 'currency': ['EUR', None]})
+    inserted, skipped = db.add_transactions_bulk(fresh_db, rows, return_skipped=True)
+    assert inserted == 1
+    assert skipped['amount'].tolist() == [20]
+    assert _balance(fresh_db, 'Revolut') == -10
+    assert db.reconcile_accounts(fresh_db).empty
+
+def test_repayment_from_foreign_account_is_rejected(fresh_db):
+    db.add_account(fresh_db, 'Revolut', currency='EUR')
+    debt_id = db.add_transaction(fresh_db, '2024-01-05', 'Debt', 'Friends', 100, description='Borrowed from Asha')
+    assert not db.repay_debt(fresh_db, debt_id, 50, 'Revolut', '2024-02-01')
+    assert db.repay_debt(fresh_db, debt_id, 50, 'Cash', '2024-02-01')
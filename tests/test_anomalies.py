@@ -0,0 +1,31 @@
+"""
+Anomaly detection: the scored matrix is reused until the budget_usage counters change.
+"""
+import database as db
+import anomalies
+
+def _spend(user_id: int, months: int = 14):
+    for m in range(months):
+        year, month = 2023 + m // 12, m % 12 + 1
+        db.add_transaction(user_id, f'{year}-{month:02d}-05', 'Expense', 'Groceries', 100 + m % 3)
+
+def test_analysis_is_reused_until_counters_change(fresh_db, query_log):
+    _spend(fresh_db)
+    first = anomalies.analyze(fresh_db)
+    query_log.clear()
+    assert anomalies.analyze(fresh_db) is first
+    assert len(query_log) == 1
+
+    db.add_transaction(fresh_db, '2024-02-06', 'Expense', 'Groceries', 900)
+    second = anomalies.analyze(fresh_db)
+    assert second is not first
+    assert second['values'].sum() == first['values'].sum() + 900
+
+def test_detect_and_heatmap_share_one_analysis(fresh_db, query_log):
+    _spend(fresh_db)
+    analysis = anomalies.analyze(fresh_db)
+    query_log.clear()
+    anomalies.detect_anomalies(fresh_db, analysis=analysis)
+    frame = anomalies.zscore_frame(fresh_db, analysis=analysis)
+    assert len(query_log) == 0
+    assert list(frame.columns) == ['Expense · Groceries']
@@ -0,0 +1,27 @@
+"""
+Year archives: archived rows are flagged in reads and cannot be changed through the hot table.
+"""
+import database as db
+
+def test_archived_rows_are_flagged_and_read_only(fresh_db):
+    old = db.add_transaction(fresh_db, '2023-05-01', 'Expense', 'Groceries', 100, description='Market')
+    new = db.add_transaction(fresh_db, '2024-05-01', 'Expense', 'Groceries', 50, description='Market')
+    assert db.archive_year(fresh_db, 2023) == 1
+
+    rows = db.get_transactions(fresh_db).set_index('id')['archived']
+    assert rows.to_dict() == {old: 1, new: 0}
+    assert not db.update_transaction(fresh_db, old, amount=1)
+    assert not db.delete_transaction(fresh_db, old)
+    assert db.delete_transaction(fresh_db, new)
+    assert db.get_transactions(fresh_db)['amount'].tolist() == [100]
+
+def test_search_finds_archived_rows(fresh_db):
+    old = db.add_transaction(fresh_db, '2023-05-01', 'Income', 'Refund', 40, description='Amazon refund')
+    new = db.add_transaction(fresh_db, '2024-05-01', 'Expense', 'Shopping', 60, description='Amazon order')
+    db.add_transaction(fresh_db, '2023-06-01', 'Expense', 'Groceries', 10, description='Market')
+    assert db.archive_year(fresh_db, 2023) == 2
+
+    found = db.search_transactions(fresh_db, 'amazon').set_index('id')['archived']
+    assert found.to_dict() == {old: 1, new: 0}
+    assert db.search_transactions(fresh_db, 'amazon', trans_type='Income')['id'].tolist() == [old]
+    assert db.search_transactions(fresh_db, 'refu')['description'].tolist() == ['Amazon refund']
@@ -0,0 +1,21 @@
+"""
+Chart builders: long series are downsampled but still drawn with WebGL.
+"""
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+import chart_utils as charts
+
+def _series(n: int) -> pd.DataFrame:
+    return pd.DataFrame({'day': pd.date_range('2015-01-01', periods=n), 'total': np.sin(np.arange(n))})
+
+def test_long_series_is_downsampled_and_drawn_with_webgl():
+    fig = charts.build_line_with_labels(_series(2000), x='day', y='total')
+    assert isinstance(fig.data[0], go.Scattergl)
+    assert len(fig.data[0].x) == charts.MAX_SERIES_POINTS
+
+def test_short_series_keeps_svg_traces():
+    fig = charts.build_trend_lines(_series(200).set_index('day'))
+    assert isinstance(fig.data[0], go.Scatter)
+    assert len(fig.data[0].x) == 200
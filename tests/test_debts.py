@@ -0,0 +1,42 @@
+"""
+Debt repayments: deleting one recomputes the debt from the repayments that remain.
+"""
+import database as db
+
+def _debt(user_id: int) -> int:
+    return db.add_transaction(user_id, '2024-01-05', 'Debt', 'Friends', 1000, description='Borrowed from Asha')
+
+def _state(user_id: int, debt_id: int):
+    conn = db.get_connection(user_id)
+    row = conn.execute("SELECT paid_amount, is_repaid, last_payment_at, closed_at FROM transactions WHERE id = ?",
+                       (debt_id,)).fetchone()
+    conn.close()
+    return tuple(row)
+
+def _repayments(user_id: int, debt_id: int) -> list:
+    conn = db.get_connection(user_id)
+    ids = [r[0] for r in conn.execute("SELECT id FROM transactions WHERE linked_id = ? ORDER BY date", (debt_id,))]
+    conn.close()
+    return ids
+
+def test_deleting_final_repayment_reopens_debt(fresh_db):
+    debt_id = _debt(fresh_db)
+    assert db.repay_debt(fresh_db, debt_id, 400, 'Cash', '2024-02-01')
+    assert db.repay_debt(fresh_db, debt_id, 600, 'Cash', '2024-03-01')
+    assert _state(fresh_db, debt_id) == (1000, 1, '2024-03-01', '2024-03-01')
+
+    db.delete_transaction(fresh_db, _repayments(fresh_db, debt_id)[-1])
+    assert _state(fresh_db, debt_id) == (400, 0, '2024-02-01', None)
+
+def test_undo_removes_every_repayment(fresh_db):
+    debt_id = _debt(fresh_db)
+    db.repay_debt(fresh_db, debt_id, 1000, 'Cash', '2024-02-01')
+    db.delete_transaction_by_link(fresh_db, debt_id)
+    assert _state(fresh_db, debt_id) == (0, 0, None, None)
+
+def test_deleting_early_repayment_keeps_loan_closed(fresh_db):
+    loan_id = db.add_transaction(fresh_db, '2024-01-05', 'Debt', 'Loan', 3000, loan_emi=1000, loan_tenure_months=3)
+    for month in (2, 3, 4, 5):
+        assert db.pay_emi(fresh_db, loan_id, 1000, 'Bank', f'2024-0{month}-01')
+    db.delete_transaction(fresh_db, _repayments(fresh_db, loan_id)[0])
+    assert _state(fresh_db, loan_id) == (3000, 1, '2024-05-01', '2024-05-01')
@@ -0,0 +1,45 @@
+"""
+Duplicate detection: only rows of the same type with the same amount and description match.
+"""
+import pandas as pd
+
+import database as db
+
+def test_income_without_description_is_not_a_duplicate_of_an_expense(fresh_db):
+    db.add_transaction(fresh_db, '2024-03-01', 'Expense', 'Groceries', 100)
+    inserted, skipped = db.add_transactions_bulk(
+        fresh_db, [{'date': '2024-03-02', 'type': 'Income', 'category': 'Salary', 'amount': 100}], return_skipped=True)
+    assert (inserted, len(skipped)) == (1, 0)
+
+def test_rows_without_description_never_match(fresh_db):
+    db.add_transaction(fresh_db, '2024-03-01', 'Expense', 'Groceries', 100)
+    assert db.add_transactions_bulk(fresh_db, [{'date': '2024-03-01', 'type': 'Expense', 'category': 'Groceries',
+                                                'amount': 100}]) == 1
+    assert db.find_duplicates(fresh_db, '2024-03-01', 100, None, trans_type='Expense').empty
+
+def test_same_type_amount_and_description_is_skipped_and_returned(fresh_db):
+    db.add_transaction(fresh_db, '2024-03-01', 'Expense', 'Groceries', 100, description='BigBasket order')
+    rows = pd.DataFrame([
+        {'date': '2024-03-02', 'type': 'Expense', 'category': 'Groceries', 'amount': 100, 'description': 'BIGBASKET ORDER'},
+        {'date': '2024-03-02', 'type': 'Income', 'category': 'Other Income', 'amount': 100, 'description': 'BigBasket order'},
+    ])
+    inserted, skipped = db.add_transactions_bulk(fresh_db, rows, return_skipped=True)
+    assert inserted == 1
+    assert skipped['type'].tolist() == ['Expense']
+    assert len(db.find_duplicates(fresh_db, '2024-03-02', 100, 'BigBasket order', trans_type='Expense')) == 1
+    assert db.find_duplicates(fresh_db, '2024-03-02', 100, 'BigBasket order', trans_type='Investment').empty
+
+def test_each_stored_row_absorbs_at_most_one_incoming_row(fresh_db):
+    for day in ('2024-03-01', '2024-03-10'):
+        db.add_transaction(fresh_db, day, 'Expense', 'Food', 5, description='Coffee')
+    rows = pd.DataFrame({'date': ['2024-03-01', '2024-03-02', '2024-03-09', '2024-03-20'], 'type': 'Expense',
+                         'category': 'Food', 'amount': 5, 'description': 'Coffee'})
+    inserted, skipped = db.add_transactions_bulk(fresh_db, rows, return_skipped=True)
+    assert inserted == 2
+    assert sorted(skipped['date'].tolist()) == ['2024-03-01', '2024-03-09']
+
+def test_reimporting_many_rows_with_one_fingerprint_skips_them_all(fresh_db):
+    rows = pd.DataFrame({'date': pd.date_range('2015-01-01', periods=4000).strftime('%Y-%m-%d'), 'type': 'Expense',
+                         'category': 'Food', 'amount': 5, 'description': 'Coffee'})
+    assert db.add_transactions_bulk(fresh_db, rows, skip_duplicates=False) == 4000
+    assert db.add_transactions_bulk(fresh_db, rows) == 0
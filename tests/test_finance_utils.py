@@ -0,0 +1,23 @@
+"""
+Formatting helpers: the vectorized currency formatter matches the scalar one value for value.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import finance_utils as utils
+
+VALUES = [0, 0.4, 0.5, 1.5, 2.5, -0.4, -0.5, 999.5, 1000, -1234567.89, 12345678901, 1e15, 9.2e18,
+          -9.2e18, 9.3e18, 1e19, -1e19, 1e300, np.nan, np.inf, -np.inf, None]
+
+@pytest.mark.parametrize('currency_code', ['INR', 'USD', 'XYZ'])
+def test_series_matches_scalar_formatter(currency_code):
+    expected = [utils.format_currency(v, currency_code) for v in VALUES]
+    assert utils.format_currency_series(pd.Series(VALUES, dtype=object), currency_code).tolist() == expected
+    numeric = [v for v in VALUES if v is not None]
+    assert utils.format_currency_series(np.array(numeric, dtype=float), currency_code).tolist() == \
+        [utils.format_currency(v, currency_code) for v in numeric]
+
+def test_series_keeps_index():
+    values = pd.Series([1500.0, np.nan], index=[7, 3])
+    assert utils.format_currency_series(values).to_dict() == {7: '₹1,500', 3: '₹nan'}
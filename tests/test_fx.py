@@ -0,0 +1,29 @@
+"""
+Currency conversion: rows without a rate count unconverted instead of vanishing from totals.
+"""
+import pandas as pd
+
+import database as db
+
+def _rates():
+    return pd.DataFrame({'date': ['2024-01-01', '2024-01-01'], 'currency': ['INR', 'EUR'], 'rate': [83.0, 0.9]})
+
+def test_foreign_row_without_rate_counts_unconverted(fresh_db):
+    db.add_transaction(fresh_db, '2024-03-01', 'Expense', 'Groceries', 100)
+    db.add_transaction(fresh_db, '2024-03-02', 'Expense', 'Groceries', 20, currency='USD')
+    total = db.aggregate(fresh_db, ('total',), filters={'type': 'Expense'})['total'].iloc[0]
+    assert total == 120
+    converted = db.convert_amounts([100, 20], [None, 'USD'], ['2024-03-01', '2024-03-02'], 'INR')
+    assert converted.tolist() == [100, 20]
+
+def test_foreign_row_with_rate_is_converted(fresh_db):
+    db.save_fx_rates(_rates())
+    db.add_transaction(fresh_db, '2024-03-02', 'Expense', 'Groceries', 20, currency='USD')
+    total = db.aggregate(fresh_db, ('total',), filters={'type': 'Expense'})['total'].iloc[0]
+    assert round(total, 2) == 1660
+
+def test_picker_offers_only_convertible_currencies(fresh_db):
+    assert db.convertible_currencies('INR') == ['INR']
+    db.save_fx_rates(_rates())
+    assert db.convertible_currencies('INR') == ['INR', 'EUR', 'USD']
+    assert db.convertible_currencies('GBP') == ['GBP']
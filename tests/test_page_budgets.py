@@ -0,0 +1,67 @@
+"""
+Per-page wall-time and query-count budgets for app.py.
+
+Every sidebar page is opened through AppTest for the 'large' user and then
+rerun once more, as any widget interaction reruns it. That warm rerun must
+stay within the page's budget of seconds and SQL statements (counted with
+database.add_query_listener). The 'small' user must issue exactly as many
+statements: a count that grows with the data is an N+1 loop, and an
+uncached lookup shows up as extra statements on the warm rerun.
+
+Each rerun currently starts with about 55 statements of db.init_db()
+schema checks, so the budgets are that plus the page's own queries. When a
+change adds a query on purpose, raise its budget in the same commit.
+Wall-time budgets leave room for slow machines and can be scaled with
+INEXO_PAGE_BUDGET_SCALE (e.g. 2 on a loaded CI box).
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+
+import pytest
+
+TIME_SCALE = float(os.environ.get('INEXO_PAGE_BUDGET_SCALE', 1))
+
+# page -> (seconds, SQL statements) for one warm rerun with the 'large' dataset
+PAGE_BUDGETS = {
+    "📊 Dashboard": (3.0, 72),
+    "💼 Portfolio": (3.0, 63),
+    "➕ Add Transaction": (3.0, 60),
+    "🔄 Recurring Items": (3.0, 61),
+    "📋 View Transactions": (3.0, 61),
+    "💸 Debt Views": (3.0, 65),
+    "🏦 Accounts": (3.0, 60),
+    "🏷️ Categories": (3.0, 61),
+    "📈 Analytics": (5.0, 115),
+    "👤 Profile": (3.0, 59),
+    "⚙️ Settings": (3.0, 65),
+}
+
+# Analytics runs all tab bodies on every rerun (tabs switch in the browser), so they share its budget
+ANALYTICS_TABS = ["📊 Overview", "💰 Income & Expense", "📈 Invest & Debt", "💳 Credit Card", "🚗 Vehicle Tracking",
+                  "⚖️ Comparison", "🔮 Forecast", "📺 Subscriptions", "🏠 Rent", "👤 Self Expenses", "🚨 Anomalies"]
+
+def test_every_page_has_a_budget(page_run):
+    run = page_run("📊 Dashboard", 'small')
+    assert set(run.at.sidebar.radio[0].options) == set(PAGE_BUDGETS)
+
+@pytest.mark.parametrize('page', list(PAGE_BUDGETS))
+def test_page_within_budget(page_run, page):
+    seconds, queries = PAGE_BUDGETS[page]
+    run = page_run(page, 'large')
+    assert run.queries <= queries, f"{page}: {run.queries} SQL statements (budget {queries})"
+    assert run.seconds <= seconds * TIME_SCALE, f"{page}: {run.seconds:.2f} s (budget {seconds * TIME_SCALE:.2f} s)"
+
+@pytest.mark.parametrize('page', list(PAGE_BUDGETS))
+def test_page_queries_do_not_grow_with_data(page_run, page):
+    small = page_run(page, 'small').queries
+    large = page_run(page, 'large').queries
+    assert large == small, f"{page}: {small} SQL statements for the small dataset, {large} for the large one"
+
+@pytest.mark.parametrize('tab', ANALYTICS_TABS)
+def test_analytics_tab_renders(page_run, tab):
+    run = page_run("📈 Analytics", 'large')
+    tabs = {t.label: t for t in run.at.tabs}
+    assert tab in tabs, f"missing Analytics tab {tab}"
+    assert len(tabs[tab].children) > 0, f"Analytics tab {tab} rendered nothing"
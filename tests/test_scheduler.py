@@ -0,0 +1,61 @@
+"""
+Recurring scheduler: occurrences are posted once, whatever happens to them later.
+"""
+from datetime import date
+
+import database as db
+import scheduler
+
+def _rent(user_id: int) -> int:
+    return db.add_recurring_item(user_id, 'Rent', 'Expense', 'Rent', 1000, auto_post=1, frequency='monthly',
+                                 day_of_month=1, start_date='2023-07-01', end_date='2023-12-31')
+
+def _lifetime_rows(user_id: int) -> int:
+    conn = db.get_lifetime_connection(user_id)
+    count = conn.execute("SELECT COUNT(*) FROM all_transactions WHERE user_id = ? AND occurrence_key IS NOT NULL",
+                         (user_id,)).fetchone()[0]
+    conn.close()
+    return count
+
+def test_rerun_posts_nothing(fresh_db):
+    _rent(fresh_db)
+    assert scheduler.run_scheduler(fresh_db, today=date(2024, 1, 15)) == {fresh_db: 6}
+    assert scheduler.run_scheduler(fresh_db, today=date(2024, 1, 15)) == {}
+    assert _lifetime_rows(fresh_db) == 6
+
+def test_archived_occurrences_are_not_posted_again(fresh_db):
+    _rent(fresh_db)
+    scheduler.run_scheduler(fresh_db, today=date(2024, 1, 15))
+    assert db.archive_year(fresh_db, 2023) == 6
+
+    assert scheduler.run_scheduler(fresh_db, today=date(2024, 1, 15)) == {}
+    assert _lifetime_rows(fresh_db) == 6
+
+def test_deleted_occurrence_is_not_posted_again(fresh_db):
+    item_id = _rent(fresh_db)
+    scheduler.run_scheduler(fresh_db, today=date(2024, 1, 15))
+    conn = db.get_connection(fresh_db)
+    skipped = conn.execute("SELECT id FROM transactions WHERE occurrence_key = ?",
+                           (scheduler.occurrence_key(item_id, date(2023, 9, 1)),)).fetchone()[0]
+    conn.close()
+    db.delete_transaction(fresh_db, skipped)
+
+    assert scheduler.run_scheduler(fresh_db, today=date(2024, 1, 15)) == {}
+    assert _lifetime_rows(fresh_db) == 5
+
+def test_background_loop_waits_before_first_run(monkeypatch):
+    runs = []
+
+    class Stop(Exception):
+        pass
+
+    def sleep(seconds):
+        raise Stop
+
+    monkeypatch.setattr(scheduler, 'run_scheduler', lambda *args, **kwargs: runs.append(1))
+    monkeypatch.setattr(scheduler.time, 'sleep', sleep)
+    try:
+        scheduler._scheduler_loop(6)
+    except Stop:
+        pass
+    assert runs == []